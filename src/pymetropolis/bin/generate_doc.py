@@ -62,7 +62,7 @@ def build_files_doc() -> str:
     files_steps = defaultdict(list)
     # Iterate over the steps to collect the generated files.
     for step in sorted(STEPS, key=lambda s: s.__name__):
-        for ofile in step.output_files.values():
+        for ofile in step._all_output_files():
             files_steps[ofile].append(step.__name__)
 
     doc = ""
@@ -6,6 +6,7 @@ import typer
 import pymetropolis
 
 from .metro_pipeline import Config, MetroPipeline
+from .metro_pipeline.profile import print_profile
 from .schema import STEPS
 
 
@@ -25,7 +26,20 @@ def app(
         "--step-by-step",
         help="Run steps one at a time, asking for a confirmation between each step.",
     ),
+    profile: bool = typer.Option(
+        False,
+        "--profile",
+        help="Show the slowest and most memory-hungry steps of the previous runs and exit.",
+    ),
     step: Annotated[str | None, typer.Option(help="Explicitly ask for a step to be run.")] = None,
+    jobs: int = typer.Option(
+        1,
+        "--jobs",
+        "-j",
+        min=1,
+        help="Maximum number of steps to run in parallel (steps are run as soon as their input "
+        "files are ready).",
+    ),
     version: Annotated[
         bool | None,
         typer.Option(
@@ -39,5 +53,8 @@ def app(
     """Python command line tool to generate, calibrate, run and analyse a METROPOLIS2 simulation."""
     # TODO command to list available steps
     config = Config.from_toml(config)
+    if profile:
+        print_profile(config.main_directory)
+        return
     pipeline = MetroPipeline(config, STEPS, target_step=step)
-    pipeline.run(dry_run, step_by_step)
+    pipeline.run(dry_run, step_by_step, jobs)
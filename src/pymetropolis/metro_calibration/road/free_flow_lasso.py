@@ -13,6 +13,7 @@ from pymetropolis.metro_calibration.road.files import (
     TomTomRoutesMatchedFile,
 )
 from pymetropolis.metro_common import MetropyError
+from pymetropolis.metro_common.edge_index import EdgeIndex
 from pymetropolis.metro_common.ml_models import compute_lasso
 from pymetropolis.metro_pipeline import Step
 from pymetropolis.metro_pipeline.parameters import ListParameter
@@ -33,15 +34,14 @@ def compute_regression_variables(
     import polars as pl
 
     logger.info("Computing congested time by edge characteristics...")
+    index = EdgeIndex(variables)
+    edges = index.edges
+    paths = index.routes(routes["path"])
     df = routes.select(
         "tomtom_id",
         "path",
         cst=pl.col("path").list.len(),
-        tt_cst=pl.col("path")
-        .list.eval(
-            pl.element().replace_strict(variables["edge_id"], variables["base_free_flow_tt"])
-        )
-        .list.sum(),
+        tt_cst=paths.sum(edges["base_free_flow_tt"]),
     )
     # Check that all variables are available.
     all_vars = (
@@ -61,40 +61,19 @@ def compute_regression_variables(
     for var in additive_variables:
         logger.debug(f"\t{var}...")
         for col in filter(lambda c: c.startswith(var), variables.columns):
-            df = df.with_columns(
-                pl.col("path")
-                .list.eval(pl.element().replace_strict(variables["edge_id"], variables[col]))
-                .list.sum()
-                .alias(col)
-            )
+            df = df.with_columns(paths.sum(edges[col]).alias(col))
     logger.debug("Additive interaction variables...")
     for var1, var2 in additive_interaction_variables:
         logger.debug(f"\t{var1} x {var2}...")
         for col1 in filter(lambda c: c.startswith(var1), variables.columns):
             for col2 in filter(lambda c: c.startswith(var2), variables.columns):
-                df = df.with_columns(
-                    pl.col("path")
-                    .list.eval(
-                        pl.element().replace_strict(variables["edge_id"], variables[col1])
-                        * pl.element().replace_strict(variables["edge_id"], variables[col2])
-                    )
-                    .list.sum()
-                    .alias(f"{col1}_x_{col2}")
-                )
+                df = df.with_columns(paths.sum(edges[col1] * edges[col2]).alias(f"{col1}_x_{col2}"))
     logger.debug("Multiplicative variables...")
     for var in multiplicative_variables:
         logger.debug(f"\t{var}...")
         for col in filter(lambda c: c.startswith(var), variables.columns):
             df = df.with_columns(
-                pl.col("path")
-                .list.eval(
-                    pl.element().replace_strict(variables["edge_id"], variables[col])
-                    * pl.element().replace_strict(
-                        variables["edge_id"], variables["base_free_flow_tt"]
-                    )
-                )
-                .list.sum()
-                .alias(f"tt_{col}")
+                paths.sum(edges[col] * edges["base_free_flow_tt"]).alias(f"tt_{col}")
             )
     logger.debug("Multiplicative interaction variables...")
     for var1, var2 in multiplicative_interaction_variables:
@@ -102,16 +81,9 @@ def compute_regression_variables(
         for col1 in filter(lambda c: c.startswith(var1), variables.columns):
             for col2 in filter(lambda c: c.startswith(var2), variables.columns):
                 df = df.with_columns(
-                    pl.col("path")
-                    .list.eval(
-                        pl.element().replace_strict(variables["edge_id"], variables[col1])
-                        * pl.element().replace_strict(variables["edge_id"], variables[col2])
-                        * pl.element().replace_strict(
-                            variables["edge_id"], variables["base_free_flow_tt"]
-                        )
+                    paths.sum(edges[col1] * edges[col2] * edges["base_free_flow_tt"]).alias(
+                        f"tt_{col1}_x_{col2}"
                     )
-                    .list.sum()
-                    .alias(f"tt_{col1}_x_{col2}")
                 )
     df = df.drop("tomtom_id", "path")
     return df
@@ -1,12 +1,12 @@
+from pymetropolis.common import ThreadedStep
 from pymetropolis.metro_common.routing import compute_all_pairs_dijkstra
 from pymetropolis.metro_common.utils import pl_duration_to_seconds
 from pymetropolis.metro_network.road_network.files import RoadEdgesCleanFile
-from pymetropolis.metro_pipeline import Step
 
 from .files import AllRoadFreeFlowTravelTimesFile, RoadEdgesFreeFlowTravelTimeFile
 
 
-class AllFreeFlowTravelTimesStep(Step):
+class AllFreeFlowTravelTimesStep(ThreadedStep):
     """Computes travel time of the fastest path under (car) free-flow conditions, for all node pairs
     of the road network.
     """
@@ -24,6 +24,8 @@ class AllFreeFlowTravelTimesStep(Step):
         edges = edges.join(edges_fftt, on="edge_id").select(
             "source", "target", weight=pl_duration_to_seconds("free_flow_travel_time")
         )
-        df = compute_all_pairs_dijkstra(edges)
-        df = df.with_columns(free_flow_travel_time=pl.duration(seconds="weight")).drop("weight")
-        self.output["all_free_flow_travel_times"].write(df)
+        batches = compute_all_pairs_dijkstra(edges, nb_threads=self.nb_threads)
+        self.output["all_free_flow_travel_times"].write_batches(
+            df.with_columns(free_flow_travel_time=pl.duration(seconds="weight")).drop("weight")
+            for df in batches
+        )
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    import numpy as np
+    from shapely.geometry import MultiPolygon, Polygon
+
+# Maximum number of vertices of a tile of the area (larger areas are split in four quadrants).
+MAX_TILE_VERTICES = 256
+# Maximum depth of the quadtree subdivision of the area.
+MAX_TILE_DEPTH = 16
+
+
+class AreaFilter:
+    """Spatial filter testing many geometries against a (Multi)Polygon area.
+
+    Testing geometries against a large area (e.g., the boundary of a region, with thousands of
+    vertices) one by one is slow.
+    The area is thus split in small, prepared tiles and the geometries are indexed by an
+    STRtree, so that each geometry is only tested against the few tiles whose bounding box
+    intersects its own, with vectorized predicates.
+
+    The tiles are split between `nb_threads` threads (default is to use all the available CPUs).
+    Each tile is used by a single thread because GEOS' prepared geometries cannot be used
+    concurrently.
+    The geometries must be in the same CRS as the area.
+    """
+
+    def __init__(self, area: Polygon | MultiPolygon, nb_threads: int | None = None):
+        import shapely
+
+        self.area = area
+        self.nb_threads = nb_threads
+        self.tiles = split_area(area)
+        shapely.prepare(self.tiles)
+
+    def intersects(self, geoms: np.ndarray) -> np.ndarray:
+        """Returns a boolean mask of the geometries which intersect the area."""
+        import numpy as np
+        import shapely
+
+        geoms = np.asarray(geoms)
+        tile_idx, geom_idx = self._candidates(geoms)
+        # The tiles cover exactly the area so a geometry intersects the area if and only if it
+        # intersects one of the tiles.
+        mask = np.zeros(len(geoms), dtype=bool)
+        mask[geom_idx[self._test(shapely.intersects, geoms, tile_idx, geom_idx)]] = True
+        return mask
+
+    def contains(self, geoms: np.ndarray) -> np.ndarray:
+        """Returns a boolean mask of the geometries which are contained in the area."""
+        import numpy as np
+        import shapely
+
+        geoms = np.asarray(geoms)
+        tile_idx, geom_idx = self._candidates(geoms)
+        # A geometry contained in one of the tiles is contained in the area.
+        mask = np.zeros(len(geoms), dtype=bool)
+        mask[geom_idx[self._test(shapely.contains, geoms, tile_idx, geom_idx)]] = True
+        # A geometry which is not contained in any tile can still be contained in the area if it
+        # spans several tiles: these geometries are tested against the full area.
+        candidates = np.flatnonzero((np.bincount(geom_idx, minlength=len(geoms)) > 1) & ~mask)
+        if len(candidates):
+            shapely.prepare(self.area)
+            mask[candidates] = shapely.contains(self.area, geoms[candidates])
+        return mask
+
+    def _candidates(self, geoms: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the indices of the (tile, geometry) pairs with intersecting bounding boxes,
+        sorted by tile."""
+        import shapely
+
+        return shapely.STRtree(geoms).query(self.tiles)
+
+    def _test(
+        self,
+        predicate: Callable[[np.ndarray, np.ndarray], np.ndarray],
+        geoms: np.ndarray,
+        tile_idx: np.ndarray,
+        geom_idx: np.ndarray,
+    ) -> np.ndarray:
+        """Evaluates the predicate on each (tile, geometry) pair, in parallel blocks of tiles."""
+        import os
+        from concurrent.futures import ThreadPoolExecutor
+        from itertools import pairwise
+
+        import numpy as np
+
+        nb_workers = self.nb_threads or os.cpu_count() or 1
+        if nb_workers == 1 or len(tile_idx) == 0:
+            return predicate(self.tiles[tile_idx], geoms[geom_idx])
+        # Blocks have approximately the same number of pairs, and all the pairs of a tile are in
+        # the same block.
+        splits = np.linspace(0, len(tile_idx), nb_workers + 1, dtype=np.int64)[1:-1]
+        bounds = np.unique(
+            np.concatenate(([0], np.searchsorted(tile_idx, tile_idx[splits]), [len(tile_idx)]))
+        )
+        blocks = [slice(a, b) for a, b in pairwise(bounds)]
+        if len(blocks) <= 1:
+            return predicate(self.tiles[tile_idx], geoms[geom_idx])
+
+        def run(block: slice) -> np.ndarray:
+            return predicate(self.tiles[tile_idx[block]], geoms[geom_idx[block]])
+
+        with ThreadPoolExecutor(max_workers=nb_workers) as executor:
+            return np.concatenate(list(executor.map(run, blocks)))
+
+
+def split_area(area: Polygon | MultiPolygon) -> np.ndarray:
+    """Splits a (Multi)Polygon in Polygon tiles with at most (approximately) `MAX_TILE_VERTICES`
+    vertices each.
+
+    The tiles are built by a recursive quadtree subdivision: the polygons with too many vertices
+    are split in four quadrants of their bounding box, so that each level only clips the geometry
+    already inside its parent tile.
+    The tiles cover exactly the area (only the polygonal parts of the clipped geometries are
+    kept).
+    """
+    import numpy as np
+    import shapely
+
+    tiles = list()
+    pending = shapely.get_parts(area)
+    for _ in range(MAX_TILE_DEPTH):
+        pending = pending[shapely.get_type_id(pending) == shapely.GeometryType.POLYGON]
+        is_small = shapely.get_num_coordinates(pending) <= MAX_TILE_VERTICES
+        tiles.append(pending[is_small])
+        pending = pending[~is_small]
+        if len(pending) == 0:
+            break
+        minx, miny, maxx, maxy = shapely.bounds(pending).T
+        midx = (minx + maxx) / 2
+        midy = (miny + maxy) / 2
+        quadrants = shapely.box(
+            np.concatenate((minx, midx, minx, midx)),
+            np.concatenate((miny, miny, midy, midy)),
+            np.concatenate((midx, maxx, midx, maxx)),
+            np.concatenate((midy, midy, maxy, maxy)),
+        )
+        pending = shapely.get_parts(shapely.intersection(np.tile(pending, 4), quadrants))
+    else:
+        # The maximum depth is reached: the remaining polygons are kept as they are.
+        tiles.append(pending[shapely.get_type_id(pending) == shapely.GeometryType.POLYGON])
+    return np.concatenate(tiles)
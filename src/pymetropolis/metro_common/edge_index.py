@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from .errors import MetropyError
+
+if TYPE_CHECKING:
+    import numpy as np
+    import polars as pl
+
+# Index value used for edge ids which are not in the index.
+MISSING = (1 << 32) - 1
+
+
+class EdgeIndex:
+    """Dense index of the edges of a network.
+
+    Edge ids are mapped once to dense `UInt32` indices so that the attributes of the edges along
+    routes can be gathered by array indexing, instead of hashing the edge ids of each route.
+
+    The DataFrame `edges` must have a column `edge_id` (with unique values) and any number of
+    attribute columns.
+    The attributes are available, in index order, in the `edges` attribute.
+    """
+
+    def __init__(self, edges: pl.DataFrame):
+        import numpy as np
+
+        self.edges = edges.sort("edge_id")
+        ids = self.edges["edge_id"]
+        if ids.is_duplicated().any():
+            raise MetropyError("Edge ids must be unique")
+        self._ids = ids.to_numpy()
+        self._lookup = None
+        self._offset = 0
+        if ids.dtype.is_integer() and len(ids):
+            lo, hi = int(self._ids[0]), int(self._ids[-1])
+            if hi - lo < 4 * len(ids):
+                # The ids are dense enough: use a lookup table instead of a binary search.
+                self._lookup = np.full(hi - lo + 1, MISSING, dtype=np.uint32)
+                self._lookup[self._ids - lo] = np.arange(len(ids), dtype=np.uint32)
+                self._offset = lo
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def index(self, edge_ids: np.ndarray) -> np.ndarray:
+        """Returns the dense index of each edge id.
+
+        Raises a MetropyError if some edge ids are not in the index.
+        """
+        import numpy as np
+
+        if self._lookup is not None:
+            pos = edge_ids.astype(np.int64) - self._offset
+            valid = (pos >= 0) & (pos < len(self._lookup))
+            idx = np.full(len(edge_ids), MISSING, dtype=np.uint32)
+            idx[valid] = self._lookup[pos[valid]]
+        else:
+            idx = np.searchsorted(self._ids, edge_ids).astype(np.uint32)
+            found = idx < len(self._ids)
+            found[found] = self._ids[idx[found]] == edge_ids[found]
+            idx[~found] = MISSING
+        missing = idx == MISSING
+        if missing.any():
+            raise MetropyError(
+                f"{missing.sum():,} edge ids are not in the edge index, e.g., "
+                f"{edge_ids[missing][0]}"
+            )
+        return idx
+
+    def gather(self, edge_ids: pl.Series, column: str) -> pl.Series:
+        """Returns the value of attribute `column` for each (non-null) edge id."""
+        return self.edges[column].gather(self.index(edge_ids.to_numpy())).alias(column)
+
+    def routes(self, routes: pl.Series) -> IndexedRoutes:
+        """Returns the routes (lists of edge ids) as lists of dense edge indices."""
+        import polars as pl
+
+        flat = routes.explode(empty_as_null=False, keep_nulls=False)
+        if flat.null_count():
+            raise MetropyError("Routes cannot have NULL edge ids")
+        return IndexedRoutes(
+            self.index(flat.to_numpy()),
+            routes.list.len().fill_null(0).cast(pl.Int64).to_numpy(),
+            routes.is_null().to_numpy(),
+        )
+
+
+class IndexedRoutes:
+    """Routes stored as a flat array of dense edge indices, with the number of edges of each
+    route."""
+
+    def __init__(self, indices: np.ndarray, lengths: np.ndarray, is_null: np.ndarray):
+        import numpy as np
+
+        self.indices = indices
+        self.lengths = lengths
+        self.is_null = is_null
+        # Index of the route of each element of `indices`.
+        self._parents = np.repeat(np.arange(len(lengths)), lengths)
+        self._ends = np.cumsum(lengths)
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def sum(self, values: pl.Series) -> pl.Series:
+        """Returns the sum of the edges' values along each route.
+
+        The Series `values` must have one value for each edge of the index, in index order (e.g.,
+        a column of `EdgeIndex.edges`).
+        NULL values count as zero and NULL routes have a NULL sum.
+        The sums have the same data type as a polars sum of `values` (e.g., `UInt32` for booleans).
+        """
+        import numpy as np
+        import polars as pl
+
+        dtype = (
+            pl.LazyFrame(schema={"values": values.dtype})
+            .select(pl.col("values").sum())
+            .collect_schema()["values"]
+        )
+        if values.dtype == pl.Boolean:
+            values = values.cast(pl.UInt32)
+        physical = values.to_physical().fill_null(0).to_numpy()
+        gathered = physical[self.indices]
+        if np.issubdtype(gathered.dtype, np.floating):
+            sums = np.bincount(self._parents, weights=gathered, minlength=len(self))
+        else:
+            # Integer sums are computed exactly from the cumulative sum.
+            cumsum = np.concatenate(([0], np.cumsum(gathered, dtype=np.int64)))
+            sums = cumsum[self._ends] - cumsum[self._ends - self.lengths]
+        s = pl.Series(values.name, sums).cast(dtype)
+        if self.is_null.any():
+            s = pl.select(pl.when(pl.Series(self.is_null)).then(None).otherwise(s)).to_series()
+        return s
@@ -15,7 +15,12 @@ def detect_csv_delimiter(filename: Path) -> str:
 
 
 def scan_dataframe(filename: Path, **kwargs):
-    """Scan a DataFrame from a Parquet or CSV file."""
+    """Scan a DataFrame from a Parquet or CSV file.
+
+    Parquet files are scanned lazily so that only the selected columns and the row groups matching
+    the filters are read.
+    Parquet files that cannot be scanned by polars are read eagerly with pyarrow instead.
+    """
     import polars as pl
 
     if pl.get_extension_type("geoarrow.wkb") is None:
@@ -25,9 +30,16 @@ def scan_dataframe(filename: Path, **kwargs):
 
     if not filename.exists():
         raise MetropyError(f"File not found: `{filename}`")
-    if filename.suffix == ".parquet" or filename.suffix == ".geoparquet":
-        lf = pl.read_parquet(filename, use_pyarrow=True, **kwargs).lazy()
-    elif filename.suffix == ".csv":
+    suffix = filename.suffix
+    if suffix == ".parquet" or suffix == ".geoparquet":
+        try:
+            lf = pl.scan_parquet(filename, **kwargs)
+            # Read the schema now so that unsupported files are detected early.
+            lf.collect_schema()
+        except Exception as e:
+            logger.debug(f"Cannot scan `{filename}` with polars, reading it with pyarrow ({e})")
+            lf = pl.read_parquet(filename, use_pyarrow=True, **kwargs).lazy()
+    elif suffix == ".csv":
         sep = detect_csv_delimiter(filename)
         lf = pl.scan_csv(filename, separator=sep, **kwargs)
     else:
@@ -36,18 +48,19 @@ def scan_dataframe(filename: Path, **kwargs):
 
 
 def read_dataframe(filename: Path, columns=None, **kwargs):
-    """Reads a DataFrame from a Parquet or CSV file."""
-    from polars.exceptions import ColumnNotFoundError
+    """Reads a DataFrame from a Parquet or CSV file.
 
+    Only the given `columns` are read (if any): they are pushed down to the scan so that the peak
+    memory usage depends on the selected data rather than on the size of the file.
+    """
     lf = scan_dataframe(filename, **kwargs)
     if columns is not None:
-        try:
-            lf = lf.select(columns)
-        except ColumnNotFoundError:
-            cols = lf.collect_schema().columns
-            missing_cols = set(columns).difference(set(cols))
+        cols = lf.collect_schema().names()
+        missing_cols = [c for c in columns if c not in cols]
+        if missing_cols:
             missing_cols_str = ", ".join(map(lambda c: f"`{c}`", missing_cols))
             raise MetropyError(f"Columns {missing_cols_str} are missing from file `{filename}`")
+        lf = lf.select(columns)
     return lf.collect()
 
 
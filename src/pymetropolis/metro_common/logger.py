@@ -1,12 +1,13 @@
 import sys
+from typing import Any
 
 from loguru import logger
 
 
-def setup():
+def setup(sink: Any = sys.stdout):
     logger.remove()
     logger.add(
-        sys.stdout,
+        sink,
         format=(
             "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> |"
             " <level>{message}</level>"
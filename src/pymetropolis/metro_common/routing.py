@@ -1,25 +1,103 @@
 from __future__ import annotations
 
+from collections import deque
+from collections.abc import Iterator
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
+    import numpy as np
     import polars as pl
+    from scipy.sparse import csr_matrix
 
+# Maximum number of distances computed at once by a worker (the dense distance matrix of a block of
+# origins has `block_size * nb_nodes` values).
+MAX_BLOCK_VALUES = 1 << 24
 
-def compute_all_pairs_dijkstra(edges: pl.DataFrame) -> pl.DataFrame:
-    import networkx as nx
+# State of the worker processes (set by `_init_worker`).
+_WORKER_STATE: dict[str, csr_matrix] = dict()
+
+
+def compute_all_pairs_dijkstra(
+    edges: pl.DataFrame, nb_threads: int | None = None, block_size: int | None = None
+) -> Iterator[pl.DataFrame]:
+    """Computes the shortest-path weight between all pairs of nodes.
+
+    The DataFrame `edges` must have columns `source`, `target` and `weight`.
+
+    Yields DataFrames with columns `origin_id`, `destination_id` and `weight`, one for each block
+    of `block_size` origins, so that the results can be written without being stored entirely in
+    memory.
+    Pairs of nodes which are not connected are not returned.
+
+    The blocks are computed in parallel, on `nb_threads` processes (default is to use all the
+    available CPUs).
+    """
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+
+    import numpy as np
     import polars as pl
+    from scipy.sparse import csr_matrix
 
     dtype = edges["source"].dtype
-    G = nx.DiGraph()
-    G.add_weighted_edges_from(edges.iter_rows(), weight="weight")
-    ods = list()
-    for origin, data in nx.all_pairs_dijkstra_path_length(G, weight="weight"):
-        for destination, weight in data.items():
-            ods.append((origin, destination, weight))
-    df = pl.DataFrame(
-        ods,
-        orient="row",
-        schema={"origin_id": dtype, "destination_id": dtype, "weight": pl.Float64},
+    # Parallel edges are removed, keeping only the minimum-weight edge (the CSR matrix would sum
+    # their weights otherwise).
+    edges = edges.group_by("source", "target").agg(pl.col("weight").min())
+    # Map node ids to contiguous indices.
+    nodes = pl.concat((edges["source"], edges["target"])).unique().sort()
+    n = len(nodes)
+    if n == 0:
+        yield pl.DataFrame(
+            schema={"origin_id": dtype, "destination_id": dtype, "weight": pl.Float64}
+        )
+        return
+    sources = nodes.search_sorted(edges["source"]).to_numpy()
+    targets = nodes.search_sorted(edges["target"]).to_numpy()
+    weights = edges["weight"].cast(pl.Float64).to_numpy()
+    # Note. Explicit zeros are kept as zero-weight edges by scipy's csgraph.
+    graph = csr_matrix((weights, (sources, targets)), shape=(n, n))
+    if block_size is None:
+        block_size = max(1, MAX_BLOCK_VALUES // n)
+    blocks = (np.arange(i, min(i + block_size, n)) for i in range(0, n, block_size))
+    nb_workers = nb_threads or os.cpu_count() or 1
+    with ProcessPoolExecutor(
+        max_workers=nb_workers, initializer=_init_worker, initargs=(graph,)
+    ) as executor:
+        # At most two blocks per worker are computed in advance to bound memory usage.
+        futures = deque()
+        for block in blocks:
+            futures.append(executor.submit(_dijkstra_block, block))
+            if len(futures) >= 2 * nb_workers:
+                yield _block_to_dataframe(futures.popleft().result(), nodes, dtype)
+        while futures:
+            yield _block_to_dataframe(futures.popleft().result(), nodes, dtype)
+
+
+def _init_worker(graph: csr_matrix):
+    _WORKER_STATE["graph"] = graph
+
+
+def _dijkstra_block(origins: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Runs Dijkstra from a block of origins and returns the origin indices, destination indices
+    and weights of the reachable pairs."""
+    import numpy as np
+    from scipy.sparse.csgraph import dijkstra
+
+    dist = dijkstra(_WORKER_STATE["graph"], directed=True, indices=origins)
+    rows, cols = np.nonzero(np.isfinite(dist))
+    return origins[rows], cols, dist[rows, cols]
+
+
+def _block_to_dataframe(
+    block: tuple[np.ndarray, np.ndarray, np.ndarray], nodes: pl.Series, dtype: pl.DataType
+) -> pl.DataFrame:
+    import polars as pl
+
+    origins, destinations, weights = block
+    return pl.DataFrame(
+        {
+            "origin_id": nodes.gather(origins).cast(dtype),
+            "destination_id": nodes.gather(destinations).cast(dtype),
+            "weight": pl.Series(weights, dtype=pl.Float64),
+        }
     )
-    return df
@@ -78,12 +78,11 @@ class PopulationFromTripCoordinatesStep(GeoStep):
 
         assert self.trip_coordinates_file is not None
 
-        df = read_dataframe(self.trip_coordinates_file)
-        for col in ("trip_id", "origin_lng", "origin_lat", "destination_lng", "destination_lat"):
-            if col not in df.columns:
-                raise MetropyError(
-                    f"Missing column `{col}` in input file `{self.trip_coordinates_file}`."
-                )
+        # Only the required columns are read from the file.
+        df = read_dataframe(
+            self.trip_coordinates_file,
+            columns=["trip_id", "origin_lng", "origin_lat", "destination_lng", "destination_lat"],
+        )
         if df["trip_id"].n_unique() != len(df):
             raise MetropyError("Trip ids must be unique.")
         origins = gpd.GeoSeries.from_xy(df["origin_lng"], df["origin_lat"], crs="EPSG:4326")
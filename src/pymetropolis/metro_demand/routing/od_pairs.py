@@ -4,6 +4,7 @@ from typing import TYPE_CHECKING
 
 from loguru import logger
 
+from pymetropolis.common import ThreadedStep
 from pymetropolis.metro_demand.population.files import TripsDestinationsFile, TripsOriginsFile
 from pymetropolis.metro_network.bicycle_network.files import BicycleEdgesCleanFile
 from pymetropolis.metro_network.pedestrian_network.files import PedestrianEdgesCleanFile
@@ -16,26 +17,29 @@ from .files import TripsBicycleNodesFile, TripsPedestrianNodesFile, TripsRoadNod
 
 if TYPE_CHECKING:
     import geopandas as gpd
+    import numpy as np
     import polars as pl
 
+# Number of points snapped at once by a thread.
+SNAPPING_CHUNK_SIZE = 500_000
+
 
 def identify_od_pairs(
-    edges: gpd.GeoDataFrame, origins_gdf: gpd.GeoDataFrame, destinations_gdf: gpd.GeoDataFrame
+    edges: gpd.GeoDataFrame,
+    origins_gdf: gpd.GeoDataFrame,
+    destinations_gdf: gpd.GeoDataFrame,
+    nb_threads: int | None = None,
 ) -> pl.DataFrame:
     """Identify the origin and destination network node from origin / destination coordinates."""
     import polars as pl
-    from shapely.geometry import Point
 
     assert len(origins_gdf) == len(destinations_gdf)
-    # Create source / target point of the edges.
-    logger.debug("Creating source / target points")
-    # TODO: Speed-up this with duckdb
-    edges["source_point"] = edges["geometry"].apply(lambda g: Point(g.coords[0]))
-    edges["target_point"] = edges["geometry"].apply(lambda g: Point(g.coords[-1]))
+    logger.debug("Building spatial index of the edges")
+    snapper = EdgeSnapper(edges)
     logger.debug("Identifying nearest nodes for origins")
-    origins = identify_nodes(edges, origins_gdf)
+    origins = snapper.snap(origins_gdf, nb_threads)
     logger.debug("Identifying nearest nodes for destinations")
-    destinations = identify_nodes(edges, destinations_gdf)
+    destinations = snapper.snap(destinations_gdf, nb_threads)
     origins = origins.select("trip_id", pl.all().exclude("trip_id").name.prefix("origin_"))
     destinations = destinations.select(
         "trip_id", pl.all().exclude("trip_id").name.prefix("destination_")
@@ -45,44 +49,90 @@ def identify_od_pairs(
     return df
 
 
-def identify_nodes(edges: gpd.GeoDataFrame, nodes_gdf: gpd.GeoDataFrame) -> pl.DataFrame:
-    """Identify the closest edge for each node in a list."""
-    import polars as pl
+class EdgeSnapper:
+    """Finds the nearest edge and node of a network for many points.
 
-    assert edges.crs == nodes_gdf.crs, "Mis-matched CRS between edges and nodes"
-    # Match to the nearest edge.
-    nodes_gdf = nodes_gdf.sjoin_nearest(
-        edges[["edge_id", "geometry", "source", "target", "source_point", "target_point"]],
-        distance_col="edge_dist",
-        how="left",
-    )
-    # Duplicate indices occur when there are two edges at the same distance.
-    nodes_gdf.drop_duplicates(subset=["trip_id"], inplace=True)
-    # Compute distance to the source / target node of nearest edge.
-    nodes_gdf["source_dist"] = nodes_gdf["geometry"].distance(nodes_gdf["source_point"])
-    nodes_gdf["target_dist"] = nodes_gdf["geometry"].distance(nodes_gdf["target_point"])
-    # Set the nearest node.
-    nodes = pl.from_pandas(
-        nodes_gdf.loc[
-            :, ["trip_id", "edge_id", "edge_dist", "source", "target", "source_dist", "target_dist"]
-        ]
-    )
-    mask = pl.col("source_dist") > pl.col("target_dist")
-    nodes = nodes.with_columns(
-        node=pl.when(mask).then("target").otherwise("source"),
-        node_dist=pl.when(mask).then("target_dist").otherwise("source_dist"),
-    )
-    # Compute the projected node dist on edge from Pythagorean Theorem.
-    nodes = nodes.with_columns(
-        node_dist_on_edge=(pl.col("node_dist") ** 2 - pl.col("edge_dist") ** 2).sqrt()
-    )
-    nodes = nodes.select(
-        "trip_id", "node", "node_dist", "node_dist_on_edge", "edge_dist", edge="edge_id"
-    )
-    return nodes
+    The spatial index of the edges and their source / target points are built only once so that
+    the same snapper can be used for the origins and the destinations.
+    Points are processed in chunks of `SNAPPING_CHUNK_SIZE` points, on parallel threads (shapely
+    releases the GIL).
+    """
+
+    def __init__(self, edges: gpd.GeoDataFrame):
+        import shapely
+
+        self.crs = edges.crs
+        self.geometries = edges.geometry.to_numpy()
+        self.tree = shapely.STRtree(self.geometries)
+        self.source_points = shapely.get_point(self.geometries, 0)
+        self.target_points = shapely.get_point(self.geometries, -1)
+        self.edge_ids = edges["edge_id"].to_numpy()
+        self.sources = edges["source"].to_numpy()
+        self.targets = edges["target"].to_numpy()
+
+    def snap(self, nodes_gdf: gpd.GeoDataFrame, nb_threads: int | None = None) -> pl.DataFrame:
+        """Identify the closest edge and node for each point.
+
+        Returns a DataFrame with columns `trip_id`, `node`, `node_dist`, `node_dist_on_edge`,
+        `edge_dist` and `edge`.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        import polars as pl
+
+        assert self.crs == nodes_gdf.crs, "Mis-matched CRS between edges and nodes"
+        points = nodes_gdf.geometry.to_numpy()
+        # The first chunk is always snapped (even if empty) so that the DataFrame has a schema.
+        chunks = (
+            points[i : i + SNAPPING_CHUNK_SIZE]
+            for i in range(0, max(len(points), 1), SNAPPING_CHUNK_SIZE)
+        )
+        with ThreadPoolExecutor(max_workers=nb_threads) as executor:
+            nodes = pl.concat(executor.map(self._snap_chunk, chunks), how="vertical")
+        nodes = nodes.with_columns(trip_id=pl.Series(nodes_gdf["trip_id"].to_numpy()))
+        # Compute the projected node dist on edge from Pythagorean Theorem.
+        nodes = nodes.with_columns(
+            node_dist_on_edge=(pl.col("node_dist") ** 2 - pl.col("edge_dist") ** 2).sqrt()
+        )
+        return nodes.select(
+            "trip_id", "node", "node_dist", "node_dist_on_edge", "edge_dist", "edge"
+        )
+
+    def _snap_chunk(self, points: np.ndarray) -> pl.DataFrame:
+        import numpy as np
+        import polars as pl
+        import shapely
+
+        # Match to the nearest edge (only one edge is kept when two edges are at the same
+        # distance).
+        (point_idx, edge_idx), edge_dist = self.tree.query_nearest(
+            points, return_distance=True, all_matches=False
+        )
+        matched_points = points[point_idx]
+        # Compute distance to the source / target node of nearest edge.
+        source_dist = shapely.distance(matched_points, self.source_points[edge_idx])
+        target_dist = shapely.distance(matched_points, self.target_points[edge_idx])
+        # Set the nearest node.
+        mask = source_dist > target_dist
+        df = pl.DataFrame(
+            {
+                "node": np.where(mask, self.targets[edge_idx], self.sources[edge_idx]),
+                "node_dist": np.where(mask, target_dist, source_dist),
+                "edge_dist": edge_dist,
+                "edge": self.edge_ids[edge_idx],
+            }
+        )
+        if len(point_idx) < len(points):
+            # Points with empty geometries are not matched.
+            df = (
+                pl.DataFrame({"idx": np.arange(len(points))})
+                .join(df.with_columns(idx=point_idx), on="idx", how="left", maintain_order="left")
+                .drop("idx")
+            )
+        return df
 
 
-class PedestrianODNodesFromCoordinatesStep(GeoStep):
+class PedestrianODNodesFromCoordinatesStep(GeoStep, ThreadedStep):
     """Identifies nodes on the pedestrian network to be used as origins and destinations of the
     trips.
 
@@ -120,7 +170,7 @@ class PedestrianODNodesFromCoordinatesStep(GeoStep):
         ]
         origins = self.input["origins"].read()
         destinations = self.input["destinations"].read()
-        ods = identify_od_pairs(edges, origins, destinations)
+        ods = identify_od_pairs(edges, origins, destinations, self.nb_threads)
         ods = ods.select(
             pl.all()
             .name.replace("origin_", "origin_pedestrian_")
@@ -129,7 +179,7 @@ class PedestrianODNodesFromCoordinatesStep(GeoStep):
         self.output["ods"].write(ods)
 
 
-class BicycleODNodesFromCoordinatesStep(GeoStep):
+class BicycleODNodesFromCoordinatesStep(GeoStep, ThreadedStep):
     """Identifies nodes on the bicycle network to be used as origins and destinations of the
     trips.
 
@@ -167,7 +217,7 @@ class BicycleODNodesFromCoordinatesStep(GeoStep):
         ]
         origins = self.input["origins"].read()
         destinations = self.input["destinations"].read()
-        ods = identify_od_pairs(edges, origins, destinations)
+        ods = identify_od_pairs(edges, origins, destinations, self.nb_threads)
         ods = ods.select(
             pl.all()
             .name.replace("origin_", "origin_bicycle_")
@@ -176,7 +226,7 @@ class BicycleODNodesFromCoordinatesStep(GeoStep):
         self.output["ods"].write(ods)
 
 
-class RoadODNodesFromCoordinatesStep(GeoStep):
+class RoadODNodesFromCoordinatesStep(GeoStep, ThreadedStep):
     """Identifies nodes on the road network to be used as origins and destinations of the trips.
 
     First, this Step finds the nearest edge to the origin / destination coordinates.
@@ -213,7 +263,7 @@ class RoadODNodesFromCoordinatesStep(GeoStep):
         ]
         origins = self.input["origins"].read()
         destinations = self.input["destinations"].read()
-        ods = identify_od_pairs(edges, origins, destinations)
+        ods = identify_od_pairs(edges, origins, destinations, self.nb_threads)
         ods = ods.select(
             pl.all()
             .name.replace("origin_", "origin_road_")
@@ -1,10 +1,10 @@
 from __future__ import annotations
 
-import math
+import hashlib
+import json
+import os
 import tempfile
-import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import timedelta
 from pathlib import Path
 from typing import TYPE_CHECKING
@@ -23,7 +23,10 @@ from pymetropolis.metro_demand.population.files import (
 )
 from pymetropolis.metro_demand.routing.files import TripsPublicTransitItinerariesFile
 from pymetropolis.metro_network.public_transit import GTFSStep
+from pymetropolis.metro_pipeline.fingerprint import fingerprint
 from pymetropolis.metro_pipeline.parameters import (
+    BoolParameter,
+    DurationParameter,
     EnumParameter,
     FloatParameter,
     IntParameter,
@@ -33,11 +36,51 @@ from pymetropolis.metro_pipeline.parameters import (
 from pymetropolis.metro_pipeline.steps import InputFile
 
 if TYPE_CHECKING:
+    import aiohttp
+    import geopandas as gpd
     import polars as pl
-    import requests
+    from tqdm import tqdm
+
+    from pymetropolis.metro_pipeline import Config
 
 MAX_TRIES = 3
 
+# Number of decimals of the coordinates (in degrees) sent to OpenTripPlanner (about 1 meter).
+COORDINATES_DECIMALS = 5
+
+# Columns identifying an OpenTripPlanner query.
+QUERY_COLUMNS = [
+    "origin_lat",
+    "origin_lng",
+    "destination_lat",
+    "destination_lng",
+    "datetime",
+    "arrive_by",
+]
+
+# Default number of queries in each batch.
+DEFAULT_BATCH_SIZE = 10_000
+
+# Delay before the first retry of a failed request, in seconds (doubled at each retry).
+RETRY_DELAY = 0.5
+
+# Timeout of the requests, in seconds (OpenTripPlanner is asked to answer within 10 seconds).
+REQUEST_TIMEOUT = 60
+
+# Initial number of concurrent requests.
+INITIAL_CONCURRENCY = 4
+
+# The throughput is measured over windows of `WINDOW_FACTOR` times the number of concurrent
+# requests (with at least `MIN_WINDOW` requests).
+WINDOW_FACTOR = 10
+MIN_WINDOW = 50
+
+# Factor by which the number of concurrent requests is increased / decreased.
+LIMIT_FACTOR = 1.25
+
+# Relative change in throughput under which the throughput is considered to be constant.
+THROUGHPUT_TOLERANCE = 0.05
+
 HEADERS = {"Content-Type": "application/json", "OTPTimeout": "10000"}
 
 QUERY = """
@@ -112,17 +155,68 @@ query plan(
 QUERY_ARRIVAL = QUERY.replace("__DATETIME_FIELD__", "latestArrival")
 QUERY_DEPARTURE = QUERY.replace("__DATETIME_FIELD__", "earliestDeparture")
 
-_thread_local = threading.local()
 
+class AdaptiveLimit:
+    """Limit on the number of concurrent requests, tuned from the observed throughput of the
+    server.
 
-def get_session() -> requests.Session:
-    import requests
+    The throughput (number of requests completed per second, i.e., the number of requests in
+    flight divided by their latency) is measured over windows of requests.
+    The limit is increased as long as this significantly increases the throughput and it is
+    decreased as long as this does not decrease the throughput (when the server is saturated,
+    additional requests only increase the latency).
+    The limit is also halved when a request fails.
+    """
 
-    if not hasattr(_thread_local, "session"):
-        session = requests.Session()
-        session.headers.update(HEADERS)
-        _thread_local.session = session
-    return _thread_local.session
+    def __init__(self, maximum: int):
+        import asyncio
+
+        self.maximum = maximum
+        self.limit = min(INITIAL_CONCURRENCY, maximum)
+        self.in_flight = 0
+        self._increasing = True
+        self._throughput: float | None = None
+        self._window_start = time.perf_counter()
+        self._window_count = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def __aexit__(self, *_):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def record(self):
+        """Updates the limit after a successful request."""
+        self._window_count += 1
+        if self._window_count < max(MIN_WINDOW, WINDOW_FACTOR * self.limit):
+            return
+        now = time.perf_counter()
+        throughput = self._window_count / (now - self._window_start)
+        if self._throughput is not None:
+            if self._increasing:
+                self._increasing = throughput > (1 + THROUGHPUT_TOLERANCE) * self._throughput
+            else:
+                self._increasing = throughput < (1 - THROUGHPUT_TOLERANCE) * self._throughput
+        if self._increasing:
+            self.limit = min(self.maximum, max(self.limit + 1, round(self.limit * LIMIT_FACTOR)))
+        else:
+            self.limit = max(1, min(self.limit - 1, round(self.limit / LIMIT_FACTOR)))
+        self._throughput = throughput
+        self._window_start = now
+        self._window_count = 0
+
+    def backoff(self):
+        """Updates the limit after a failed request."""
+        self.limit = max(1, self.limit // 2)
+        self._increasing = True
+        self._throughput = None
+        self._window_start = time.perf_counter()
+        self._window_count = 0
 
 
 def run_queries(
@@ -130,74 +224,153 @@ def run_queries(
     api_url: str,
     parameters: dict,
     batch_size: int | None = None,
-    nb_threads: int | None = None,
+    max_concurrency: int | None = None,
+    cache_directory: Path | None = None,
 ) -> pl.DataFrame:
+    """Returns the least-cost itinerary of each trip.
+
+    The coordinates are rounded to `COORDINATES_DECIMALS` decimals and each unique query (origin,
+    destination, date-time and arrive-by flag) is sent only once.
+    The queries are run in batches of `batch_size` queries, whose results are written as segments
+    of the `cache_directory` (or of a temporary directory if it is `None`).
+    The queries whose results are already in the cache directory are not sent again, so that an
+    interrupted run resumes where it stopped.
+    """
     import polars as pl
 
-    batch_size = batch_size or len(trips)
-    batch_size = max(batch_size, 1)
-    nb_batches = math.ceil(len(trips) / batch_size)
-    if nb_batches == 1:
-        return run_queries_batch(trips, api_url, parameters, nb_threads)
+    if trips.is_empty():
+        raise MetropyError("There is no trip to be routed with OpenTripPlanner")
+    trips = trips.with_columns(
+        pl.col("origin_lat", "origin_lng", "destination_lat", "destination_lng").round(
+            COORDINATES_DECIMALS
+        ),
+        datetime=pl.format("{}T{}+00:00", "date", "time"),
+    ).select("trip_id", *QUERY_COLUMNS)
+    queries = trips.select(QUERY_COLUMNS).unique(maintain_order=True)
+    logger.info(
+        f"{len(trips):,} trips grouped in {len(queries):,} unique queries "
+        f"(compression ratio: {len(trips) / len(queries):.2f})"
+    )
     with tempfile.TemporaryDirectory() as tmp_dir:
-        for i in range(nb_batches):
+        directory = Path(tmp_dir) if cache_directory is None else cache_directory
+        directory.mkdir(parents=True, exist_ok=True)
+        cached = scan_query_cache(directory)
+        if cached is not None:
+            n0 = len(queries)
+            queries = queries.join(
+                cached.select(QUERY_COLUMNS).collect(),
+                on=QUERY_COLUMNS,
+                how="anti",
+                maintain_order="left",
+            )
+            logger.info(f"Results of {n0 - len(queries):,} / {n0:,} queries read from the cache")
+        batch_size = max(batch_size or DEFAULT_BATCH_SIZE, 1)
+        for i in range(0, len(queries), batch_size):
             df = run_queries_batch(
-                trips[i * batch_size : (i + 1) * batch_size], api_url, parameters, nb_threads
+                queries[i : i + batch_size], api_url, parameters, max_concurrency
             )
-            df.write_parquet(Path(tmp_dir) / Path(f"otp_results_{i}.parquet"))
+            write_query_cache_segment(df, directory)
             del df
-        df = pl.concat(
-            (
-                pl.scan_parquet(Path(tmp_dir) / Path(f"otp_results_{i}.parquet"))
-                for i in range(nb_batches)
-            ),
-            how="vertical",
-        ).collect()
+        results = scan_query_cache(directory)
+        assert results is not None
+        df = (
+            trips.lazy()
+            .join(results, on=QUERY_COLUMNS, how="left", maintain_order="left")
+            .drop(QUERY_COLUMNS)
+            .collect()
+        )
     return df
 
 
+def round_coordinates(points: gpd.GeoSeries, rounding: float) -> gpd.GeoSeries:
+    """Rounds the coordinates of the points to the nearest multiple of `rounding` (in the unit of
+    the CRS of the points)."""
+    import geopandas as gpd
+    import numpy as np
+
+    x = np.round(points.x.to_numpy() / rounding) * rounding
+    y = np.round(points.y.to_numpy() / rounding) * rounding
+    return gpd.GeoSeries.from_xy(x, y, index=points.index, crs=points.crs)
+
+
+def query_cache_directory(
+    root: Path, api_url: str, parameters: dict, gtfs_files: list[Path] | None = None
+) -> Path:
+    """Returns the directory, within `root`, of the query cache for the given OpenTripPlanner API,
+    query parameters and GTFS files.
+
+    The directory is keyed by a hash of the URL of the API, of the GraphQL query, of the
+    parameters and of the content of the GTFS files, so that the results of queries with different
+    parameters or on different public-transit networks are never mixed.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(api_url.encode())
+    h.update(QUERY.encode())
+    h.update(json.dumps(parameters, sort_keys=True).encode())
+    for path in gtfs_files or []:
+        h.update(fingerprint(path).encode())
+    return root / h.hexdigest()
+
+
+def scan_query_cache(directory: Path) -> pl.LazyFrame | None:
+    """Returns the results stored in the segments of a query cache directory (or `None` if there
+    is no segment)."""
+    import polars as pl
+
+    if not any(directory.glob("*.parquet")):
+        return None
+    return pl.scan_parquet(directory / "*.parquet").unique(QUERY_COLUMNS, keep="any")
+
+
+def write_query_cache_segment(df: pl.DataFrame, directory: Path):
+    """Writes the results of a batch of queries as a new segment of the query cache directory.
+
+    Segments are never modified: they are written under a temporary name and then renamed, so that
+    an interrupted run never leaves a partially-written segment.
+    """
+    filename = directory / f"{time.time_ns()}-{os.getpid()}.parquet"
+    tmp_filename = filename.with_suffix(".tmp")
+    df.write_parquet(tmp_filename)
+    os.replace(tmp_filename, filename)
+
+
 def run_queries_batch(
-    trips: pl.DataFrame, api_url: str, parameters: dict, nb_threads: int | None = None
+    queries: pl.DataFrame, api_url: str, parameters: dict, max_concurrency: int | None = None
 ) -> pl.DataFrame:
+    """Runs the OpenTripPlanner queries and returns the least-cost itinerary of each query.
+
+    At most `max_concurrency` requests are in flight at the same time (default is the number of
+    CPUs), the actual number being tuned from the observed throughput of the OpenTripPlanner
+    server.
+    """
+    import asyncio
+
     import polars as pl
-    from tqdm import tqdm
 
-    logger.debug("Running new batch")
+    logger.debug(f"Running new batch of {len(queries):,} queries")
     t0 = time.time()
-    with ThreadPoolExecutor(max_workers=nb_threads) as executor:
-        futures = [
-            executor.submit(get_least_cost_itinerary, row, api_url, parameters)
-            for row in trips.iter_rows(named=True)
-        ]
-        results = []
-        for future in tqdm(
-            as_completed(futures), total=len(futures), desc="Processing batch", smoothing=0.01
-        ):
-            results.append(future.result())
-    df = pl.from_records(
-        results,
-        orient="row",
-        schema=[
-            ("trip_id", trips.schema["trip_id"]),
-            ("travel_time", pl.Float64),
-            ("generalized_time", pl.Float64),
-            ("waiting_time", pl.Float64),
-            (
-                "legs",
-                pl.List(
-                    pl.Struct(
-                        [
-                            pl.Field("mode", pl.String),
-                            pl.Field("travel_time", pl.Float64),
-                            pl.Field("route_id", pl.String),
-                            pl.Field("from_stop_id", pl.String),
-                            pl.Field("to_stop_id", pl.String),
-                        ]
-                    )
-                ),
+    max_concurrency = max_concurrency or os.cpu_count() or 1
+    results = asyncio.run(query_itineraries(queries, api_url, parameters, max_concurrency))
+    df = pl.DataFrame(
+        {**queries.select(QUERY_COLUMNS).to_dict(), **results},
+        schema={
+            **queries.select(QUERY_COLUMNS).schema,
+            "travel_time": pl.Float64,
+            "generalized_time": pl.Float64,
+            "waiting_time": pl.Float64,
+            "legs": pl.List(
+                pl.Struct(
+                    [
+                        pl.Field("mode", pl.String),
+                        pl.Field("travel_time", pl.Float64),
+                        pl.Field("route_id", pl.String),
+                        pl.Field("from_stop_id", pl.String),
+                        pl.Field("to_stop_id", pl.String),
+                    ]
+                )
             ),
-            ("query_time", pl.Float64),
-        ],
+            "query_time": pl.Float64,
+        },
     )
     tot_query_time = timedelta(seconds=float(df["query_time"].sum()))
     tot_time = timedelta(seconds=time.time() - t0)
@@ -216,51 +389,122 @@ def run_queries_batch(
     return df
 
 
-def get_least_cost_itinerary(row: dict, api_url: str, parameters: dict, nb_tries: int = 0):
-    from requests.exceptions import RequestException
+async def query_itineraries(
+    trips: pl.DataFrame, api_url: str, parameters: dict, max_concurrency: int
+) -> dict[str, list]:
+    """Sends the OpenTripPlanner requests of the trips with an adaptive number of in-flight
+    requests, over a pool of keep-alive connections.
 
-    variables = {
-        **parameters,
-        "datetime": f"{row['date']}T{row['time']}+00:00",
-        "originLat": row["origin_lat"],
-        "originLng": row["origin_lng"],
-        "destinationLat": row["destination_lat"],
-        "destinationLng": row["destination_lng"],
-    }
-    if row["arrive_by"]:
-        query = QUERY_ARRIVAL
-    else:
-        query = QUERY_DEPARTURE
-    session = get_session()
-    try:
-        t0 = time.time()
-        req = session.post(api_url, headers=HEADERS, json={"query": query, "variables": variables})
-        query_time = time.time() - t0
-        req.raise_for_status()
-        data = req.json()
-    except (RequestException, ValueError) as e:
-        if nb_tries > MAX_TRIES:
-            raise MetropyError(f"OpenTripPlanner request failed: {e}")
-        # Retry.
-        return get_least_cost_itinerary(row, api_url, parameters, nb_tries + 1)
-    itineraries = data.get("data", dict()).get("planConnection", dict()).get("edges", None)
+    Returns the columns `travel_time`, `generalized_time`, `waiting_time`, `legs` and `query_time`
+    (as lists, in the order of the trips).
+    """
+    import asyncio
+
+    import aiohttp
+    from tqdm import tqdm
+
+    n = len(trips)
+    columns = ("travel_time", "generalized_time", "waiting_time", "legs", "query_time")
+    results: dict[str, list] = {col: [None] * n for col in columns}
+    rows = enumerate(
+        trips.select(
+            "datetime",
+            "arrive_by",
+            "origin_lat",
+            "origin_lng",
+            "destination_lat",
+            "destination_lng",
+        ).iter_rows()
+    )
+    limit = AdaptiveLimit(max_concurrency)
+    connector = aiohttp.TCPConnector(limit=max_concurrency)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+
+    async def worker(session: aiohttp.ClientSession, pbar: tqdm):
+        # The iterator of rows is shared by the workers so that there are never more than
+        # `max_concurrency` pending requests.
+        for i, (datetime, arrive_by, o_lat, o_lng, d_lat, d_lng) in rows:
+            variables = {
+                **parameters,
+                "datetime": datetime,
+                "originLat": o_lat,
+                "originLng": o_lng,
+                "destinationLat": d_lat,
+                "destinationLng": d_lng,
+            }
+            query = QUERY_ARRIVAL if arrive_by else QUERY_DEPARTURE
+            data, query_time = await post_query(session, limit, api_url, query, variables)
+            for col, value in zip(columns, parse_least_cost_itinerary(data)):
+                results[col][i] = value
+            results["query_time"][i] = query_time
+            pbar.update(1)
+
+    async with aiohttp.ClientSession(
+        headers=HEADERS, connector=connector, timeout=timeout
+    ) as session:
+        with tqdm(total=n, desc="Processing batch", smoothing=0.01) as pbar:
+            try:
+                async with asyncio.TaskGroup() as group:
+                    for _ in range(min(max_concurrency, n)):
+                        group.create_task(worker(session, pbar))
+            except ExceptionGroup as e:
+                # Raise the error of the first failed request instead of the group of errors of
+                # the workers.
+                errors = e.subgroup(MetropyError)
+                if errors is None:
+                    raise
+                raise errors.exceptions[0] from None
+    logger.debug(f"Final number of concurrent requests: {int(limit.limit)}")
+    return results
+
+
+async def post_query(
+    session: aiohttp.ClientSession, limit: AdaptiveLimit, api_url: str, query: str, variables: dict
+) -> tuple[dict, float]:
+    """Sends a GraphQL query to the OpenTripPlanner API and returns the JSON response and the
+    query time.
+
+    Failed requests are retried `MAX_TRIES` times, with an exponential backoff.
+    """
+    import asyncio
+
+    import aiohttp
+
+    nb_tries = 0
+    while True:
+        try:
+            async with limit:
+                t0 = time.perf_counter()
+                async with session.post(
+                    api_url, json={"query": query, "variables": variables}
+                ) as response:
+                    response.raise_for_status()
+                    data = await response.json(content_type=None)
+                query_time = time.perf_counter() - t0
+            limit.record()
+            return data, query_time
+        except (aiohttp.ClientError, TimeoutError, ValueError) as e:
+            if nb_tries >= MAX_TRIES:
+                raise MetropyError(f"OpenTripPlanner request failed: {e}")
+            limit.backoff()
+            await asyncio.sleep(RETRY_DELAY * 2**nb_tries)
+            nb_tries += 1
+
+
+def parse_least_cost_itinerary(data: dict) -> tuple:
+    """Returns the duration, generalized cost, waiting time and legs of the least-cost itinerary of
+    an OpenTripPlanner response (or `None` values if no itinerary was found)."""
+    itineraries = (data.get("data") or dict()).get("planConnection", dict()).get("edges", None)
     if itineraries is None:
         raise MetropyError(f"Invalid OpenTripPlanner result data:\n{data}")
     # Find the itinerary with the least cost.
     edge = min(itineraries, key=lambda it: it["node"]["generalizedCost"], default=None)
     if edge is None:
         # No itinerary found.
-        return (row["trip_id"], None, None, None, None, None)
+        return (None, None, None, None)
     it = edge["node"]
     legs = [clean_leg(leg) for leg in it["legs"]]
-    return (
-        row["trip_id"],
-        it["duration"],
-        it["generalizedCost"],
-        it["waitingTime"],
-        legs,
-        query_time,
-    )
+    return (it["duration"], it["generalizedCost"], it["waitingTime"], legs)
 
 
 def clean_leg(leg: dict):
@@ -389,12 +633,34 @@ class TripsOpenTripPlannerStep(ThreadedStep, GTFSStep):
     - [`multipliers.rail`](parameters.md#opentripplannermultipliers.rail): multiplier for the value
       of time for rail transport (default is 1).
 
-    When running this step, the public-transit itineraries of all trips are hold in memory.
-    If you are running out of memory, you can try to use the
-    [`batch_size`](parameters.md#opentripplannerbatch_size) parameter to reduce RAM consumption.
-    Reducing the batch size should reduce memory consumption, at the cost of an increase in running
-    time.
-    By default, all trips are run in a single batch.
+    The requests are sent concurrently to the OpenTripPlanner server, over a pool of keep-alive
+    connections.
+    The number of concurrent requests is tuned automatically from the throughput of the server, up
+    to [`nb_threads`](parameters.md#nb_threads) (default is the number of CPUs of your machine).
+    Failed requests are retried three times, with an exponential backoff.
+
+    Trips with the same origin, destination (rounded to about 1 meter) and departure / arrival time
+    are queried only once (the itinerary is then used for all these trips).
+    To further reduce the number of queries, origins and destinations can be rounded to a grid with
+    the [`coordinates_rounding`](parameters.md#opentripplannercoordinates_rounding) parameter (in
+    meters) and departure / arrival times can be rounded with the
+    [`time_rounding`](parameters.md#opentripplannertime_rounding) parameter, at the cost of less
+    accurate itineraries.
+    By default, no rounding is done.
+    The queries are run in batches of [`batch_size`](parameters.md#opentripplannerbatch_size)
+    queries.
+    When [`cache`](parameters.md#opentripplannercache) is `true` (the default), the results of each
+    batch are stored in the `opentripplanner_cache/` directory (in the main directory), with one
+    sub-directory per set of query parameters (URL and generalized-time parameters) and GTFS files
+    ([`gtfs.files`](parameters.md#gtfsfiles)).
+    The queries whose results are already in the cache are not sent again: if a run is interrupted,
+    the next run resumes where it stopped, and changing parameters which do not affect the queries
+    (e.g., the trips that are not public-transit trips) does not require running all the queries
+    again.
+    Set `gtfs.files` to the GTFS files used to build the OpenTripPlanner graph so that the cached
+    results are not used anymore when these files change.
+    The cache cannot detect other changes of the graph (e.g., new OpenStreetMap data, or GTFS files
+    modified while `gtfs.files` is not set): disable the cache in that case.
 
     Example of configuration for this step:
 
@@ -406,6 +672,8 @@ class TripsOpenTripPlannerStep(ThreadedStep, GTFSStep):
     url = "http://0.0.0.0:8080"
     batch_size = 50000
     time_type = "tstar"
+    coordinates_rounding = 100
+    time_rounding = 600
     walking_speed = 4.0
     transfer_cost = 300
     [opentripplanner.multipliers]
@@ -425,12 +693,40 @@ class TripsOpenTripPlannerStep(ThreadedStep, GTFSStep):
     )
     batch_size = IntParameter(
         "opentripplanner.batch_size",
-        description="How many trips should be processed in each batch.",
+        default=DEFAULT_BATCH_SIZE,
+        lower_bound=1,
+        description="How many queries should be processed in each batch.",
         note=(
-            "Default is to process all trips in a single batch. "
+            "The results are written to the cache after each batch. "
             "Use a lower value if you are running out of memory."
         ),
     )
+    coord_rounding = FloatParameter(
+        "opentripplanner.coordinates_rounding",
+        description="By how many meters trip origin / destination coordinates should be rounded.",
+        note=(
+            "Default is to not round the coordinates. "
+            "Larger values mean that fewer queries are run, but the itineraries are less accurate."
+        ),
+    )
+    time_rounding = DurationParameter(
+        "opentripplanner.time_rounding",
+        description="By how much time trips' departure / arrival time should be rounded.",
+        note=(
+            "Default is to not round the departure / arrival times. "
+            "Larger values mean that fewer queries are run, but the itineraries are less accurate."
+        ),
+    )
+    cache = BoolParameter(
+        "opentripplanner.cache",
+        default=True,
+        description="Whether the results of the queries are stored in a persistent cache.",
+        note=(
+            "The cache is stored in the `opentripplanner_cache/` directory (in the main "
+            "directory). It is keyed by the content of the `gtfs.files`, if any, but it cannot "
+            "detect other changes of the OpenTripPlanner graph."
+        ),
+    )
     time_type = EnumParameter(
         "opentripplanner.time_type",
         values=["departure", "arrival", "tstar", "custom_departure", "custom_arrival"],
@@ -510,6 +806,11 @@ class TripsOpenTripPlannerStep(ThreadedStep, GTFSStep):
     }
     output_files = {"costs": TripsPublicTransitItinerariesFile}
 
+    def __init__(self, config: Config):
+        super().__init__(config)
+        # Directory where the results of the queries are kept from one run to another.
+        self.cache_root = config.main_directory / "opentripplanner_cache"
+
     def is_defined(self):
         return self.gtfs_date is not None and self.time_type is not None
 
@@ -521,11 +822,13 @@ class TripsOpenTripPlannerStep(ThreadedStep, GTFSStep):
         assert self.walking_speed is not None
 
         trips = self.input["trips"].read()
-        # Note that tstars are read even when not required. This could be optimized although the
-        # impact is probably very small.
-        trips = clean_trips_time(
-            trips, self.input["tstars"].read_if_exists(), self.time_type, self.time
-        )
+        tstars = self.input["tstars"].read() if self.time_type == "tstar" else None
+        trips = clean_trips_time(trips, tstars, self.time_type, self.time)
+        if self.time_rounding is not None:
+            t_round = self.time_rounding.total_seconds()
+            trips = trips.with_columns(
+                seconds=pl.col("seconds").truediv(t_round).round().mul(t_round).cast(pl.Int64)
+            )
         # Convert time column to a HH:MM:SS string.
         trips = trips.with_columns(
             time=pl.time(
@@ -539,6 +842,8 @@ class TripsOpenTripPlannerStep(ThreadedStep, GTFSStep):
 
         # Read origin / destination longitude and latitude.
         origins = self.input["origins"].read()
+        if self.coord_rounding is not None:
+            origins.geometry = round_coordinates(origins.geometry, self.coord_rounding)
         origins.to_crs("EPSG:4326", inplace=True)
         origins_df = pl.DataFrame(
             {
@@ -549,6 +854,8 @@ class TripsOpenTripPlannerStep(ThreadedStep, GTFSStep):
         )
         trips = trips.join(origins_df, on="trip_id")
         destinations = self.input["destinations"].read()
+        if self.coord_rounding is not None:
+            destinations.geometry = round_coordinates(destinations.geometry, self.coord_rounding)
         destinations.to_crs("EPSG:4326", inplace=True)
         destinations_df = pl.DataFrame(
             {
@@ -570,7 +877,23 @@ class TripsOpenTripPlannerStep(ThreadedStep, GTFSStep):
             "transferCost": self.transfer_cost,
         }
 
+        if self.cache:
+            if self.gtfs_files is None:
+                logger.warning(
+                    "The cache of OpenTripPlanner queries cannot detect changes of the GTFS files "
+                    "when `gtfs.files` is not set"
+                )
+            cache_directory = query_cache_directory(
+                self.cache_root, self.otp_url, parameters, self.gtfs_files
+            )
+        else:
+            cache_directory = None
         df = run_queries(
-            trips, self.otp_url, parameters, self.batch_size, nb_threads=self.nb_threads
+            trips,
+            self.otp_url,
+            parameters,
+            self.batch_size,
+            max_concurrency=self.nb_threads,
+            cache_directory=cache_directory,
         )
         self.output["costs"].write(df)
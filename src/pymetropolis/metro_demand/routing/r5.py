@@ -1,11 +1,16 @@
 from __future__ import annotations
 
 import datetime
+import tempfile
+import time
+from collections.abc import Iterator
+from contextlib import ExitStack, contextmanager
 from pathlib import Path
 from typing import TYPE_CHECKING
 
 from loguru import logger
 
+from pymetropolis.common import ThreadedStep
 from pymetropolis.metro_common import MetropyError
 from pymetropolis.metro_common.utils import pl_duration_to_seconds
 from pymetropolis.metro_demand.population.files import (
@@ -16,9 +21,11 @@ from pymetropolis.metro_demand.population.files import (
 from pymetropolis.metro_demand.routing.files import TripsPublicTransitItinerariesFile
 from pymetropolis.metro_network.public_transit import GTFSStep
 from pymetropolis.metro_pipeline.parameters import (
+    BoolParameter,
     DurationParameter,
     EnumParameter,
     FloatParameter,
+    IntParameter,
     TimeParameter,
 )
 from pymetropolis.metro_spatial import OSMStep
@@ -26,6 +33,55 @@ from pymetropolis.metro_spatial import OSMStep
 if TYPE_CHECKING:
     import geopandas as gpd
     import polars as pl
+    import r5py
+
+    from pymetropolis.metro_pipeline import Config
+
+# Default memory budget for the travel-time matrices being computed, in megabytes.
+DEFAULT_MEMORY_BUDGET = 2_000
+
+# Estimated memory used by each origin-destination pair of a travel-time matrix, in bytes.
+MATRIX_CELL_BYTES = 100
+
+
+@contextmanager
+def r5py_cache_directory(path: Path | None) -> Iterator[Path]:
+    """Sets the cache directory of r5py, where the transport networks it builds are stored, within
+    the context.
+
+    r5py keys the networks by a hash of the content of their input files, so that a network is only
+    built again when one of these changed.
+    If `path` is `None`, a temporary directory is used, so that nothing is kept after the context.
+    """
+    from r5py.util import Config as R5Config
+
+    r5_config = R5Config()
+    previous = r5_config.CACHE_DIR
+    with ExitStack() as stack:
+        if path is None:
+            path = Path(stack.enter_context(tempfile.TemporaryDirectory(prefix="r5_cache")))
+        path.mkdir(parents=True, exist_ok=True)
+        r5_config.CACHE_DIR = path
+        try:
+            yield path
+        finally:
+            r5_config.CACHE_DIR = previous
+
+
+def load_transport_network(
+    osm_file: Path, gtfs_files: list[Path], cache_directory: Path | None = None
+) -> r5py.TransportNetwork:
+    """Returns the r5py transport network built from the OpenStreetMap and GTFS files.
+
+    If `cache_directory` is given, it is used as the cache directory of r5py (see
+    `r5py_cache_directory`), so that the network is only built again when the OpenStreetMap or GTFS
+    files changed.
+    """
+    import r5py
+
+    with r5py_cache_directory(cache_directory):
+        logger.debug("Loading public-transit network")
+        return r5py.TransportNetwork(osm_pbf=osm_file, gtfs=gtfs_files)
 
 
 def run_r5py(
@@ -35,39 +91,62 @@ def run_r5py(
     trips: pl.DataFrame,
     origins: gpd.GeoDataFrame,
     destinations: gpd.GeoDataFrame,
+    nb_threads: int | None = None,
+    memory_budget: int = DEFAULT_MEMORY_BUDGET,
+    cache_directory: Path | None = None,
 ) -> pl.DataFrame:
+    """Computes the public-transit travel time of the trips with r5py.
+
+    One travel-time matrix is computed for each departure time, between the origins and
+    destinations of the trips with that departure time.
+    The matrices are computed concurrently by `nb_threads` threads (default is the number of
+    CPUs), sharing a single transport network.
+    The origins of each departure time are split in chunks so that the matrices being computed
+    hold at most `memory_budget` megabytes in total.
+    The transport network is stored in (or loaded from) `cache_directory`, if given (see
+    `load_transport_network`).
+    """
+    import os
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
     import polars as pl
-    import r5py
 
-    logger.debug("Building public-transit network.")
-    transport_network = r5py.TransportNetwork(osm_pbf=osm_file, gtfs=gtfs_files)
+    t0 = time.perf_counter()
+    transport_network = load_transport_network(osm_file, gtfs_files, cache_directory)
+    logger.debug(f"Public-transit network ready in {time.perf_counter() - t0:.1f}s")
 
-    logger.debug("Computing public-transit travel-time matrix.")
+    nb_threads = nb_threads or os.cpu_count() or 1
+    max_cells = max(1, memory_budget * 1_000_000 // (MATRIX_CELL_BYTES * nb_threads))
+    tasks = list(matrix_tasks(trips, max_cells))
+    logger.debug(
+        f"Computing {len(tasks):,} public-transit travel-time matrices "
+        f"({trips['seconds'].n_unique():,} departure times) on {nb_threads} threads"
+    )
+    t0 = time.perf_counter()
     results = []
-    for (departure_time,), dt_trips in (
-        trips.sort("seconds").partition_by("seconds", include_key=False, as_dict=True).items()
-    ):
-        departure = datetime.datetime.combine(date, datetime.time(0)) + datetime.timedelta(
-            seconds=departure_time
-        )
-        dt_origins = origins.loc[origins["id"].isin(dt_trips["from_id"])]
-        dt_destinations = destinations.loc[destinations["id"].isin(dt_trips["to_id"])]
-        print(f"Departure: {departure}")
-        print(f"Unique origins: {len(dt_origins)}")
-        print(f"Unique destinations: {len(dt_destinations)}")
-        travel_time_matrix = r5py.TravelTimeMatrix(
-            transport_network,
-            origins=dt_origins,
-            destinations=dt_destinations,
-            transport_modes=[r5py.TransportMode.TRANSIT],
-            departure=departure,
-        )
-        dt_df = (
-            pl.from_pandas(travel_time_matrix)
-            .join(dt_trips, on=["from_id", "to_id"], how="semi")
-            .with_columns(seconds=pl.lit(departure_time, dtype=pl.Float64))
-        )
-        results.append(dt_df)
+    with ThreadPoolExecutor(max_workers=nb_threads) as executor:
+        futures = {
+            executor.submit(
+                travel_time_matrix,
+                transport_network,
+                date,
+                departure_time,
+                task_trips,
+                origins,
+                destinations,
+            ): (departure_time, task_trips)
+            for departure_time, task_trips in tasks
+        }
+        for i, future in enumerate(as_completed(futures), start=1):
+            departure_time, task_trips = futures[future]
+            df, running_time = future.result()
+            logger.debug(
+                f"[{i}/{len(tasks)}] Departure {datetime.timedelta(seconds=departure_time)}: "
+                f"{task_trips['from_id'].n_unique():,} origins x "
+                f"{task_trips['to_id'].n_unique():,} destinations in {running_time:.1f}s"
+            )
+            results.append(df)
+    logger.debug(f"Travel-time matrices computed in {time.perf_counter() - t0:.1f}s")
     df = pl.concat(results, how="vertical_relaxed")
     df = trips.join(df, on=["seconds", "from_id", "to_id"], how="left").select(
         "trip_id", travel_time=pl.duration(minutes="travel_time")
@@ -75,7 +154,58 @@ def run_r5py(
     return df
 
 
-class TripsPublicTransitTravelTimeFromR5Step(OSMStep, GTFSStep):
+def matrix_tasks(trips: pl.DataFrame, max_cells: int) -> Iterator[tuple[float, pl.DataFrame]]:
+    """Yields the departure time and the trips of each travel-time matrix to be computed.
+
+    The trips are partitioned by departure time and the origins of each departure time are split
+    in chunks so that each matrix has at most `max_cells` origin-destination pairs (unless a single
+    origin has more than `max_cells` destinations).
+    """
+    import polars as pl
+
+    for (departure_time,), dt_trips in (
+        trips.sort("seconds").partition_by("seconds", include_key=False, as_dict=True).items()
+    ):
+        origin_ids = dt_trips["from_id"].unique().sort()
+        chunk_size = max(1, max_cells // dt_trips["to_id"].n_unique())
+        for i in range(0, len(origin_ids), chunk_size):
+            chunk = origin_ids.slice(i, chunk_size)
+            yield departure_time, dt_trips.filter(pl.col("from_id").is_in(chunk))
+
+
+def travel_time_matrix(
+    transport_network: r5py.TransportNetwork,
+    date: datetime.date,
+    departure_time: float,
+    trips: pl.DataFrame,
+    origins: gpd.GeoDataFrame,
+    destinations: gpd.GeoDataFrame,
+) -> tuple[pl.DataFrame, float]:
+    """Returns the travel times of the trips' origin-destination pairs, for the given departure
+    time, and the running time."""
+    import polars as pl
+    import r5py
+
+    t0 = time.perf_counter()
+    departure = datetime.datetime.combine(date, datetime.time(0)) + datetime.timedelta(
+        seconds=departure_time
+    )
+    matrix = r5py.TravelTimeMatrix(
+        transport_network,
+        origins=origins.loc[origins["id"].isin(trips["from_id"].to_numpy())],
+        destinations=destinations.loc[destinations["id"].isin(trips["to_id"].to_numpy())],
+        transport_modes=[r5py.TransportMode.TRANSIT],
+        departure=departure,
+    )
+    df = (
+        pl.from_pandas(matrix)
+        .join(trips, on=["from_id", "to_id"], how="semi")
+        .with_columns(seconds=pl.lit(departure_time, dtype=pl.Float64))
+    )
+    return df, time.perf_counter() - t0
+
+
+class TripsPublicTransitTravelTimeFromR5Step(ThreadedStep, OSMStep, GTFSStep):
     """Computes the trips' travel time by public transit with r5py.
 
     This is the easiest and (usually) fastest solution to compute public-transit travel times.
@@ -117,6 +247,20 @@ class TripsPublicTransitTravelTimeFromR5Step(OSMStep, GTFSStep):
     By default, origins and destinations are rounded to the nearest 500 meters and departure time is
     rounded to periods of 1 hour.
 
+    The travel-time matrices of the different departure times are computed concurrently, with
+    [`nb_threads`](parameters.md#nb_threads) threads sharing the same public-transit network.
+    The memory used by the matrices being computed is bounded by the
+    [`memory_budget`](parameters.md#r5memory_budget) parameter (2 GB by default).
+
+    Building the public-transit network can take several minutes for large OpenStreetMap and GTFS
+    files.
+    When [`cache`](parameters.md#r5cache) is `true` (the default), the network is stored in the
+    `r5_cache/` directory (in the main directory), which is used as the cache directory of r5py: the
+    network is only built again when the content of the OpenStreetMap file or of the GTFS files
+    changed.
+    Networks built from previous versions of the files are not removed automatically: delete the
+    `r5_cache/` directory to free disk space.
+
     Example of configuration for this step:
 
     ```toml
@@ -169,6 +313,24 @@ class TripsPublicTransitTravelTimeFromR5Step(OSMStep, GTFSStep):
             "a very long running time for the step."
         ),
     )
+    memory_budget = IntParameter(
+        "r5.memory_budget",
+        default=DEFAULT_MEMORY_BUDGET,
+        lower_bound=1,
+        description=(
+            "Memory budget for the travel-time matrices being computed concurrently, in megabytes."
+        ),
+        note="Use a lower value if you are running out of memory.",
+    )
+    cache = BoolParameter(
+        "r5.cache",
+        default=True,
+        description="Whether the public-transit network built by r5py is stored in a cache.",
+        note=(
+            "The cache is stored in the `r5_cache/` directory (in the main directory). "
+            "If `false`, the network is built in a temporary directory."
+        ),
+    )
     input_files = {
         "trips": TripsFile,
         "origins": TripsOriginsFile,
@@ -176,6 +338,11 @@ class TripsPublicTransitTravelTimeFromR5Step(OSMStep, GTFSStep):
     }
     output_files = {"costs": TripsPublicTransitItinerariesFile}
 
+    def __init__(self, config: Config):
+        super().__init__(config)
+        # Directory where the public-transit networks are kept from one run to another.
+        self.cache_directory = config.main_directory / "r5_cache"
+
     def is_defined(self):
         return (
             self.osm_file is not None
@@ -193,6 +360,7 @@ class TripsPublicTransitTravelTimeFromR5Step(OSMStep, GTFSStep):
         assert self.time_type is not None
         assert self.gtfs_date is not None
         assert self.time_rounding is not None
+        assert self.memory_budget is not None
 
         trips = self.input["trips"].read()
         if self.time_type == "departure":
@@ -276,6 +444,14 @@ class TripsPublicTransitTravelTimeFromR5Step(OSMStep, GTFSStep):
         trips = trips.select("trip_id", "from_id", "to_id", "seconds")
 
         df = run_r5py(
-            self.osm_file, self.gtfs_files, self.gtfs_date, trips, origins_gdf, destinations_gdf
+            self.osm_file,
+            self.gtfs_files,
+            self.gtfs_date,
+            trips,
+            origins_gdf,
+            destinations_gdf,
+            nb_threads=self.nb_threads,
+            memory_budget=self.memory_budget,
+            cache_directory=self.cache_directory if self.cache else None,
         )
         self.output["costs"].write(df)
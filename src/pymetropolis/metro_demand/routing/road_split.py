@@ -6,12 +6,13 @@ from loguru import logger
 
 from pymetropolis.metro_calibration.road.files import RoadEdgesFreeFlowTravelTimeFile
 from pymetropolis.metro_common import MetropyError
+from pymetropolis.metro_common.edge_index import EdgeIndex
 from pymetropolis.metro_demand.routing.files import (
     NonPrimaryCarTrips,
     PrimaryCarTripsAccessEgressFile,
     TripsCarFreeFlowTravelTimesFile,
 )
-from pymetropolis.metro_network.functions import get_largest_strongly_connected_component_nodes
+from pymetropolis.metro_network.functions import largest_strongly_connected_component_mask
 from pymetropolis.metro_network.road_network.files import (
     RoadEdgesCleanFile,
     RoadEdgesPrimaryFlagFile,
@@ -22,6 +23,7 @@ from pymetropolis.metro_pipeline.steps import InputFile
 from pymetropolis.metro_pipeline.types import String
 
 if TYPE_CHECKING:
+    import numpy as np
     import polars as pl
 
 
@@ -63,34 +65,80 @@ def find_first_last_primary(routes: pl.DataFrame, primary_edges: set) -> pl.Data
     ).pl()
 
 
-def find_primary_edges(routes: pl.DataFrame, primary_edges: set, i=0) -> set:
-    """Recursively adds edges to the primary network when they are "in the middle" of the primary
-    parts."""
+def find_primary_edges(routes: pl.DataFrame, primary_edges: set) -> tuple[set, list[float]]:
+    """Adds edges to the primary network when they are "in the middle" of the primary parts, until
+    all the routes are primary-connected.
+
+    The DataFrame `routes` must have a column `route` (lists of edge ids).
+
+    The first iteration examines all the routes. Then, only the routes with a newly added primary
+    edge are examined again (the first and last primary edges of the other routes cannot change)
+    so the total running time is roughly linear in the total length of the routes.
+
+    Returns the set of primary edges and the running time of each iteration (in seconds).
+    """
+    import time
+
+    import numpy as np
     import polars as pl
 
-    logger.debug(f"Iteration {i}")
-    # Compute the set of secondary edges taken in-between the primary part.
-    primary_idx = find_first_last_primary(routes, primary_edges)
-    secondary_edges_in_middle = set(
-        routes.lazy()
-        .join(primary_idx.lazy(), on="trip_id")
-        .select(
-            edge_id=pl.col("route").list.slice(
-                pl.col("first_idx_primary") - 1,
-                pl.col("last_idx_primary") - pl.col("first_idx_primary") + 1,
+    # The index covers the edges of the routes (and the initial primary edges) so that any edge
+    # of the routes can be added to the primary network.
+    edge_ids = routes["route"].explode(empty_as_null=False, keep_nulls=False)
+    if primary_edges:
+        edge_ids = pl.concat((edge_ids, pl.Series(list(primary_edges), dtype=edge_ids.dtype)))
+    index = EdgeIndex(edge_ids.unique().to_frame("edge_id"))
+    indexed = index.routes(routes["route"])
+    idx = indexed.indices
+    ends = np.cumsum(indexed.lengths)
+    starts = ends - indexed.lengths
+    # Route of each position in `idx`.
+    route_of = np.repeat(np.arange(len(indexed)), indexed.lengths)
+    # Positions in `idx` of each edge: edge `e` is at `by_edge[edge_ptr[e] : edge_ptr[e + 1]]`.
+    by_edge = np.argsort(idx, kind="stable")
+    edge_ptr = np.concatenate(([0], np.cumsum(np.bincount(idx, minlength=len(index)))))
+    is_primary = np.zeros(len(index), dtype=bool)
+    if primary_edges:
+        is_primary[index.index(np.array(list(primary_edges)))] = True
+    timings = list()
+    worklist = np.arange(len(indexed))
+    while len(worklist):
+        t0 = time.perf_counter()
+        logger.debug(f"Iteration {len(timings)} ({len(worklist):,} routes)")
+        # Positions of the primary edges of the routes in the worklist (sorted by route).
+        positions = _ranges(starts[worklist], ends[worklist])
+        primary_positions = positions[is_primary[idx[positions]]]
+        new_edges = np.empty(0, dtype=idx.dtype)
+        if len(primary_positions):
+            # Compute the set of secondary edges taken in-between the primary part.
+            r = route_of[primary_positions]
+            is_first = np.concatenate(([True], r[1:] != r[:-1]))
+            is_last = np.concatenate((r[1:] != r[:-1], [True]))
+            middle = idx[_ranges(primary_positions[is_first], primary_positions[is_last] + 1)]
+            new_edges = np.unique(middle[~is_primary[middle]])
+        if len(new_edges):
+            logger.debug(f"Adding {len(new_edges):,} secondary edges to primary graph")
+            is_primary[new_edges] = True
+            # Only the routes with a new primary edge need to be examined again.
+            worklist = np.unique(
+                route_of[by_edge[_ranges(edge_ptr[new_edges], edge_ptr[new_edges + 1])]]
             )
-        )
-        .explode("edge_id")
-        .filter(pl.col("edge_id").is_in(primary_edges).not_())
-        .collect(engine="streaming")
-        .to_series()
-    )
-    if secondary_edges_in_middle:
-        logger.debug(f"Adding {len(secondary_edges_in_middle):,} secondary edges to primary graph")
-        primary_edges |= secondary_edges_in_middle
-        return find_primary_edges(routes, primary_edges, i + 1)
+        else:
+            worklist = worklist[:0]
+        timings.append(time.perf_counter() - t0)
+    primary_edges = set(index.edges["edge_id"].filter(pl.Series(is_primary)))
     logger.debug(f"Total number of edges in the primary graph: {len(primary_edges):,}")
-    return primary_edges
+    return primary_edges, timings
+
+
+def _ranges(starts: np.ndarray, stops: np.ndarray) -> np.ndarray:
+    """Returns the concatenation of the ranges `[start, stop)`."""
+    import numpy as np
+
+    lengths = stops - starts
+    # Offset of each range in the output array.
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
 
 
 def find_connections(routes: pl.DataFrame, edges: pl.DataFrame, primary_edges: set):
@@ -100,64 +148,39 @@ def find_connections(routes: pl.DataFrame, edges: pl.DataFrame, primary_edges: s
 
     primary_idx = find_first_last_primary(routes, primary_edges)
     df = routes.join(primary_idx, on="trip_id", how="left")
+    index = EdgeIndex(
+        edges.select("edge_id", "source", "target", "length", "free_flow_travel_time")
+    )
     primary_trips = (
         df.lazy()
         .filter(pl.col("first_idx_primary").is_not_null())
-        .with_columns(
+        .select(
+            "trip_id",
             first_primary_edge=pl.col("route").list.get(pl.col("first_idx_primary") - 1),
             last_primary_edge=pl.col("route").list.get(pl.col("last_idx_primary") - 1),
             access_path=pl.col("route").list.slice(0, pl.col("first_idx_primary") - 1),
             egress_path=pl.col("route").list.slice(pl.col("last_idx_primary")),
         )
-        .with_columns(
-            access_time=pl.col("access_path")
-            .list.eval(
-                pl.element().replace_strict(edges["edge_id"], edges["free_flow_travel_time"])
-            )
-            .list.sum(),
-            egress_time=pl.col("egress_path")
-            .list.eval(
-                pl.element().replace_strict(edges["edge_id"], edges["free_flow_travel_time"])
-            )
-            .list.sum(),
-            access_length=pl.col("access_path")
-            .list.eval(pl.element().replace_strict(edges["edge_id"], edges["length"]))
-            .list.sum(),
-            egress_length=pl.col("egress_path")
-            .list.eval(pl.element().replace_strict(edges["edge_id"], edges["length"]))
-            .list.sum(),
-            access_node=pl.col("first_primary_edge").replace_strict(
-                edges["edge_id"], edges["source"]
-            ),
-            egress_node=pl.col("last_primary_edge").replace_strict(
-                edges["edge_id"], edges["target"]
-            ),
-        )
-        .select(
-            "trip_id",
-            "access_node",
-            "access_path",
-            "access_time",
-            "access_length",
-            "egress_node",
-            "egress_path",
-            "egress_time",
-            "egress_length",
-        )
         .collect()
     )
-    secondary_trips = (
-        df.lazy()
-        .filter(pl.col("first_idx_primary").is_null())
-        .select(
-            "trip_id",
-            "free_flow_travel_time",
-            path="route",
-            path_length=pl.col("route")
-            .list.eval(pl.element().replace_strict(edges["edge_id"], edges["length"]))
-            .list.sum(),
-        )
-        .collect()
+    access_routes = index.routes(primary_trips["access_path"])
+    egress_routes = index.routes(primary_trips["egress_path"])
+    primary_trips = primary_trips.select(
+        "trip_id",
+        access_node=index.gather(primary_trips["first_primary_edge"], "source"),
+        access_path="access_path",
+        access_time=access_routes.sum(index.edges["free_flow_travel_time"]),
+        access_length=access_routes.sum(index.edges["length"]),
+        egress_node=index.gather(primary_trips["last_primary_edge"], "target"),
+        egress_path="egress_path",
+        egress_time=egress_routes.sum(index.edges["free_flow_travel_time"]),
+        egress_length=egress_routes.sum(index.edges["length"]),
+    )
+    secondary_trips = df.filter(pl.col("first_idx_primary").is_null()).select(
+        "trip_id", "free_flow_travel_time", path="route"
+    )
+    secondary_trips = secondary_trips.with_columns(
+        path_length=index.routes(secondary_trips["path"]).sum(index.edges["length"])
     )
     return primary_trips, secondary_trips
 
@@ -220,6 +243,7 @@ class RoadNetworkPrimaryEdgesStep(Step):
     output_files = {"edges_primary": RoadEdgesPrimaryFlagFile}
 
     def run(self):
+        import numpy as np
         import polars as pl
 
         edges_gdf = self.input["edges"].read()
@@ -234,21 +258,21 @@ class RoadNetworkPrimaryEdgesStep(Step):
         if not df["primary"].all() and self.ensure_primary_connected:
             routes = self.input["car_ff_routes"].read().select("trip_id", route="free_flow_route")
             primary_edges = set(df.filter("primary")["edge_id"])
-            primary_edges = find_primary_edges(routes, primary_edges)
+            primary_edges, timings = find_primary_edges(routes, primary_edges)
+            logger.debug(
+                f"Primary network closure: {len(timings)} iterations in {sum(timings):.2f}s"
+            )
             edges = edges.with_columns(primary=pl.col("edge_id").is_in(primary_edges))
             # Select the largest strongly connected component.
             # Some patches of edges can be disconnected and are not re-connected to the main part
             # since no trip is starting from them.
-            nodes = get_largest_strongly_connected_component_nodes(
-                edges.filter("primary").select("source", "target")
+            is_primary = edges["primary"].to_numpy()
+            connected = np.zeros(len(edges), dtype=bool)
+            connected[is_primary] = largest_strongly_connected_component_mask(
+                edges.filter("primary")
             )
             n0 = len(primary_edges)
-            df = edges.select(
-                "edge_id",
-                primary=pl.col("primary")
-                .and_(pl.col("source").is_in(nodes))
-                .and_(pl.col("target").is_in(nodes)),
-            )
+            df = edges.select("edge_id", primary=pl.Series(connected))
             n1 = df["primary"].sum()
             if n1 < n0:
                 logger.warning(
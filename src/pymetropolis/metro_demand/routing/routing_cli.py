@@ -4,13 +4,16 @@ import json
 import os
 import subprocess
 import tempfile
+from collections.abc import Iterator
 from pathlib import Path
 from typing import TYPE_CHECKING
 
 from loguru import logger
 
+from pymetropolis.common import ThreadedStep
 from pymetropolis.metro_calibration.road.files import RoadEdgesFreeFlowTravelTimeFile
 from pymetropolis.metro_common import MetropyError
+from pymetropolis.metro_common.edge_index import EdgeIndex
 from pymetropolis.metro_demand.routing.files import (
     TripsBicycleCostsFile,
     TripsBicycleNodesFile,
@@ -25,14 +28,13 @@ from pymetropolis.metro_network.bicycle_network.files import (
 )
 from pymetropolis.metro_network.pedestrian_network.files import PedestrianEdgesCleanFile
 from pymetropolis.metro_network.road_network.files import RoadEdgesCleanFile
-from pymetropolis.metro_pipeline import Step
-from pymetropolis.metro_pipeline.parameters import BoolParameter, ExecPathParameter
+from pymetropolis.metro_pipeline.parameters import BoolParameter, ExecPathParameter, IntParameter
 
 if TYPE_CHECKING:
     import polars as pl
 
 
-class RoutingCLIStep(Step):
+class RoutingCLIStep(ThreadedStep):
     """Abstract Step to run the Metropolis-Core routing executable."""
 
     exec_path = ExecPathParameter(
@@ -40,6 +42,18 @@ class RoutingCLIStep(Step):
         description="Path to the `routing_cli` executable.",
         note='On Windows, you can omit the ".exe" extension',
     )
+    nb_shards = IntParameter(
+        "metropolis_core.routing_shards",
+        default=1,
+        lower_bound=1,
+        description="Number of shards in which the routing queries are split.",
+        note=(
+            "The shards are routed by concurrent `routing_cli` processes, sharing the "
+            "[`nb_threads`](parameters.md#nb_threads) threads. "
+            "Use more than one shard when the number of unique origin-destination pairs is very "
+            "large, to bound the memory usage and to use all the threads on the query phase."
+        ),
+    )
 
     def is_defined(self) -> bool:
         return self.exec_path is not None
@@ -80,12 +94,14 @@ class TripsPedestrianDistancesStep(RoutingCLIStep):
             origin_node="origin_pedestrian_node",
             destination_node="destination_pedestrian_node",
         )
-        df = trip_routing(trips, edges, self.exec_path, self.output_path)
+        batches = trip_routing(
+            trips, edges, self.exec_path, self.output_path, self.nb_shards, self.nb_threads
+        )
         if self.output_path:
-            df = df.select("trip_id", pedestrian_distance="value", pedestrian_path="route")
+            columns = {"pedestrian_distance": "value", "pedestrian_path": "route"}
         else:
-            df = df.select("trip_id", pedestrian_distance="value")
-        self.output["distances"].write(df)
+            columns = {"pedestrian_distance": "value"}
+        self.output["distances"].write_batches(df.select("trip_id", **columns) for df in batches)
 
 
 class TripsBicycleCostStep(RoutingCLIStep):
@@ -124,12 +140,14 @@ class TripsBicycleCostStep(RoutingCLIStep):
             origin_node="origin_bicycle_node",
             destination_node="destination_bicycle_node",
         )
-        df = trip_routing(trips, edges, self.exec_path, self.output_path)
+        batches = trip_routing(
+            trips, edges, self.exec_path, self.output_path, self.nb_shards, self.nb_threads
+        )
         if self.output_path:
-            df = df.select("trip_id", bicycle_cost="value", bicycle_path="route")
+            columns = {"bicycle_cost": "value", "bicycle_path": "route"}
         else:
-            df = df.select("trip_id", bicycle_cost="value")
-        self.output["costs"].write(df)
+            columns = {"bicycle_cost": "value"}
+        self.output["costs"].write_batches(df.select("trip_id", **columns) for df in batches)
 
 
 class TripsCarFreeFlowTravelTimesStep(RoutingCLIStep):
@@ -167,63 +185,199 @@ class TripsCarFreeFlowTravelTimesStep(RoutingCLIStep):
         trips = od_pairs.select(
             "trip_id", origin_node="origin_road_node", destination_node="destination_road_node"
         )
-        df = trip_routing(trips, edges, self.exec_path, with_routes=True)
-        df = df.select(
-            "trip_id", free_flow_travel_time=pl.duration(seconds="value"), free_flow_route="route"
+        shards = od_pair_routing(
+            trips, edges, self.exec_path, True, self.nb_shards, self.nb_threads
         )
-        # Add route distance.
-        df = df.with_columns(
-            free_flow_distance=pl.col("free_flow_route")
-            .list.eval(pl.element().replace_strict(edges["edge_id"], edges["length"]))
-            .list.sum()
+        index = EdgeIndex(edges.select("edge_id", "length"))
+        self.output["fftt"].write_batches(
+            car_free_flow_results(shard_trips, results, index) for shard_trips, results in shards
         )
-        self.output["fftt"].write(df)
 
 
 def trip_routing(
-    trips: pl.DataFrame, edges: pl.DataFrame, routing_exec: Path, with_routes: bool = False
-):
+    trips: pl.DataFrame,
+    edges: pl.DataFrame,
+    routing_exec: Path,
+    with_routes: bool = False,
+    nb_shards: int = 1,
+    nb_threads: int | None = None,
+) -> Iterator[pl.DataFrame]:
+    """Runs routing_cli for each trip and yields DataFrames with columns `trip_id`, `value` and
+    (optionally) `route`, one for each shard.
+
+    The DataFrame `trips` must have columns `trip_id`, `origin_node` and `destination_node`.
+    Routing is run only once for each unique origin-destination pair.
+    """
+    for shard_trips, results in od_pair_routing(
+        trips, edges, routing_exec, with_routes, nb_shards, nb_threads
+    ):
+        yield join_od_pair_results(shard_trips, results)
+
+
+def car_free_flow_results(
+    trips: pl.DataFrame, results: pl.DataFrame, index: EdgeIndex
+) -> pl.DataFrame:
+    """Returns the free-flow travel time, route and distance of the trips, given the results of
+    `od_pair_routing`."""
+    import polars as pl
+
+    # Add route distance (computed once for each origin-destination pair).
+    routes = index.routes(results["route"])
+    results = results.with_columns(free_flow_distance=routes.sum(index.edges["length"]))
+    df = join_od_pair_results(trips, results)
+    return df.select(
+        "trip_id",
+        free_flow_travel_time=pl.duration(seconds="value"),
+        free_flow_route="route",
+        free_flow_distance="free_flow_distance",
+    )
+
+
+def od_pair_routing(
+    trips: pl.DataFrame,
+    edges: pl.DataFrame,
+    routing_exec: Path,
+    with_routes: bool = False,
+    nb_shards: int = 1,
+    nb_threads: int | None = None,
+) -> Iterator[tuple[pl.DataFrame, pl.DataFrame]]:
+    """Runs routing_cli for each unique origin-destination pair of the trips.
+
+    Synthetic populations have many trips with the same origin and destination nodes so routing
+    the unique pairs only is much faster than routing each trip.
+
+    The pairs are split in `nb_shards` shards of contiguous origin nodes, which are routed by
+    concurrent routing_cli processes, sharing a budget of `nb_threads` threads (default is to use
+    all the available threads).
+    For each shard (in completion order), yields the trips of the shard and a DataFrame with
+    columns `origin_node`, `destination_node`, `value` and (optionally) `route`, so that the
+    results never need to be stored entirely in memory.
+    """
     import polars as pl
 
-    queries = trips.select(query_id="trip_id", origin="origin_node", destination="destination_node")
+    pairs = trips.select("origin_node", "destination_node").unique().with_row_index("query_id")
+    logger.debug(f"Routing {len(pairs):,} unique origin-destination pairs ({len(trips):,} trips)")
+    # Shards are made of contiguous origin nodes, so that each routing_cli process only needs to
+    # explore the graph from a subset of the origins.
+    nb_origins = pairs["origin_node"].drop_nulls().n_unique()
+    nb_shards = max(1, min(nb_shards, nb_origins))
+    pairs = pairs.with_columns(
+        shard=((pl.col("origin_node").rank("dense") - 1) * nb_shards // max(nb_origins, 1))
+        .fill_null(0)
+        .cast(pl.UInt32)
+    )
+    budget = nb_threads or os.cpu_count() or 1
+    nb_processes = min(nb_shards, budget)
+    env = None
+    if nb_threads is not None or nb_processes > 1:
+        # Limit the number of threads of each routing_cli process so that the concurrent processes
+        # do not use more than the thread budget.
+        env = dict(os.environ, RAYON_NUM_THREADS=str(max(1, budget // nb_processes)))
     with tempfile.TemporaryDirectory() as tmp_directory:
-        prepare_routing(queries, edges, tmp_directory, with_routes)
-        run_routing(routing_exec, tmp_directory)
-        df = pl.read_parquet(os.path.join(tmp_directory, "output", "ea_results.parquet"))
-    if with_routes:
-        df = df.select(trip_id="query_id", value="arrival_time", route="route")
-    else:
-        df = df.select(trip_id="query_id", value="arrival_time")
-    return df
+        # The edges are written once and shared by all the shards.
+        edges_filename = os.path.join(tmp_directory, "edges.parquet")
+        prepare_routing_edges(edges, edges_filename)
+        shard_directories = list()
+        for shard in range(nb_shards):
+            shard_directory = os.path.join(tmp_directory, f"shard_{shard}")
+            os.mkdir(shard_directory)
+            queries = pairs.filter(pl.col("shard") == shard).select(
+                "query_id", origin="origin_node", destination="destination_node"
+            )
+            prepare_routing(queries, edges_filename, shard_directory, with_routes)
+            shard_directories.append(shard_directory)
+        if nb_shards > 1:
+            logger.debug(f"Running {nb_shards} shards on {nb_processes} concurrent processes")
+        for shard in run_routing_shards(routing_exec, shard_directories, nb_processes, env):
+            df = pl.read_parquet(
+                os.path.join(shard_directories[shard], "output", "ea_results.parquet")
+            )
+            if with_routes:
+                df = df.select("query_id", value="arrival_time", route="route")
+            else:
+                df = df.select("query_id", value="arrival_time")
+            shard_pairs = pairs.filter(pl.col("shard") == shard)
+            results = shard_pairs.join(df, on="query_id").drop("query_id", "shard")
+            # All the trips of an origin-destination pair belong to the shard of the pair.
+            shard_trips = trips.join(
+                shard_pairs.select("origin_node", "destination_node"),
+                on=["origin_node", "destination_node"],
+                how="semi",
+                nulls_equal=True,
+            )
+            yield shard_trips, results
+
+
+def join_od_pair_results(trips: pl.DataFrame, results: pl.DataFrame) -> pl.DataFrame:
+    """Joins the results of `od_pair_routing` to the trips (without the node columns)."""
+    return (
+        trips.select("trip_id", "origin_node", "destination_node")
+        .join(results, on=["origin_node", "destination_node"], nulls_equal=True)
+        .drop("origin_node", "destination_node")
+    )
+
+
+def prepare_routing_edges(edges: pl.DataFrame, filename: str):
+    edges = edges.select("edge_id", "source", "target", "weight")
+    # Parallel edges are removed, keeping only the minimum-weight edge.
+    edges = edges.sort("weight").unique(subset=["source", "target"], keep="first").sort("edge_id")
+    edges.rename({"weight": "travel_time"}).write_parquet(filename)
 
 
 def prepare_routing(
-    queries: pl.DataFrame, edges: pl.DataFrame, tmp_directory: str, with_routes: bool = False
+    queries: pl.DataFrame, edges_filename: str, directory: str, with_routes: bool = False
 ):
     import polars as pl
 
     queries = queries.select("query_id", "origin", "destination", departure_time=pl.lit(0.0))
-    queries.write_parquet(os.path.join(tmp_directory, "queries.parquet"))
-    edges = edges.select("edge_id", "source", "target", "weight")
-    # Parallel edges are removed, keeping only the minimum-weight edge.
-    edges = edges.sort("weight").unique(subset=["source", "target"], keep="first").sort("edge_id")
-    edges.rename({"weight": "travel_time"}).write_parquet(
-        os.path.join(tmp_directory, "edges.parquet")
-    )
+    queries.write_parquet(os.path.join(directory, "queries.parquet"))
     parameters = {
         "algorithm": "TCH" if with_routes else "Best",
         "output_route": with_routes,
-        "input_files": {"queries": "queries.parquet", "edges": "edges.parquet"},
+        "input_files": {
+            "queries": "queries.parquet",
+            "edges": os.path.relpath(edges_filename, directory),
+        },
         "output_directory": "output",
         "saving_format": "Parquet",
     }
-    with open(os.path.join(tmp_directory, "parameters.json"), "w") as f:
+    with open(os.path.join(directory, "parameters.json"), "w") as f:
         json.dump(parameters, f)
 
 
-def run_routing(routing_exec: Path, tmp_directory: str):
-    parameters_filename = os.path.join(tmp_directory, "parameters.json")
-    res = subprocess.run([routing_exec, parameters_filename], check=False)
+def run_routing(routing_exec: Path, directory: str, env: dict[str, str] | None = None):
+    parameters_filename = os.path.join(directory, "parameters.json")
+    res = subprocess.run([routing_exec, parameters_filename], env=env, check=False)
     if res.returncode:
         # The run did not succeed.
         raise MetropyError("Metropolis-Core routing failed.")
+
+
+def run_routing_shards(
+    routing_exec: Path,
+    directories: list[str],
+    nb_processes: int = 1,
+    env: dict[str, str] | None = None,
+) -> Iterator[int]:
+    """Runs routing_cli in each directory, with at most `nb_processes` concurrent processes, and
+    yields the index of the directories as their run finishes."""
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    if len(directories) == 1:
+        run_routing(routing_exec, directories[0], env)
+        yield 0
+        return
+    with ThreadPoolExecutor(max_workers=nb_processes) as executor:
+        futures = {
+            executor.submit(run_routing, routing_exec, directory, env): i
+            for i, directory in enumerate(directories)
+        }
+        try:
+            for future in as_completed(futures):
+                future.result()
+                yield futures[future]
+        finally:
+            # Do not start the remaining shards if a shard failed or if the results are not
+            # consumed anymore.
+            for future in futures:
+                future.cancel()
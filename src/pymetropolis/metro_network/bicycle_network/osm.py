@@ -5,30 +5,33 @@ from typing import TYPE_CHECKING, Any
 
 from loguru import logger
 
+from pymetropolis.common import ThreadedStep
 from pymetropolis.metro_network.osm import OpenStreetMapNetworkImport
 from pymetropolis.metro_pipeline.parameters import BoolParameter, FloatParameter, ListParameter
 from pymetropolis.metro_pipeline.steps import InputFile
 from pymetropolis.metro_pipeline.types import String
 from pymetropolis.metro_spatial import GeoStep, OSMStep
+from pymetropolis.metro_spatial.osm_data.file import OSMNodesFile, OSMWaysFile
 from pymetropolis.metro_spatial.simulation_area.file import SimulationAreaFile
 
 from .files import BicycleEdgesRawFile
 
 if TYPE_CHECKING:
     import polars as pl
-    from osmium.osm import Node, Way
     from shapely.geometry import MultiPolygon, Polygon
 
+    from pymetropolis.metro_spatial.osm_data.osm import OSMNode, OSMWay
+
 # Directed features of the ways.
 FEATURES = ("speed_limit", "lanes", "give_way", "stop", "traffic_signals", "type")
 
 
 class OSMBicycleNetworkImport(OpenStreetMapNetworkImport):
-    def extra_way_filter(self, way: Way) -> bool:
+    def extra_way_filter(self, way: OSMWay) -> bool:
         """Returns True if the candidate way has valid bicycle access."""
         return "bicycle" not in way.tags or way.tags["bicycle"] not in ("no", "private")
 
-    def way_data(self, way: Way) -> dict[str, Any]:
+    def way_data(self, way: OSMWay) -> dict[str, Any]:
         """Returns a dictionary with the relevant OpenStreetMap data to extract from a valid way."""
 
         data = super().way_data(way)
@@ -308,7 +311,11 @@ class OSMBicycleNetworkImport(OpenStreetMapNetworkImport):
         )
         return df
 
-    def node_data(self, node: Node) -> dict[str, Any]:
+    def node_tag_keys(self) -> list[str]:
+        """Returns the tag keys of the nodes whose data must be read with `node_data`."""
+        return ["highway", "traffic_calming"]
+
+    def node_data(self, node: OSMNode) -> dict[str, Any]:
         """Returns a dictionary with the relevant OpenStreetMap data to extract from a node of the
         network.
         """
@@ -423,7 +430,7 @@ class OSMBicycleNetworkImport(OpenStreetMapNetworkImport):
         return [*super().edge_columns(), "quality", "has_bump", *FEATURES]
 
 
-class OpenStreetMapBicycleImportStep(GeoStep, OSMStep):
+class OpenStreetMapBicycleImportStep(GeoStep, OSMStep, ThreadedStep):
     """Imports a bicycle network from OpenStreetMap data.
 
     Edges of the bicycle network are read from the OpenStreetMap ways with tag
@@ -543,11 +550,13 @@ class OpenStreetMapBicycleImportStep(GeoStep, OSMStep):
     )
 
     input_files = {
+        "osm_ways": OSMWaysFile,
+        "osm_nodes": OSMNodesFile,
         "simulation_area": InputFile(
             SimulationAreaFile,
             when=lambda inst: inst.simulation_area_filter,
             when_doc="if `simulation_area_filter` is set to `true`",
-        )
+        ),
     }
     output_files = {"raw_edges": BicycleEdgesRawFile}
 
@@ -566,11 +575,13 @@ class OpenStreetMapBicycleImportStep(GeoStep, OSMStep):
         else:
             filter_polygon = None
         importer = OSMBicycleNetworkImport(
-            osm_file=self.osm_file,
+            ways=self.input["osm_ways"].scan(),
+            nodes=self.input["osm_nodes"].scan(),
             highway_tags=self.highways,
             crs=self.crs,
             filter_polygon=filter_polygon,
             reindex=self.reindex,
+            nb_threads=self.nb_threads,
         )
         edges = importer.run()
         self.output["raw_edges"].write(edges)
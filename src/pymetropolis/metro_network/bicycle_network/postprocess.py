@@ -1,6 +1,6 @@
 from loguru import logger
 
-from pymetropolis.metro_network.functions import get_largest_strongly_connected_component_nodes
+from pymetropolis.metro_network.functions import largest_strongly_connected_component_mask
 from pymetropolis.metro_pipeline import Step
 from pymetropolis.metro_pipeline.parameters import BoolParameter
 
@@ -90,12 +90,10 @@ def select_connected(gdf):
     import polars as pl
 
     logger.info("Identifying strongly connected components")
-    nodes = get_largest_strongly_connected_component_nodes(
-        pl.from_pandas(gdf[["source", "target"]])
-    )
+    mask = largest_strongly_connected_component_mask(pl.from_pandas(gdf[["source", "target"]]))
     n0 = len(gdf)
     l0 = gdf["length"].sum()
-    gdf = gdf.loc[gdf["source"].isin(nodes) & gdf["target"].isin(nodes)].copy()
+    gdf = gdf.loc[mask].copy()
     n1 = len(gdf)
     if n1 < n0:
         l1 = gdf["length"].sum()
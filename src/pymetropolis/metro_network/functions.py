@@ -3,14 +3,29 @@ from __future__ import annotations
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
+    import numpy as np
     import polars as pl
 
 
-def get_largest_strongly_connected_component_nodes(df: pl.DataFrame) -> set:
-    import networkx as nx
+def largest_strongly_connected_component_mask(df: pl.DataFrame) -> np.ndarray:
+    """Returns a boolean mask of the edges whose source and target nodes are both in the largest
+    strongly connected component of the graph.
+
+    The DataFrame `df` must have columns `source` and `target`.
+    Node ids are mapped to contiguous indices and the components are computed by scipy on a CSR
+    matrix of the graph.
+    """
+    import numpy as np
+    import polars as pl
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import connected_components
 
     assert not df.is_empty(), "No edge given."
-    G = nx.DiGraph()
-    G.add_edges_from((v[0], v[1]) for v in df.select("source", "target").to_numpy())
-    nodes = max(nx.strongly_connected_components(G), key=len)
-    return nodes  # ty: ignore[invalid-return-type]
+    n = len(df)
+    codes = pl.concat((df["source"], df["target"])).rank("dense").cast(pl.Int64).to_numpy() - 1
+    sources, targets = codes[:n], codes[n:]
+    nb_nodes = int(codes.max()) + 1
+    graph = csr_matrix((np.ones(n, dtype=np.int8), (sources, targets)), shape=(nb_nodes, nb_nodes))
+    _, labels = connected_components(graph, directed=True, connection="strong")
+    in_largest = labels == np.bincount(labels).argmax()
+    return in_largest[sources] & in_largest[targets]
@@ -1,6 +1,5 @@
 from __future__ import annotations
 
-from pathlib import Path
 from typing import TYPE_CHECKING, Any
 
 from loguru import logger
@@ -9,53 +8,63 @@ from pymetropolis.metro_common import MetropyError
 
 if TYPE_CHECKING:
     import geopandas as gpd
+    import numpy as np
     import polars as pl
     import pyproj
-    from osmium import IdTracker
-    from osmium.osm import Node, Way
     from shapely.geometry import MultiPolygon, Polygon
 
+    from pymetropolis.metro_spatial.osm_data.osm import OSMNode, OSMWay
+
 
 class OpenStreetMapNetworkImport:
     """Generic class to import a network from OpenStreetMap data.
 
     Parameters
     ----------
-    - osm_file: Path to a OSM file that can be read by osmium.
+    - ways: LazyFrame of the OpenStreetMap ways (see `OSMWaysFile`).
+    - nodes: LazyFrame of the OpenStreetMap nodes (see `OSMNodesFile`).
     - highway_tags: list of `highway=*` values that define valid ways for the network.
     - crs: projected CRS to be used for geometric operations, must be a valid pyproj CRS.
     - filter_polygon: optional polygon to filter ways, must be in the same CRS.
     - reindex: if True, set edge ids to `1,...,n`, where `n` is the number of edges (default is
       False).
+    - nb_threads: number of threads used to filter the ways with the polygon (default is to use
+      all the available threads).
     """
 
     def __init__(
         self,
-        osm_file: Path,
+        ways: pl.LazyFrame,
+        nodes: pl.LazyFrame,
         highway_tags: list[str],
         crs: pyproj.CRS,
         filter_polygon: Polygon | MultiPolygon | None,
         reindex: bool = False,
+        nb_threads: int | None = None,
     ):
-        self.osm_file = osm_file
+        self.ways = ways
+        self.nodes = nodes
         self.highway_tags = highway_tags
         self.crs = crs
         self.filter_polygon = filter_polygon
         self.reindex = reindex
+        self.nb_threads = nb_threads
 
     def run(self):
         """Runs all operations required to import the network and returns a GeoDataFrame of edges
         with their characteristics.
         """
-        way_id_tracker = self.filter_highway_ways()
-        edges, node_id_tracker = self.read_highway_ways(way_id_tracker)
-        nodes = self.read_highway_nodes(node_id_tracker)
+        ways, nodes = self.read_network_data()
+        edges = self.clean_ways(ways)
         edges_gdf = self.create_edges(edges, nodes)
         return edges_gdf
 
-    def filter_highway_ways(self) -> IdTracker:
-        """Reads all the ways in the OSM file and returns a IdTracker with the id of all the valid
-        way.
+    def read_network_data(self) -> tuple[pl.DataFrame, pl.DataFrame]:
+        """Reads the valid ways and the network nodes from the OpenStreetMap data.
+
+        Returns a DataFrame with the data of the valid ways (see `way_data`), with their node ids in
+        a `nodes` column, and a DataFrame with the id and coordinates of their nodes, as well as
+        the data of the nodes with one of the tag keys of `node_tag_keys` (see `node_data`).
 
         A way is valid if:
         - It has a valid highway tag.
@@ -63,62 +72,129 @@ class OpenStreetMapNetworkImport:
         - It intersects with the filtering polygon (if any).
         - It is valid according to the `extra_way_filter` method.
         """
-        import geopandas as gpd
-        import osmium
-        from osmium import IdTracker
-        from osmium.filter import EntityFilter, TagFilter
-        from osmium.geom import WKBFactory
-        from osmium.osm import WAY
-
-        logger.info("Filtering highway ways")
-        ids = list()
-        linestrings = list()
-        fab = WKBFactory()
-        valid_tag_pairs = tuple(("highway", tag) for tag in self.highway_tags)
-        logger.debug("Reading ways from OSM file")
-        for way in (
-            osmium.FileProcessor(self.osm_file)
-            .with_filter(EntityFilter(WAY))
-            .with_filter(TagFilter(*valid_tag_pairs))
-            .with_locations()
+        import numpy as np
+        import polars as pl
+
+        from pymetropolis.metro_spatial.osm_data.osm import (
+            NODE_TAG_KEYS,
+            OSMNode,
+            OSMWay,
+            has_tag_key,
+            tags_as_dicts,
+        )
+
+        logger.info("Reading highway ways and nodes")
+        ways = self.ways.filter(pl.col("highway").is_in(self.highway_tags)).collect()
+        if ways.is_empty():
+            raise MetropyError("No valid way in the OSM data")
+        way_columns: dict[str, list] = {key: list() for key in self.way_data_schema()}
+        mask = np.zeros(len(ways), dtype=bool)
+        for i, (osm_id, tags, nodes) in enumerate(
+            zip(ways["osm_id"].to_list(), tags_as_dicts(ways["tags"]), ways["nodes"].to_list())
         ):
-            if not self.is_valid_way(way) and not self.extra_way_filter(way):  # ty: ignore[invalid-argument-type]
+            way = OSMWay(osm_id, tags, nodes)
+            if not self.is_valid_way(way) or not self.extra_way_filter(way):
                 continue
-            ids.append(way.id)
-            linestrings.append(fab.create_linestring(way.nodes))  # ty: ignore[unresolved-attribute]
-        if not ids:
+            mask[i] = True
+            for key, value in self.way_data(way).items():
+                way_columns[key].append(value)
+        logger.debug("Building DataFrames")
+        ways = pl.DataFrame(
+            [
+                pl.Series(key, values, dtype=dtype)
+                for (key, values), dtype in zip(
+                    way_columns.items(), self.way_data_schema().values()
+                )
+            ]
+        ).with_columns(nodes=ways["nodes"].filter(mask))
+        if ways.is_empty():
             raise MetropyError("No valid way in the OSM data")
-        logger.debug("Building GeoDataFrame")
-        gdf = gpd.GeoDataFrame(
-            {"id": ids}, geometry=gpd.GeoSeries.from_wkb(linestrings, crs="EPSG:4326")
+        # Coordinates of the ways' nodes, concatenated.
+        coords = (
+            ways.lazy()
+            .select(osm_id=pl.col("nodes").explode())
+            .join(self.nodes.select("osm_id", "lon", "lat"), on="osm_id", how="left")
+            .collect()
         )
-        logger.debug("Converting to required CRS")
-        gdf.to_crs(self.crs, inplace=True)
+        lons = coords["lon"].to_numpy()
+        lats = coords["lat"].to_numpy()
+        offsets = np.concatenate(([0], ways["nodes"].list.len().cum_sum().to_numpy()))
         if self.filter_polygon is not None:
             logger.debug("Filtering based on area")
-            mask = [self.filter_polygon.intersects(geom) for geom in gdf.geometry]
-            gdf = gdf.loc[mask].copy()
-            if len(gdf) == 0:
+            mask = self.intersects_area(lons, lats, offsets)
+            if not mask.any():
                 raise MetropyError("The simulation area does not intersect with the OSM data")
-        logger.debug("Creating id tracker")
-        tracker = IdTracker()
-        for way_id in gdf["id"].values:
-            tracker.add_way(way_id)
-        return tracker
+            ways = ways.filter(pl.Series(mask))
+            coords = coords.filter(pl.Series(np.repeat(mask, np.diff(offsets))))
+        nodes = coords.unique("osm_id", keep="first", maintain_order=True).select(
+            "osm_id", coords=pl.struct("lon", "lat")
+        )
+        node_tag_keys = self.node_tag_keys()
+        if not set(node_tag_keys).issubset(NODE_TAG_KEYS):
+            raise MetropyError(f"The tags of the nodes are only stored for keys {NODE_TAG_KEYS}")
+        tagged_nodes = (
+            self.nodes.filter(has_tag_key(node_tag_keys))
+            .join(nodes.lazy().select("osm_id"), on="osm_id", how="semi")
+            .collect()
+        )
+        node_columns: dict[str, list] = {key: list() for key in self.node_data_schema()}
+        for osm_id, lon, lat, tags in zip(
+            tagged_nodes["osm_id"],
+            tagged_nodes["lon"],
+            tagged_nodes["lat"],
+            tags_as_dicts(tagged_nodes["tags"]),
+        ):
+            for key, value in self.node_data(OSMNode(osm_id, lon, lat, tags)).items():
+                node_columns[key].append(value)
+        node_data = pl.DataFrame(
+            [
+                pl.Series(key, values, dtype=dtype)
+                for (key, values), dtype in zip(
+                    node_columns.items(), self.node_data_schema().values()
+                )
+            ]
+        ).drop("lon", "lat")
+        nodes = nodes.join(node_data, on="osm_id", how="left").with_columns(
+            pl.col(key).fill_null(False)
+            for key, dtype in self.node_data_schema().items()
+            if dtype == pl.Boolean
+        )
+        return ways, nodes
+
+    def intersects_area(
+        self, lons: np.ndarray, lats: np.ndarray, offsets: np.ndarray
+    ) -> np.ndarray:
+        """Returns a boolean mask of the ways (given by the concatenated coordinates of their nodes
+        and the offsets of the ways in these coordinates) which intersect the filtering polygon.
+        """
+        import numpy as np
+        import pyproj
+        import shapely
+
+        from pymetropolis.metro_common.area_filter import AreaFilter
+
+        transformer = pyproj.Transformer.from_crs("EPSG:4326", self.crs, always_xy=True)
+        xs, ys = transformer.transform(lons, lats)
+        way_index = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        geoms = shapely.linestrings(xs, ys, indices=way_index)
+        assert self.filter_polygon is not None
+        return AreaFilter(self.filter_polygon, self.nb_threads).intersects(geoms)
 
-    def is_valid_way(self, way: Way) -> bool:
+    def is_valid_way(self, way: OSMWay) -> bool:
         """Returns True if the candidate way has a valid geometry."""
         return len(way.nodes) >= 2 and not way.is_closed()
 
-    def extra_way_filter(self, way: Way) -> bool:
+    def extra_way_filter(self, way: OSMWay) -> bool:
         """Returns True if the candidate way should be imported."""
         return True
 
-    def way_data(self, way: Way) -> dict[str, Any]:
-        """Returns a dictionary with the relevant OpenStreetMap data to extract from a valid way."""
+    def way_data(self, way: OSMWay) -> dict[str, Any]:
+        """Returns a dictionary with the relevant OpenStreetMap data to extract from a valid way.
+
+        The ids of the way's nodes are read separately (column `nodes`).
+        """
         return {
             "osm_id": way.id,
-            "nodes": tuple(n.ref for n in way.nodes),
             "edge_type": way.tags["highway"],
             "name": way.tags.get("name") or way.tags.get("addr:street") or way.tags.get("ref"),
         }
@@ -128,12 +204,7 @@ class OpenStreetMapNetworkImport:
         `way_data`."""
         import polars as pl
 
-        return {
-            "osm_id": pl.UInt64,
-            "nodes": pl.List(pl.UInt64),
-            "edge_type": pl.String,
-            "name": pl.String,
-        }
+        return {"osm_id": pl.UInt64, "edge_type": pl.String, "name": pl.String}
 
     def split_intersected_ways(self, df: pl.DataFrame) -> pl.DataFrame:
         """Split ways at the node where they are intersected by another way."""
@@ -186,36 +257,25 @@ class OpenStreetMapNetworkImport:
         df: pl.DataFrame = df.select("osm_id", "source", "target", "edge_type", "name", "nodes")
         return df
 
-    def read_highway_ways(self, way_id_tracker: IdTracker) -> tuple[pl.DataFrame, IdTracker]:
-        """Reads all the ways in the OSM file with a valid id and returns a DataFrame with their
-        characteristics and an IdTracker with their node ids.
-        """
-        import osmium
-        import polars as pl
-        from osmium import IdTracker
-        from osmium.osm import WAY
-
-        logger.info("Reading highway ways")
-        data = list()
-        logger.debug("Reading ways from OSM file")
-        for way in osmium.FileProcessor(self.osm_file, WAY).with_filter(way_id_tracker.id_filter()):
-            data.append(self.way_data(way))  # ty: ignore[invalid-argument-type]
-        logger.debug("Building DataFrame")
-        df = pl.DataFrame(data, schema_overrides=self.way_data_schema())
+    def clean_ways(self, ways: pl.DataFrame) -> pl.DataFrame:
+        """Splits the ways at intersections and cleans their data."""
         logger.debug("Spliting ways at intersections")
-        df = self.split_intersected_ways(df)
+        df = self.split_intersected_ways(ways)
         logger.debug("Cleaning way data")
-        df = self.clean_way_data(df)
-        # Keep track of all nodes to later identify the highway nodes.
-        all_nodes = set(df["nodes"].explode())
-        node_id_tracker = IdTracker()
-        for n in all_nodes:
-            node_id_tracker.add_node(n)
-        return df, node_id_tracker
-
-    def node_data(self, node: Node) -> dict[str, Any]:
+        return self.clean_way_data(df)
+
+    def node_tag_keys(self) -> list[str]:
+        """Returns the tag keys of the nodes whose data must be read with `node_data`.
+
+        The coordinates of all the nodes of the ways are always read.
+        """
+        return []
+
+    def node_data(self, node: OSMNode) -> dict[str, Any]:
         """Returns a dictionary with the relevant OpenStreetMap data to extract from a node of the
-        network.
+        network with one of the tag keys of `node_tag_keys`.
+
+        For nodes without these tags, boolean values are `False` and other values are NULL.
         """
         return {"osm_id": node.id, "lat": node.lat, "lon": node.lon}
 
@@ -227,29 +287,6 @@ class OpenStreetMapNetworkImport:
 
         return {"osm_id": pl.UInt64, "lat": pl.Float64, "lon": pl.Float64}
 
-    def read_highway_nodes(self, node_id_tracker: IdTracker) -> pl.DataFrame:
-        """Reads all the nodes in the OSM file with a valid id and returns a DataFrame with their
-        characteristics (including coordinates).
-        """
-        import osmium
-        import polars as pl
-        from osmium.osm import NODE
-
-        logger.info("Reading highway nodes")
-        data = list()
-        logger.debug("Reading nodes from OSM file")
-        for node in osmium.FileProcessor(self.osm_file, NODE).with_filter(
-            node_id_tracker.id_filter()
-        ):
-            data.append(self.node_data(node))  # ty: ignore[invalid-argument-type]
-        logger.debug("Building DataFrame")
-        df = (
-            pl.DataFrame(data, schema_overrides=self.node_data_schema())
-            .with_columns(coords=pl.struct("lon", "lat"))
-            .drop("lat", "lon")
-        )
-        return df
-
     def add_node_features_to_edges(self, edges: pl.DataFrame, nodes: pl.DataFrame) -> pl.DataFrame:
         """Returns edges with additional informations read from node data (e.g., traffic signals,
         stop signs).
@@ -277,8 +314,10 @@ class OpenStreetMapNetworkImport:
     def create_edges(self, edges: pl.DataFrame, nodes: pl.DataFrame) -> gpd.GeoDataFrame:
         """Creates edge geometries from node coordinates and duplicate the two-way edges."""
         import geopandas as gpd
+        import numpy as np
         import polars as pl
-        from shapely.geometry import LineString
+        import pyproj
+        import shapely
 
         edges = self.add_node_features_to_edges(edges, nodes)
         logger.debug("Duplicating two-way edges")
@@ -313,15 +352,19 @@ class OpenStreetMapNetworkImport:
         edges = edges.rename({"osm_id": "original_id"})
         edges = edges.select(self.edge_columns())
         logger.debug("Creating edge geometries")
-        edge_coords = edges["nodes"].list.eval(
-            pl.element().replace_strict(nodes["osm_id"], nodes["coords"])
+        # Coordinates of the edges' nodes, concatenated.
+        coords = (
+            edges["nodes"]
+            .explode()
+            .replace_strict(nodes["osm_id"], nodes["coords"])
+            .struct.unnest()
         )
-        np_edge_coords = [coords.to_numpy() for coords in edge_coords]
-        geoms = [LineString(coords) for coords in np_edge_coords]
+        transformer = pyproj.Transformer.from_crs("EPSG:4326", self.crs, always_xy=True)
+        xs, ys = transformer.transform(coords["lon"].to_numpy(), coords["lat"].to_numpy())
+        edge_index = np.repeat(np.arange(len(edges)), edges["nodes"].list.len().to_numpy())
+        geoms = shapely.linestrings(xs, ys, indices=edge_index)
         edges = edges.drop("nodes")
-        gdf = gpd.GeoDataFrame(edges.to_pandas(), geometry=gpd.GeoSeries(geoms, crs="EPSG:4326"))
-        logger.debug("Converting to required CRS")
-        gdf.to_crs(self.crs, inplace=True)
+        gdf = gpd.GeoDataFrame(edges.to_pandas(), geometry=gpd.GeoSeries(geoms, crs=self.crs))
         logger.debug("Computing edges' length")
-        gdf["length"] = gdf.geometry.length
+        gdf["length"] = shapely.length(geoms)
         return gdf
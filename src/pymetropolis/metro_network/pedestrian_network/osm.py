@@ -2,27 +2,30 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING
 
+from pymetropolis.common import ThreadedStep
 from pymetropolis.metro_network.osm import OpenStreetMapNetworkImport
 from pymetropolis.metro_network.pedestrian_network.files import PedestrianEdgesRawFile
 from pymetropolis.metro_pipeline.parameters import BoolParameter, FloatParameter, ListParameter
 from pymetropolis.metro_pipeline.steps import InputFile
 from pymetropolis.metro_pipeline.types import String
 from pymetropolis.metro_spatial import GeoStep, OSMStep
+from pymetropolis.metro_spatial.osm_data.file import OSMNodesFile, OSMWaysFile
 from pymetropolis.metro_spatial.simulation_area.file import SimulationAreaFile
 
 if TYPE_CHECKING:
-    from osmium.osm import Way
     from shapely.geometry import MultiPolygon, Polygon
 
+    from pymetropolis.metro_spatial.osm_data.osm import OSMWay
+
 
 class OSMPedestrianNetworkImport(OpenStreetMapNetworkImport):
-    def extra_way_filter(self, way: Way) -> bool:
+    def extra_way_filter(self, way: OSMWay) -> bool:
         """Returns True if the candidate way should be imported."""
         has_access = "access" not in way.tags or way.tags["access"] != "private"
         return has_access and not way.tags.get("area") == "yes"
 
 
-class OpenStreetMapPedestrianImportStep(GeoStep, OSMStep):
+class OpenStreetMapPedestrianImportStep(GeoStep, OSMStep, ThreadedStep):
     """Imports a pedestrian network from OpenStreetMap data.
 
     Edges of the pedestrian network are read from the OpenStreetMap ways with tag
@@ -139,11 +142,13 @@ class OpenStreetMapPedestrianImportStep(GeoStep, OSMStep):
     )
 
     input_files = {
+        "osm_ways": OSMWaysFile,
+        "osm_nodes": OSMNodesFile,
         "simulation_area": InputFile(
             SimulationAreaFile,
             when=lambda inst: inst.simulation_area_filter,
             when_doc="if `simulation_area_filter` is set to `true`",
-        )
+        ),
     }
     output_files = {"raw_edges": PedestrianEdgesRawFile}
 
@@ -162,11 +167,13 @@ class OpenStreetMapPedestrianImportStep(GeoStep, OSMStep):
         else:
             filter_polygon = None
         importer = OSMPedestrianNetworkImport(
-            osm_file=self.osm_file,
+            ways=self.input["osm_ways"].scan(),
+            nodes=self.input["osm_nodes"].scan(),
             highway_tags=self.highways,
             crs=self.crs,
             filter_polygon=filter_polygon,
             reindex=self.reindex,
+            nb_threads=self.nb_threads,
         )
         edges = importer.run()
         self.output["raw_edges"].write(edges)
@@ -5,6 +5,7 @@ from .files import (
     AllRoadDistancesFile,
     RoadEdgesCapacitiesFile,
     RoadEdgesCleanFile,
+    RoadEdgesContractionFile,
     RoadEdgesRawFile,
     RoadEdgesUrbanFlagFile,
 )
@@ -16,6 +17,7 @@ from .urban import UrbanEdgesStep
 
 ROAD_NETWORK_FILES = [
     RoadEdgesCleanFile,
+    RoadEdgesContractionFile,
     RoadEdgesCapacitiesFile,
     RoadEdgesRawFile,
     RoadEdgesUrbanFlagFile,
@@ -222,6 +222,32 @@ class RoadEdgesCleanFile(MetroGeoDataFrameFile):
     ]
 
 
+class RoadEdgesContractionFile(MetroDataFrameFile):
+    path = "network/road_network/edges_contraction.parquet"
+    description = (
+        "Original edges of each clean road-network edge (the clean edges can be chains of "
+        "original edges merged together when `road_network.contract_nodes` is `true`)."
+    )
+    schema = [
+        Column(
+            "edge_id",
+            MetroDataType.ID,
+            description="Identifier of the clean edge.",
+            unique=True,
+            nullable=False,
+        ),
+        Column(
+            "original_edges",
+            MetroDataType.LIST_OF_IDS,
+            description=(
+                "Identifiers of the raw edges merged into the clean edge, in the order in which "
+                "they are traversed."
+            ),
+            nullable=False,
+        ),
+    ]
+
+
 class RoadEdgesCapacitiesFile(MetroDataFrameFile):
     path = "network/road_network/edges_capacities.parquet"
     description = "Bottleneck capacity of each road-network edge."
@@ -1,15 +1,16 @@
 from __future__ import annotations
 
-from pathlib import Path
 from typing import TYPE_CHECKING, Any
 
 from loguru import logger
 
+from pymetropolis.common import ThreadedStep
 from pymetropolis.metro_network.osm import OpenStreetMapNetworkImport
 from pymetropolis.metro_pipeline.parameters import BoolParameter, FloatParameter, ListParameter
 from pymetropolis.metro_pipeline.steps import InputFile
 from pymetropolis.metro_pipeline.types import String
 from pymetropolis.metro_spatial import GeoStep, OSMStep
+from pymetropolis.metro_spatial.osm_data.file import OSMNodesFile, OSMWaysFile
 from pymetropolis.metro_spatial.simulation_area.file import SimulationAreaFile
 
 from .files import RoadEdgesRawFile
@@ -17,9 +18,10 @@ from .files import RoadEdgesRawFile
 if TYPE_CHECKING:
     import polars as pl
     import pyproj
-    from osmium.osm import Node, Way
     from shapely.geometry import MultiPolygon, Polygon
 
+    from pymetropolis.metro_spatial.osm_data.osm import OSMNode, OSMWay
+
 # Dictionary for special `maxspeed` values.
 SPEED_DICT = {"walk": 8, "FR:walk": 20, "FR:urban": 50, "FR:rural": 80}
 
@@ -33,27 +35,31 @@ FEATURES = ("speed_limit", "lanes", "give_way", "stop", "traffic_signals")
 class OSMRoadNetworkImport(OpenStreetMapNetworkImport):
     def __init__(
         self,
-        osm_file: Path,
+        ways: pl.LazyFrame,
+        nodes: pl.LazyFrame,
         highway_tags: list[str],
         crs: pyproj.CRS,
         filter_polygon: Polygon | MultiPolygon | None,
         allowed_access_tags: list[str],
         reindex: bool = False,
+        nb_threads: int | None = None,
     ):
         super().__init__(
-            osm_file=osm_file,
+            ways=ways,
+            nodes=nodes,
             highway_tags=highway_tags,
             crs=crs,
             filter_polygon=filter_polygon,
             reindex=reindex,
+            nb_threads=nb_threads,
         )
         self.allowed_access_tags = allowed_access_tags
 
-    def extra_way_filter(self, way: Way) -> bool:
+    def extra_way_filter(self, way: OSMWay) -> bool:
         """Returns True if the candidate way has valid road access."""
         return "access" not in way.tags or way.tags["access"] in self.allowed_access_tags
 
-    def way_data(self, way: Way) -> dict[str, Any]:
+    def way_data(self, way: OSMWay) -> dict[str, Any]:
         """Returns a dictionary with the relevant OpenStreetMap data to extract from a valid way."""
         data = super().way_data(way)
         data.update(
@@ -155,7 +161,11 @@ class OSMRoadNetworkImport(OpenStreetMapNetworkImport):
         )
         return df
 
-    def node_data(self, node: Node) -> dict[str, Any]:
+    def node_tag_keys(self) -> list[str]:
+        """Returns the tag keys of the nodes whose data must be read with `node_data`."""
+        return ["highway"]
+
+    def node_data(self, node: OSMNode) -> dict[str, Any]:
         """Returns a dictionary with the relevant OpenStreetMap data to extract from a node of the
         network.
         """
@@ -264,7 +274,7 @@ class OSMRoadNetworkImport(OpenStreetMapNetworkImport):
         return [*super().edge_columns(), "toll", "roundabout", "oneway", *FEATURES]
 
 
-class OpenStreetMapRoadImportStep(GeoStep, OSMStep):
+class OpenStreetMapRoadImportStep(GeoStep, OSMStep, ThreadedStep):
     """Imports a road network from OpenStreetMap data.
 
     Edges of the road network are read from the OpenStreetMap ways with tag
@@ -402,11 +412,13 @@ class OpenStreetMapRoadImportStep(GeoStep, OSMStep):
     )
 
     input_files = {
+        "osm_ways": OSMWaysFile,
+        "osm_nodes": OSMNodesFile,
         "simulation_area": InputFile(
             SimulationAreaFile,
             when=lambda inst: inst.simulation_area_filter,
             when_doc="if `simulation_area_filter` is set to `true`",
-        )
+        ),
     }
     output_files = {"raw_edges": RoadEdgesRawFile}
 
@@ -426,12 +438,14 @@ class OpenStreetMapRoadImportStep(GeoStep, OSMStep):
         else:
             filter_polygon = None
         importer = OSMRoadNetworkImport(
-            osm_file=self.osm_file,
+            ways=self.input["osm_ways"].scan(),
+            nodes=self.input["osm_nodes"].scan(),
             highway_tags=self.highways,
             crs=self.crs,
             filter_polygon=filter_polygon,
             allowed_access_tags=self.allowed_access,
             reindex=self.reindex,
+            nb_threads=self.nb_threads,
         )
         edges = importer.run()
         self.output["raw_edges"].write(edges)
@@ -6,20 +6,43 @@ from loguru import logger
 
 from pymetropolis.metro_common import MetropyError
 from pymetropolis.metro_common.errors import error_context
-from pymetropolis.metro_network.functions import get_largest_strongly_connected_component_nodes
+from pymetropolis.metro_network.functions import largest_strongly_connected_component_mask
 from pymetropolis.metro_pipeline import Step
 from pymetropolis.metro_pipeline.parameters import BoolParameter, CustomParameter, FloatParameter
-from pymetropolis.metro_pipeline.steps import InputFile
+from pymetropolis.metro_pipeline.steps import InputFile, OutputFile
 
 from .common import default_edge_values_validator
-from .files import RoadEdgesCleanFile, RoadEdgesRawFile, RoadEdgesUrbanFlagFile
+from .files import (
+    RoadEdgesCleanFile,
+    RoadEdgesContractionFile,
+    RoadEdgesRawFile,
+    RoadEdgesUrbanFlagFile,
+)
 
 if TYPE_CHECKING:
     import geopandas as gpd
+    import numpy as np
     import polars as pl
 
 EPSILON = 1e-8
 
+# Columns which must have the same value for two consecutive edges to be merged.
+HOMOGENEOUS_COLUMNS = (
+    "edge_type",
+    "speed_limit",
+    "default_speed_limit",
+    "lanes",
+    "default_lanes",
+    "hov_lanes",
+    "toll",
+    "roundabout",
+    "urban",
+)
+
+# Features of the edges' end intersection (an edge with one of these features cannot be merged
+# with the next edge).
+INTERSECTION_COLUMNS = ("give_way", "stop", "traffic_signals")
+
 
 class PostprocessRoadNetworkStep(Step):
     """Performs some operations on the "raw" road network to make it suitable for simulation.
@@ -28,6 +51,9 @@ class PostprocessRoadNetworkStep(Step):
 
     - Replace NULL values with defaults for columns `speed_limit`, `lanes`, `hov_lanes`, and all
       the boolean columns.
+    - Merge the chains of edges through nodes with a single predecessor and a single successor
+      (e.g., a road split in many edges by OpenStreetMap ways' endpoints). This is only done if
+      `contract_nodes` is `true`.
     - Remove all parallel edges (edges with same source and target nodes), keeping only the edge
       of minimum free-flow travel time. This is only done if `remove_duplicates` is `true`.
     - Keep only the largest strongly connected component of the road-network graph. This ensures
@@ -36,6 +62,14 @@ class PostprocessRoadNetworkStep(Step):
     - Set a minimum value for the number of lanes, speed limit, and length of edges.
     - Compute in- and out-degrees of nodes.
 
+    Two consecutive edges are merged only if they have the same type, speed limit, number of lanes,
+    toll and roundabout flags (and urban flag, when the urban flags are read), and if there is no
+    give-way sign, stop sign or traffic signals at the intersection between them.
+    The merged edge has the id, name and original id of its first edge, the sum of the lengths of
+    the edges and the end-intersection features of its last edge.
+    The original edges of each clean edge are stored in the `RoadEdgesContractionFile` (only
+    written when `contract_nodes` is `true`).
+
     The default values for `speed_limit` and `lanes` can be specified as
 
     - constant value over edges
@@ -66,6 +100,19 @@ class PostprocessRoadNetworkStep(Step):
         ),
         note="If `True`, the edge with the smallest travel time is kept.",
     )
+    contract_nodes = BoolParameter(
+        "road_network.contract_nodes",
+        default=False,
+        description=(
+            "Whether the chains of edges through nodes with a single predecessor and a single "
+            "successor should be merged into single edges."
+        ),
+        note=(
+            "Two-way roads are also merged (through nodes whose two neighbors are both "
+            "predecessors and successors). Merging the edges makes the network smaller, which "
+            "speeds up routing and simulation."
+        ),
+    )
     ensure_connected = BoolParameter(
         "road_network.ensure_connected",
         default=False,
@@ -166,41 +213,60 @@ road = 1
             when_doc="if default values rely on the urban flag",
         ),
     }
-    output_files = {"clean_edges": RoadEdgesCleanFile}
+    output_files = {
+        "clean_edges": RoadEdgesCleanFile,
+        "contraction": OutputFile(
+            RoadEdgesContractionFile,
+            when=lambda inst: inst.contract_nodes,
+            when_doc="if `contract_nodes` is `true`",
+        ),
+    }
 
     def run(self):
         """Reads a GeoDataFrame of edges and performs various operations to make the data ready to
         use with METROPOLIS2.
         Saves the results to the given output file.
+
+        The attributes of the edges are processed with polars, the geometries being kept as WKB
+        until the clean edges are written.
         """
         assert self.min_lanes is not None
         assert self.min_speed_limit is not None
         assert self.min_length is not None
 
-        gdf = self.input["raw_edges"].read()
+        raw_edges = self.input["raw_edges"]
+        crs = raw_edges.crs()  # ty: ignore[unresolved-attribute]
         if self.urban_flag_required():
             urban_flags = self.input["urban_edges"].read()
         else:
             urban_flags = None
-        gdf = set_default_values(
-            gdf,
+        edges = set_default_values(
+            raw_edges.scan(),
             default_speed_limit=self.default_speed_limit,
             default_lanes=self.default_lanes,
             hov_lanes=self.hov_lanes,
             urban_flags=urban_flags,
         )
+        contraction = None
+        if self.contract_nodes:
+            edges, contraction = contract_nodes(edges, urban_flags)
         if self.remove_duplicates:
-            gdf = remove_duplicates(gdf)
+            edges = remove_duplicates(edges)
         if self.ensure_connected:
-            gdf = select_connected(gdf)
-        gdf = check(
-            gdf,
+            edges = select_connected(edges)
+        edges = check(
+            edges.lazy(),
             min_lanes=self.min_lanes,
             min_speed_limit=self.min_speed_limit,
             min_length=self.min_length,
-        )
-        gdf.sort_values("edge_id", inplace=True)
-        self.output["clean_edges"].write(gdf)
+        ).collect()
+        self.output["clean_edges"].write_wkb(edges, crs)  # ty: ignore[unresolved-attribute]
+        if contraction is not None:
+            # Edges can have been removed after the contraction.
+            contraction = contraction.join(edges.select("edge_id"), on="edge_id", how="semi").sort(
+                "edge_id"
+            )
+            self.output["contraction"].write(contraction)
 
     def urban_flag_required(self) -> bool:
         if isinstance(self.default_speed_limit, dict) and "urban" in self.default_speed_limit:
@@ -214,181 +280,339 @@ road = 1
 
 @error_context("Failed to set default values of edges")
 def set_default_values(
-    gdf,
+    edges: pl.LazyFrame,
     default_speed_limit: float | dict | None,
     default_lanes: float | dict,
     hov_lanes: float | dict,
     urban_flags: pl.DataFrame | None,
-):
-    import numpy as np
+) -> pl.DataFrame:
+    import polars as pl
 
+    columns = edges.collect_schema().names()
+    if urban_flags is not None:
+        edges = edges.join(
+            urban_flags.lazy().select("edge_id", _urban="urban"),
+            on="edge_id",
+            how="left",
+            maintain_order="left",
+        )
     # Set default for bool columns (default is always False).
-    for col in ("toll", "roundabout", "give_way", "stop", "traffic_signals"):
-        if col not in gdf.columns:
-            gdf[col] = False
-        else:
-            gdf[col] = gdf[col].fillna(False)
-    # Set default speed limits.
-    if "speed_limit" not in gdf.columns:
-        gdf["speed_limit"] = np.nan
-    gdf["default_speed_limit"] = gdf["speed_limit"].isna()
-    if isinstance(default_speed_limit, int | float):
-        gdf["speed_limit"] = gdf["speed_limit"].fillna(default_speed_limit)
-    elif isinstance(default_speed_limit, dict):
-        if "urban" in default_speed_limit and "rural" in default_speed_limit:
-            assert urban_flags is not None
-            urban_edges = set(urban_flags.filter("urban")["edge_id"])
-            mask = gdf["edge_id"].isin(urban_edges) & gdf["speed_limit"].isna()
-            gdf.loc[mask, "speed_limit"] = gdf.loc[mask, "speed_limit"].fillna(
-                gdf.loc[mask, "edge_type"].map(default_speed_limit["urban"])
-            )
-            mask = (~gdf["edge_id"].isin(urban_edges)) & gdf["speed_limit"].isna()
-            gdf.loc[mask, "speed_limit"] = gdf.loc[mask, "speed_limit"].fillna(
-                gdf.loc[mask, "edge_type"].map(default_speed_limit["rural"])
-            )
-        else:
-            mask = gdf["speed_limit"].isna()
-            gdf.loc[mask, "speed_limit"] = gdf.loc[mask, "speed_limit"].fillna(
-                gdf.loc[mask, "edge_type"].map(default_speed_limit)
-            )
-    assert not gdf["speed_limit"].isna().any(), "Some edges have unknown speed limit"
-    gdf["speed_limit"] = gdf["speed_limit"].astype(np.float64)
-    # Set default number of lanes.
-    if "lanes" not in gdf.columns:
-        gdf["lanes"] = np.nan
-    gdf["default_lanes"] = gdf["lanes"].isna()
-    if isinstance(default_lanes, int | float):
-        gdf["lanes"] = gdf["lanes"].fillna(default_lanes)
-    elif isinstance(default_lanes, dict):
-        if "urban" in default_lanes and "rural" in default_lanes:
-            assert urban_flags is not None
-            urban_edges = set(urban_flags.filter("urban")["edge_id"])
-            mask = gdf["edge_id"].isin(urban_edges) & gdf["lanes"].isna()
-            gdf.loc[mask, "lanes"] = gdf.loc[mask, "lanes"].fillna(
-                gdf.loc[mask, "edge_type"].map(default_lanes["urban"])
-            )
-            mask = (~gdf["edges_id"].isin(urban_edges)) & gdf["lanes"].isna()
-            gdf.loc[mask, "lanes"] = gdf.loc[mask, "lanes"].fillna(
-                gdf.loc[mask, "edge_type"].map(default_lanes["rural"])
-            )
-        else:
-            mask = gdf["lanes"].isna()
-            gdf.loc[mask, "lanes"] = gdf.loc[mask, "lanes"].fillna(
-                gdf.loc[mask, "edge_type"].map(default_lanes)
-            )
-    assert not gdf["lanes"].isna().any(), "Some edges have unknown number of lanes"
-    gdf["lanes"] = gdf["lanes"].astype(np.float64)
-    # Set number of HOV lanes.
-    if "hov_lanes" not in gdf.columns:
-        gdf["hov_lanes"] = np.nan
+    edges = edges.with_columns(
+        pl.col(col).fill_null(False) if col in columns else pl.lit(False).alias(col)
+        for col in ("toll", "roundabout", "give_way", "stop", "traffic_signals")
+    )
+    # Add missing columns.
+    edges = edges.with_columns(
+        pl.lit(None, dtype=pl.Float64).alias(col)
+        for col in ("speed_limit", "lanes", "hov_lanes")
+        if col not in columns
+    )
+    edges = edges.with_columns(
+        default_speed_limit=pl.col("speed_limit").is_null(),
+        default_lanes=pl.col("lanes").is_null(),
+        speed_limit=pl.col("speed_limit")
+        .cast(pl.Float64)
+        .fill_null(default_value_expr(default_speed_limit)),
+        lanes=pl.col("lanes").cast(pl.Float64).fill_null(default_value_expr(default_lanes)),
+    )
     if isinstance(hov_lanes, int | float):
-        gdf["hov_lanes"] = hov_lanes
-    elif isinstance(hov_lanes, dict):
-        if "urban" in hov_lanes and "rural" in hov_lanes:
-            assert urban_flags is not None
-            urban_edges = set(urban_flags.filter("urban")["edge_id"])
-            mask = gdf["edge_id"].isin(urban_edges) & gdf["hov_lanes"].isna()
-            gdf.loc[mask, "hov_lanes"] = gdf.loc[mask, "hov_lanes"].fillna(
-                gdf.loc[mask, "edge_type"].map(hov_lanes["urban"])
-            )
-            mask = (~gdf["edge_id"].isin(urban_edges)) & gdf["hov_lanes"].isna()
-            gdf.loc[mask, "hov_lanes"] = gdf.loc[mask, "hov_lanes"].fillna(
-                gdf.loc[mask, "edge_type"].map(hov_lanes["rural"])
-            )
-        else:
-            mask = gdf["hov_lanes"].isna()
-            gdf.loc[mask, "hov_lanes"] = gdf.loc[mask, "hov_lanes"].fillna(
-                gdf.loc[mask, "edge_type"].map(hov_lanes)
-            )
+        # A constant number of HOV lanes is set for all edges.
+        hov_lanes_expr = pl.lit(hov_lanes, dtype=pl.Float64)
+    else:
+        hov_lanes_expr = (
+            pl.col("hov_lanes").cast(pl.Float64).fill_null(default_value_expr(hov_lanes))
+        )
     # By default, there is no HOV lane.
-    gdf["hov_lanes"] = gdf["hov_lanes"].fillna(0).astype(np.float64)
-    if (gdf["hov_lanes"] > gdf["lanes"]).any():
+    edges = edges.with_columns(hov_lanes=hov_lanes_expr.fill_null(0.0))
+    if urban_flags is not None:
+        edges = edges.drop("_urban")
+    df = edges.collect()
+    if df["speed_limit"].has_nulls():
+        raise MetropyError("Some edges have unknown speed limit")
+    if df["lanes"].has_nulls():
+        raise MetropyError("Some edges have unknown number of lanes")
+    if (df["hov_lanes"] > df["lanes"]).any():
         raise MetropyError("Some edges have more HOV lanes than there have lanes.")
-    return gdf
+    return df
+
+
+def default_value_expr(value: float | dict | None) -> pl.Expr:
+    """Returns an expression with the default value of the edges, given as a constant, a map
+    `edge_type -> value` or two maps `edge_type -> value` for urban and rural edges.
+
+    The urban flag of the edges must be in column `_urban` when the value depends on it.
+    """
+    import polars as pl
+
+    if value is None:
+        return pl.lit(None, dtype=pl.Float64)
+    if isinstance(value, int | float):
+        return pl.lit(value, dtype=pl.Float64)
+
+    def edge_type_map(mapping: dict) -> pl.Expr:
+        return (
+            pl.col("edge_type")
+            .cast(pl.String)
+            .replace_strict(mapping, default=None, return_dtype=pl.Float64)
+        )
+
+    if "urban" in value and "rural" in value:
+        return (
+            pl.when(pl.col("_urban").fill_null(False))
+            .then(edge_type_map(value["urban"]))
+            .otherwise(edge_type_map(value["rural"]))
+        )
+    return edge_type_map(value)
+
+
+def contract_nodes(
+    edges: pl.DataFrame, urban_flags: pl.DataFrame | None
+) -> tuple[pl.DataFrame, pl.DataFrame]:
+    """Merges the chains of edges through nodes with a single predecessor and a single successor.
+
+    Returns the DataFrame of the merged edges (with geometries as WKB) and a DataFrame with the
+    original edges of each merged edge.
+    """
+    import numpy as np
+    import polars as pl
+    import shapely
+
+    logger.info("Merging chains of edges")
+    n = len(edges)
+    if n == 0:
+        logger.debug("No edge can be merged")
+        return edges, identity_contraction(edges)
+    codes = (
+        pl.concat((edges["source"], edges["target"])).rank("dense").cast(pl.Int64).to_numpy() - 1
+    )
+    sources, targets = codes[:n], codes[n:]
+    columns = [col for col in HOMOGENEOUS_COLUMNS if col in edges.columns]
+    values = {col: edges[col].to_numpy() for col in columns}
+    if urban_flags is not None:
+        values["urban"] = (
+            edges.select("edge_id")
+            .join(urban_flags, on="edge_id", how="left", maintain_order="left")["urban"]
+            .to_numpy()
+        )
+    features = edges.select(
+        pl.any_horizontal(col for col in INTERSECTION_COLUMNS if col in edges.columns)
+    ).to_series()
+    next_edges = find_next_edges(sources, targets)
+    # An edge can be merged with its successor only if they are homogeneous.
+    mask = (next_edges >= 0) & ~features.fill_null(False).to_numpy()
+    idx = np.flatnonzero(mask)
+    for col_values in values.values():
+        mask[idx] &= col_values[idx] == col_values[next_edges[idx]]
+    # A node is contracted only if all its incoming edges can be merged (otherwise, the node would
+    # remain reachable in one direction only).
+    nb_nodes = max(sources.max(initial=-1), targets.max(initial=-1)) + 1
+    contracted = np.bincount(targets, weights=mask, minlength=nb_nodes) == np.bincount(
+        targets, minlength=nb_nodes
+    )
+    next_edges[~(mask & contracted[targets])] = -1
+    chains, ranks = find_chains(next_edges)
+    # Chains from a node to itself would become loops: their edges are not merged.
+    order = np.lexsort((ranks, chains))
+    chain_ids, starts = np.unique(chains[order], return_index=True)
+    ends = np.append(starts[1:], n)
+    first, last = order[starts], order[ends - 1]
+    is_loop = sources[first] == targets[last]
+    if is_loop.any():
+        loop_edges = np.isin(chains, chain_ids[is_loop])
+        chains[loop_edges] = n + np.flatnonzero(loop_edges)
+        ranks[loop_edges] = 0
+        order = np.lexsort((ranks, chains))
+        chain_ids, starts = np.unique(chains[order], return_index=True)
+        ends = np.append(starts[1:], n)
+        first, last = order[starts], order[ends - 1]
+    nb_merged = n - len(chain_ids)
+    if nb_merged == 0:
+        logger.debug("No edge can be merged")
+        return edges, identity_contraction(edges)
+    logger.debug(f"Number of edges removed: {nb_merged:,} ({nb_merged / n:.2%})")
+    # Merge the geometries, dropping the first point of all the edges but the first of each chain.
+    coords, edge_index = shapely.get_coordinates(
+        shapely.from_wkb(edges["geometry"].gather(order).to_numpy()), return_index=True
+    )
+    is_first = np.zeros(n, dtype=bool)
+    is_first[starts] = True
+    chain_index = np.repeat(np.arange(len(chain_ids)), ends - starts)
+    keep = np.ones(len(coords), dtype=bool)
+    keep[np.flatnonzero(np.diff(edge_index, prepend=-1))] = is_first
+    geoms = shapely.linestrings(coords[keep], indices=chain_index[edge_index[keep]])
+    lengths = edges["length"].gather(order).to_numpy()
+    merged = edges[first].with_columns(
+        edges["target"].gather(last),
+        pl.Series("length", np.add.reduceat(lengths, starts), dtype=edges["length"].dtype),
+        pl.Series("geometry", shapely.to_wkb(geoms), dtype=pl.Binary),
+        *(edges[col].gather(last) for col in INTERSECTION_COLUMNS if col in edges.columns),
+    )
+    contraction = (
+        pl.DataFrame({"chain": chain_index, "original_edges": edges["edge_id"].gather(order)})
+        .group_by("chain", maintain_order=True)
+        .agg(pl.col("original_edges"))
+        .select(edge_id=edges["edge_id"].gather(first), original_edges="original_edges")
+    )
+    return merged, contraction
+
+
+def identity_contraction(edges: pl.DataFrame) -> pl.DataFrame:
+    """Returns the original edges of each edge when no edge is merged."""
+    import polars as pl
+
+    return edges.select("edge_id", original_edges=pl.concat_list("edge_id"))
+
+
+def find_next_edges(sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """Returns the index of the edge following each edge in a chain of edges through nodes with a
+    single predecessor and a single successor (or -1 if the edge's target is not such a node).
 
+    A node `v` can be contracted if it has two distinct neighbors `u` and `w` and either:
 
-def remove_duplicates(gdf):
+    - one incoming edge (from `u`) and one outgoing edge (to `w`),
+    - two incoming and two outgoing edges, to and from both `u` and `w` (two-way road).
+
+    The edge following an edge `u -> v` is then the edge `v -> w`.
+    """
+    import numpy as np
+
+    n = len(sources)
+    nb_nodes = max(sources.max(initial=-1), targets.max(initial=-1)) + 1
+    in_degrees = np.bincount(targets, minlength=nb_nodes)
+    out_degrees = np.bincount(sources, minlength=nb_nodes)
+    # Number of distinct predecessors, successors and neighbors of each node.
+    pairs = np.unique(np.stack((targets, sources), axis=1), axis=0)
+    nb_preds = np.bincount(pairs[:, 0], minlength=nb_nodes)
+    pairs = np.unique(np.stack((sources, targets), axis=1), axis=0)
+    nb_succs = np.bincount(pairs[:, 0], minlength=nb_nodes)
+    pairs = np.unique(
+        np.concatenate(
+            (np.stack((targets, sources), axis=1), np.stack((sources, targets), axis=1))
+        ),
+        axis=0,
+    )
+    nb_neighbors = np.bincount(pairs[:, 0], minlength=nb_nodes)
+    contractible = (
+        (in_degrees == out_degrees)
+        & ((in_degrees == 1) | (in_degrees == 2))
+        & (nb_preds == in_degrees)
+        & (nb_succs == out_degrees)
+        & (nb_neighbors == 2)
+    )
+    # Outgoing edges of each node, sorted by node.
+    out_order = np.argsort(sources, kind="stable")
+    out_starts = np.concatenate(([0], np.cumsum(out_degrees)))
+    next_edges = np.full(n, -1, dtype=np.int64)
+    idx = np.flatnonzero(contractible[targets])
+    v = targets[idx]
+    candidate = out_order[out_starts[v]]
+    # When the first outgoing edge goes back to the predecessor, the second one is the successor.
+    back = targets[candidate] == sources[idx]
+    candidate[back] = out_order[out_starts[v[back]] + 1]
+    next_edges[idx] = candidate
+    return next_edges
+
+
+def find_chains(next_edges: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the chain (identified by the index of its first edge) of each edge and the rank
+    of the edge in its chain, given the index of the next edge of each edge (or -1).
+
+    Edges which are part of a cycle are not merged (they form chains of a single edge).
+    """
+    import numpy as np
+
+    n = len(next_edges)
+    prev_edges = np.full(n, -1, dtype=np.int64)
+    has_next = next_edges >= 0
+    prev_edges[next_edges[has_next]] = np.flatnonzero(has_next)
+    # List ranking by pointer jumping: each edge points to an earlier edge of its chain until it
+    # reaches the first edge.
+    heads = np.where(prev_edges < 0, np.arange(n), prev_edges)
+    ranks = (prev_edges >= 0).astype(np.int64)
+    for _ in range(max(1, int(np.ceil(np.log2(n + 1))) + 1)):
+        active = prev_edges[heads] >= 0
+        if not active.any():
+            break
+        ranks[active] += ranks[heads[active]]
+        heads[active] = heads[heads[active]]
+    # The edges of a cycle never reach a first edge.
+    in_cycle = prev_edges[heads] >= 0
+    heads[in_cycle] = np.flatnonzero(in_cycle)
+    ranks[in_cycle] = 0
+    return heads, ranks
+
+
+def remove_duplicates(edges: pl.DataFrame) -> pl.DataFrame:
     """Remove the duplicates edges, keeping in order the one with smallest free-flow travel time."""
+    import polars as pl
+
     logger.info("Removing duplicate edges")
-    n0 = len(gdf)
-    l0 = gdf["length"].sum()
-    # Sort the dataframe.
-    gdf["tt"] = gdf["length"] / (gdf["speed_limit"] / 3.6)
-    gdf.sort_values(["tt"], ascending=[True], inplace=True)
-    gdf.drop(columns="tt", inplace=True)
-    # Drop duplicates.
-    gdf.drop_duplicates(subset=["source", "target"], inplace=True)
-    n1 = len(gdf)
+    n0 = len(edges)
+    l0 = edges["length"].sum()
+    edges = edges.sort(
+        pl.col("length") / (pl.col("speed_limit") / 3.6), maintain_order=True
+    ).unique(subset=["source", "target"], keep="first", maintain_order=True)
+    n1 = len(edges)
     if n0 > n1:
-        l1 = gdf["length"].sum()
+        l1 = edges["length"].sum()
         logger.debug(f"Number of edges removed: {n0 - n1} ({(n0 - n1) / n0:.2%})")
         logger.debug(f"Edge length removed (m): {l0 - l1:.0f} ({(l0 - l1) / l0:.2%})")
-    return gdf
+    return edges
 
 
-def select_connected(gdf):
+def select_connected(edges: pl.DataFrame) -> pl.DataFrame:
     import polars as pl
 
     logger.info("Identifying strongly connected components")
-    nodes = get_largest_strongly_connected_component_nodes(
-        pl.from_pandas(gdf[["source", "target"]])
-    )
-    n0 = len(gdf)
-    l0 = gdf["length"].sum()
-    gdf = gdf.loc[gdf["source"].isin(nodes) & gdf["target"].isin(nodes)].copy()
-    n1 = len(gdf)
+    mask = largest_strongly_connected_component_mask(edges)
+    n0 = len(edges)
+    l0 = edges["length"].sum()
+    edges = edges.filter(pl.Series(mask))
+    n1 = len(edges)
     if n1 < n0:
-        l1 = gdf["length"].sum()
+        l1 = edges["length"].sum()
         logger.warning(
             f"Discarding {n0 - n1} edges ({(n0 - n1) / n0:.2%}) disconnected from the largest "
             "graph component"
         )
         logger.debug(f"Length removed (m): {l0 - l1:.0f} ({(l0 - l1) / l0:.2%})")
-    return gdf
+    return edges
 
 
-def check(gdf, min_lanes: float, min_speed_limit: float, min_length: float):
-    import numpy as np
+def check(
+    edges: pl.LazyFrame, min_lanes: float, min_speed_limit: float, min_length: float
+) -> pl.LazyFrame:
+    import polars as pl
 
-    gdf["lanes"] = gdf["lanes"].clip(min_lanes)
-    gdf["speed_limit"] = gdf["speed_limit"].clip(min_speed_limit)
-    gdf["length"] = gdf["length"].clip(min_length)
-    # Count number of incoming / outgoing edges for the source / target node.
-    target_counts = gdf["target"].value_counts()
-    source_counts = gdf["source"].value_counts()
-    gdf = gdf.merge(
-        target_counts.rename("target_in_degree"), left_on="target", right_index=True, how="left"
+    edges = edges.with_columns(
+        lanes=pl.col("lanes").clip(min_lanes),
+        speed_limit=pl.col("speed_limit").clip(min_speed_limit),
+        length=pl.col("length").clip(min_length),
     )
-    gdf = gdf.merge(
-        target_counts.rename("source_in_degree"), left_on="source", right_index=True, how="left"
-    )
-    gdf = gdf.merge(
-        source_counts.rename("target_out_degree"), left_on="target", right_index=True, how="left"
-    )
-    gdf = gdf.merge(
-        source_counts.rename("source_out_degree"), left_on="source", right_index=True, how="left"
-    )
-    for col in ("target_in_degree", "source_in_degree", "target_out_degree", "source_out_degree"):
-        gdf[col] = gdf[col].fillna(0.0).astype(np.uint8)
-    # Add oneway column.
-    gdf.drop(columns=["oneway"], inplace=True, errors="ignore")
-    gdf = gdf.merge(
-        gdf[["source", "target"]],
-        left_on=["source", "target"],
-        right_on=["target", "source"],
-        how="left",
-        indicator="oneway",
-        suffixes=("", "_y"),
+    # Count number of incoming / outgoing edges for the source / target node.
+    in_degrees = edges.group_by(node="target").agg(in_degree=pl.len())
+    out_degrees = edges.group_by(node="source").agg(out_degree=pl.len())
+    for end in ("source", "target"):
+        edges = (
+            edges.join(in_degrees, left_on=end, right_on="node", how="left", maintain_order="left")
+            .join(out_degrees, left_on=end, right_on="node", how="left", maintain_order="left")
+            .rename({"in_degree": f"{end}_in_degree", "out_degree": f"{end}_out_degree"})
+        )
+    edges = edges.with_columns(
+        pl.col(f"{end}_{direction}_degree").fill_null(0).cast(pl.UInt8)
+        for end in ("source", "target")
+        for direction in ("in", "out")
     )
-    gdf.drop(columns=["source_y", "target_y"], inplace=True)
-    gdf.drop_duplicates(subset=["edge_id", "source", "target"], inplace=True)
-    gdf["oneway"] = (
-        gdf["oneway"]
-        .cat.remove_unused_categories()
-        .cat.rename_categories({"both": False, "left_only": True})
-        .astype(bool)
+    # Add oneway column: an edge is part of a one-way road if there is no edge in the opposite
+    # direction.
+    reverse = edges.select(source="target", target="source").unique().with_columns(_two_way=True)
+    edges = (
+        edges.drop("oneway", strict=False)
+        .join(reverse, on=["source", "target"], how="left", maintain_order="left")
+        .with_columns(oneway=pl.col("_two_way").is_null())
+        .drop("_two_way")
     )
-    return gdf
+    return edges.sort("edge_id")
 
 
 def print_stats(gdf: gpd.GeoDataFrame):
@@ -1,10 +1,10 @@
+from pymetropolis.common import ThreadedStep
 from pymetropolis.metro_common.routing import compute_all_pairs_dijkstra
-from pymetropolis.metro_pipeline import Step
 
 from .files import AllRoadDistancesFile, RoadEdgesCleanFile
 
 
-class AllRoadDistancesStep(Step):
+class AllRoadDistancesStep(ThreadedStep):
     """Computes distance of the shortest path, for all node pairs of the road network."""
 
     input_files = {"clean_edges": RoadEdgesCleanFile}
@@ -17,6 +17,7 @@ class AllRoadDistancesStep(Step):
         edges = self.input["clean_edges"].read()
         edges = pl.from_pandas(edges.loc[:, ["edge_id", "source", "target", "length"]])
         edges = edges.select("source", "target", weight="length")
-        df = compute_all_pairs_dijkstra(edges)
-        df = df.rename({"weight": "distance"})
-        self.output["all_distances"].write(df)
+        batches = compute_all_pairs_dijkstra(edges, nb_threads=self.nb_threads)
+        self.output["all_distances"].write_batches(
+            df.rename({"weight": "distance"}) for df in batches
+        )
@@ -2,8 +2,9 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING
 
+from pymetropolis.common import ThreadedStep
+from pymetropolis.metro_common.area_filter import AreaFilter
 from pymetropolis.metro_network.road_network.files import RoadEdgesRawFile
-from pymetropolis.metro_pipeline import Step
 from pymetropolis.metro_spatial.urban_areas.file import UrbanAreasFile
 
 from .files import RoadEdgesUrbanFlagFile
@@ -12,18 +13,18 @@ if TYPE_CHECKING:
     import geopandas as gpd
 
 
-def add_urban_tag(edges: gpd.GeoDataFrame, urban_areas: gpd.GeoDataFrame):
+def add_urban_tag(
+    edges: gpd.GeoDataFrame, urban_areas: gpd.GeoDataFrame, nb_threads: int | None = None
+):
     """Creates a DataFrame classifying the edges within urban areas."""
     import polars as pl
-    from shapely.prepared import prep
 
-    geom = prep(urban_areas.unary_union)
-    urban_flag = [geom.contains(g) for g in edges.geometry]
+    urban_flag = AreaFilter(urban_areas.union_all(), nb_threads).contains(edges.geometry.values)
     df = pl.DataFrame({"edge_id": edges["edge_id"], "urban": urban_flag})
     return df
 
 
-class UrbanEdgesStep(Step):
+class UrbanEdgesStep(ThreadedStep):
     """Identifies edges which are part of urban areas.
 
     An edge is classified as "urban" if it is fully contained within the urban areas of the
@@ -36,6 +37,8 @@ class UrbanEdgesStep(Step):
 
     def run(self):
         df = add_urban_tag(
-            edges=self.input["raw_edges"].read(), urban_areas=self.input["urban_areas"].read()
+            edges=self.input["raw_edges"].read(),
+            urban_areas=self.input["urban_areas"].read(),
+            nb_threads=self.nb_threads,
         )
         self.output["urban_edges"].write(df)
@@ -0,0 +1,72 @@
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+from loguru import logger
+
+
+class ArtifactCache:
+    """In-memory LRU cache of the (Geo)DataFrames written or read through MetroFiles.
+
+    Entries are indexed by path and are only valid as long as the size and modification time of the
+    file did not change.
+    The least-recently used entries are evicted when the total estimated size of the cached values
+    exceeds the memory budget.
+    A budget of 0 disables the cache.
+    """
+
+    def __init__(self, budget: int = 0):
+        # Memory budget, in bytes.
+        self.budget = budget
+        # Entries indexed by path: (size, mtime) of the file, value, estimated size of the value.
+        self.entries: OrderedDict[str, tuple[tuple[int, int], Any, int]] = OrderedDict()
+        self.total_size = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget > 0
+
+    def set_budget(self, budget: int):
+        self.budget = budget
+        self.evict()
+
+    def get(self, path: Path) -> Any | None:
+        """Returns the cached value for the given path, or `None` if there is no valid entry."""
+        entry = self.entries.get(str(path))
+        if entry is None:
+            return None
+        if entry[0] != file_key(path):
+            # The file was modified since the value was cached.
+            self.discard(path)
+            return None
+        self.entries.move_to_end(str(path))
+        return entry[1]
+
+    def put(self, path: Path, value: Any, size: int):
+        """Caches the value of the file at the given path."""
+        self.discard(path)
+        if not self.budget or size > self.budget:
+            return
+        self.entries[str(path)] = (file_key(path), value, size)
+        self.total_size += size
+        self.evict()
+
+    def discard(self, path: Path):
+        entry = self.entries.pop(str(path), None)
+        if entry is not None:
+            self.total_size -= entry[2]
+
+    def evict(self):
+        while self.total_size > self.budget:
+            path, (_, _, size) = self.entries.popitem(last=False)
+            self.total_size -= size
+            logger.trace(f"Evicting `{path}` from the artifact cache")
+
+
+def file_key(path: Path) -> tuple[int, int]:
+    stat = path.stat()
+    return stat.st_size, stat.st_mtime_ns
+
+
+# Cache shared by all the MetroFiles of the current process.
+ARTIFACT_CACHE = ArtifactCache()
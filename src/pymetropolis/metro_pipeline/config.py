@@ -11,11 +11,15 @@ from pymetropolis.metro_common import MetropyError
 class Config:
     main_directory: Path
     secrets: dict
+    content_fingerprint: bool
+    memory_cache_size: int
 
     def __init__(self, d: dict):
         self.dict = d
         self.check_main_directory()
         self.read_secrets()
+        self.read_content_fingerprint()
+        self.read_memory_cache_size()
 
     @classmethod
     def from_toml(cls, path: Path):
@@ -73,6 +77,35 @@ class Config:
             logger.debug(f"Secrets file path does not exist: `{path}`")
             self.secrets = dict()
 
+    def read_content_fingerprint(self):
+        """Reads whether steps' input / output files should be compared by content.
+
+        When `content_fingerprint` is `true`, a file whose modification time changed since the last
+        run is only considered modified if its content changed.
+        Default is `false` (files are compared by modification time only).
+        """
+        value = self.dict.get("content_fingerprint", False)
+        if not isinstance(value, bool):
+            raise MetropyError(
+                f"Config value `content_fingerprint` should be a boolean, got `{value}`"
+            )
+        self.content_fingerprint = value
+
+    def read_memory_cache_size(self):
+        """Reads the memory budget (in megabytes) of the in-memory cache of (Geo)DataFrames.
+
+        When several steps are run in the same process, the DataFrames written or read by a step
+        are kept in memory (within that budget) so that the next steps do not need to read them
+        again from disk.
+        Default is 0 (no cache).
+        """
+        value = self.dict.get("memory_cache_size", 0)
+        if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            raise MetropyError(
+                f"Config value `memory_cache_size` should be a non-negative integer, got `{value}`"
+            )
+        self.memory_cache_size = value
+
     def resolve_parameter(self, key: list[str]):
         """Returns the value associated to the given key in the config.
 
@@ -103,6 +136,8 @@ class Config:
     def get_unused_keys(self, used_keys: set[str]) -> set[str]:
         """Returns a set of all keys (flatten) in the configuration that are not in `used_keys`."""
         used_keys.add("main_directory")
+        used_keys.add("content_fingerprint")
+        used_keys.add("memory_cache_size")
         return get_unused_keys_inner(self.dict, set(), root=None, used_keys=used_keys)
 
 
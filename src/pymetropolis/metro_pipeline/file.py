@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import os
+from collections.abc import Iterable
 from enum import Enum
 from pathlib import Path
 from typing import TYPE_CHECKING, Any, override
@@ -8,10 +10,17 @@ from loguru import logger
 
 from pymetropolis.metro_common.errors import MetropyError, error_context
 
+from .cache import ARTIFACT_CACHE
+from .fingerprint import modification_time
+
 if TYPE_CHECKING:
     import geopandas as gpd
     import matplotlib.pyplot as plt
     import polars as pl
+    import pyproj
+
+# Number of bytes read / written through MetroFiles by the current process.
+IO_STATS = {"bytes_read": 0, "bytes_written": 0}
 
 
 class MetroDataType(Enum):
@@ -231,9 +240,18 @@ class MetroFile:
         return self.complete_path
 
     def last_modified_time(self) -> int | float:
-        return self.complete_path.stat().st_mtime
+        return modification_time(self.complete_path)
+
+    def num_rows(self) -> int | None:
+        """Returns the number of rows of the file, or `None` if this is not a tabular file."""
+        return None
+
+    def _record_io(self, key: str):
+        """Adds the size of the file to the IO statistic `key` ("bytes_read" or "bytes_written")."""
+        IO_STATS[key] += self.complete_path.stat().st_size
 
     def remove(self):
+        ARTIFACT_CACHE.discard(self.complete_path)
         self.complete_path.unlink()
 
     def relative_path_from(self, working_directory: Path) -> str:
@@ -280,11 +298,51 @@ class MetroDataFrameFile(MetroFile):
     def write(self, df: pl.DataFrame):
         df = self.validate(df)
         df.write_parquet(self.complete_path)
+        self._record_io("bytes_written")
+        if ARTIFACT_CACHE.enabled:
+            ARTIFACT_CACHE.put(self.complete_path, df.clone(), df.estimated_size())
+
+    @error_context(msg="Cannot save DataFrame {}", fmt_args=[0])
+    def write_batches(self, dfs: Iterable[pl.DataFrame]):
+        """Writes the DataFrame from an iterable of DataFrames (with the same schema), without
+        storing all of them in memory.
+        """
+        import pyarrow.parquet as pq
+
+        ARTIFACT_CACHE.discard(self.complete_path)
+        # The batches are written to a temporary file which replaces the actual file only when all
+        # the batches are written, so that a failure does not leave a truncated file.
+        tmp_path = self.complete_path.with_name(f"{self.complete_path.name}.tmp")
+        writer = None
+        try:
+            for batch in dfs:
+                table = self.validate(batch).to_arrow()
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp_path, table.schema)
+                writer.write_table(table)
+        except BaseException:
+            if writer is not None:
+                writer.close()
+            tmp_path.unlink(missing_ok=True)
+            raise
+        if writer is None:
+            raise MetropyError("No DataFrame to write")
+        writer.close()
+        os.replace(tmp_path, self.complete_path)
+        self._record_io("bytes_written")
 
     def read(self) -> pl.DataFrame:
         import polars as pl
 
-        return pl.read_parquet(self.complete_path)
+        df = ARTIFACT_CACHE.get(self.complete_path)
+        if df is not None:
+            # Cloning a DataFrame does not copy the underlying data.
+            return df.clone()
+        df = pl.read_parquet(self.complete_path)
+        self._record_io("bytes_read")
+        if ARTIFACT_CACHE.enabled:
+            ARTIFACT_CACHE.put(self.complete_path, df.clone(), df.estimated_size())
+        return df
 
     def read_if_exists(self) -> pl.DataFrame | None:
         if self.exists():
@@ -293,7 +351,15 @@ class MetroDataFrameFile(MetroFile):
     def scan(self) -> pl.LazyFrame:
         import polars as pl
 
-        return pl.scan_parquet(self.complete_path)
+        lf = pl.scan_parquet(self.complete_path)
+        # The size of the whole file is recorded, even if only some columns are read.
+        self._record_io("bytes_read")
+        return lf
+
+    def num_rows(self) -> int | None:
+        import pyarrow.parquet as pq
+
+        return pq.read_metadata(self.complete_path).num_rows
 
     @override
     @classmethod
@@ -349,11 +415,65 @@ class MetroGeoDataFrameFile(MetroFile):
     def write(self, gdf: gpd.GeoDataFrame):
         gdf = self.validate(gdf)
         gdf.to_parquet(self.complete_path)
+        self._record_io("bytes_written")
+        if ARTIFACT_CACHE.enabled:
+            ARTIFACT_CACHE.put(self.complete_path, gdf.copy(), geodataframe_size(gdf))
+
+    def write_wkb(self, df: pl.DataFrame, crs: pyproj.CRS | None):
+        """Saves a DataFrame whose geometries are stored as WKB (column `geometry`)."""
+        import geopandas as gpd
+
+        gdf = gpd.GeoDataFrame(
+            df.drop("geometry").to_pandas(),
+            geometry=gpd.GeoSeries.from_wkb(df["geometry"].to_numpy(), crs=crs),
+        )
+        self.write(gdf)
 
     def read(self) -> gpd.GeoDataFrame:
         import geopandas as gpd
 
-        return gpd.read_parquet(self.complete_path)
+        gdf = ARTIFACT_CACHE.get(self.complete_path)
+        if gdf is not None:
+            # The geometries are immutable so they are shared with the cached GeoDataFrame (only
+            # the arrays are copied).
+            return gdf.copy()
+        gdf = gpd.read_parquet(self.complete_path)
+        self._record_io("bytes_read")
+        if ARTIFACT_CACHE.enabled:
+            ARTIFACT_CACHE.put(self.complete_path, gdf.copy(), geodataframe_size(gdf))
+        return gdf
+
+    def scan(self) -> pl.LazyFrame:
+        """Returns a LazyFrame of the GeoDataFrame, with the geometries as WKB (column
+        `geometry`)."""
+        import polars as pl
+
+        lf = pl.scan_parquet(self.complete_path)
+        # The size of the whole file is recorded, even if only some columns are read.
+        self._record_io("bytes_read")
+        return lf
+
+    def crs(self) -> pyproj.CRS | None:
+        """Returns the CRS of the geometries, from the GeoParquet metadata of the file."""
+        import json
+
+        import pyarrow.parquet as pq
+        import pyproj
+
+        metadata = pq.read_schema(self.complete_path).metadata or dict()
+        geo = json.loads(metadata.get(b"geo", b"{}"))
+        column = geo.get("columns", dict()).get(geo.get("primary_column", "geometry"), dict())
+        if "crs" not in column:
+            # The CRS defaults to longitude / latitude (WGS 84) in GeoParquet files.
+            return pyproj.CRS("OGC:CRS84")
+        if column["crs"] is None:
+            return None
+        return pyproj.CRS.from_user_input(column["crs"])
+
+    def num_rows(self) -> int | None:
+        import pyarrow.parquet as pq
+
+        return pq.read_metadata(self.complete_path).num_rows
 
     def read_if_exists(self) -> gpd.GeoDataFrame | None:
         if self.exists():
@@ -391,10 +511,13 @@ class MetroTxtFile(MetroFile):
     def write(self, txt: str):
         with open(self.complete_path, "w") as f:
             f.write(txt)
+        self._record_io("bytes_written")
 
     def read(self) -> str:
         with open(self.complete_path) as f:
-            return f.read()
+            txt = f.read()
+        self._record_io("bytes_read")
+        return txt
 
     def read_if_exists(self) -> str | None:
         if self.exists():
@@ -412,6 +535,7 @@ class MetroPlotFile(MetroFile):
     @error_context(msg="Cannot save plot {}", fmt_args=[0])
     def write(self, fig: plt.Figure):
         fig.savefig(self.complete_path, dpi=300)
+        self._record_io("bytes_written")
 
     @override
     @classmethod
@@ -419,3 +543,14 @@ class MetroPlotFile(MetroFile):
         doc = super()._md_doc()
         doc += "- **Type:** Plot\n"
         return doc
+
+
+def geodataframe_size(gdf: gpd.GeoDataFrame) -> int:
+    """Returns an estimation of the memory used by a GeoDataFrame, in bytes."""
+    import shapely
+
+    size = gdf.drop(columns=gdf.geometry.name).memory_usage(deep=True).sum()
+    # Each coordinate is stored as two 64-bit floats, with an overhead of about 100 bytes per
+    # geometry.
+    size += 16 * shapely.get_num_coordinates(gdf.geometry.values).sum() + 100 * len(gdf)
+    return int(size)
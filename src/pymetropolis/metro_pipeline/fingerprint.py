@@ -0,0 +1,56 @@
+import hashlib
+from pathlib import Path
+
+# Size of the chunks read when hashing a file (1 MiB).
+CHUNK_SIZE = 1 << 20
+
+# Fingerprints already computed by this process, indexed by (path, size, mtime).
+_FINGERPRINTS: dict[tuple[str, int, int], str] = dict()
+
+
+def file_fingerprint(path: Path) -> str:
+    """Returns a hash of the content of a file.
+
+    Fingerprints are cached by (path, size, modification time) so that a file is not hashed again
+    when it has not been modified since the last call.
+    """
+    stat = path.stat()
+    key = (str(path.resolve()), stat.st_size, stat.st_mtime_ns)
+    fingerprint = _FINGERPRINTS.get(key)
+    if fingerprint is None:
+        h = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                h.update(chunk)
+        fingerprint = h.hexdigest()
+        _FINGERPRINTS[key] = fingerprint
+    return fingerprint
+
+
+def modification_time(path: Path) -> float:
+    """Returns the last modification time of a file or of a directory.
+
+    The modification time of a directory is the latest modification time of the directory itself
+    and of all the files and directories it contains (recursively), so that editing a file inside
+    a data directory is detected.
+    """
+    mtime = path.stat().st_mtime
+    if path.is_dir():
+        for p in path.rglob("*"):
+            mtime = max(mtime, p.stat().st_mtime)
+    return mtime
+
+
+def fingerprint(path: Path) -> str:
+    """Returns a hash of the content of a file or of a directory.
+
+    The fingerprint of a directory depends on the relative paths and the content of all the files
+    in that directory.
+    """
+    if not path.is_dir():
+        return file_fingerprint(path)
+    h = hashlib.blake2b(digest_size=16)
+    for file in sorted(p for p in path.rglob("*") if p.is_file()):
+        h.update(str(file.relative_to(path)).encode())
+        h.update(file_fingerprint(file).encode())
+    return h.hexdigest()
@@ -1,6 +1,9 @@
+import io
 import sys
 import time
+import traceback
 from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
 from enum import Enum
 
 import click
@@ -8,8 +11,10 @@ import humanize
 from loguru import logger
 from termcolor import colored
 
+from pymetropolis.metro_common import MetropyError
 from pymetropolis.metro_common import logger as metro_logger
 
+from .cache import ARTIFACT_CACHE
 from .config import Config
 from .file import MetroFile
 from .steps import Step
@@ -43,6 +48,7 @@ class MetroPipeline:
     ) -> None:
         metro_logger.setup()
         self.config = config
+        ARTIFACT_CACHE.set_budget(config.memory_cache_size * 1024 * 1024)
         steps = defaultdict(dict)
         all_output_files = set()
         used_keys = set()
@@ -53,15 +59,15 @@ class MetroPipeline:
             # Keep track of all keys used.
             for _, p in step_class._iter_params():
                 used_keys.add(str(p))
-            all_output_files.update(step.output_files.values())
-            if step.is_defined() and step.output_files:
+            all_output_files.update(step._all_output_files())
+            if step.is_defined() and step.output:
                 steps[step]["required_inputs"] = set(
                     map(lambda f: f[1], step._iter_input_files(required=True))
                 )
                 steps[step]["optional_inputs"] = set(
                     map(lambda f: f[1], step._iter_input_files(required=False))
                 )
-                steps[step]["outputs"] = set(map(lambda f: f, step.output_files.values()))
+                steps[step]["outputs"] = set(map(lambda f: f[1], step._iter_output_files()))
         self.steps = steps
         self.check_unused_keys(used_keys)
         self.check_target_step_defined(target_step, step_classes)
@@ -248,13 +254,43 @@ class MetroPipeline:
         ordered_steps = list(sorted(conflict))
         return set(ordered_steps[:-1])
 
-    def run(self, dry_run: bool = False, step_by_step: bool = False):
+    def step_dependencies(self, steps: list[Step]) -> dict[Step, set[Step]]:
+        """Returns, for each Step, the set of Steps in `steps` that generate one of its (required or
+        optional) input files.
+        """
+        producers = {f: s for s in steps for f in self.steps[s]["outputs"]}
+        dependencies = dict()
+        for step in steps:
+            input_files = self.steps[step]["required_inputs"] | self.steps[step]["optional_inputs"]
+            dependencies[step] = {producers[f] for f in input_files if f in producers} - {step}
+        return dependencies
+
+    def skip_unchanged(self, step: Step, status: StepStatus) -> bool:
+        """Returns `True` if an invalidated Step does not need to be run anymore.
+
+        This happens when `content_fingerprint` is enabled and the upstream Steps re-generated
+        input files with the exact same content.
+        In this case, the update file of the Step is refreshed so that the new modification times
+        are recorded.
+        """
+        if status != StepStatus.INVALIDATED or not self.config.content_fingerprint:
+            return False
+        if step.update_required():
+            return False
+        step.save_update_dict(self.config)
+        return True
+
+    def run(self, dry_run: bool = False, step_by_step: bool = False, jobs: int = 1):
         sequence = self.find_sequence()
         if not sequence:
             logger.error("No Step to run.")
             return
         if dry_run:
             self.print_sequence(sequence)
+        elif jobs > 1:
+            if step_by_step:
+                raise MetropyError("Option `--step-by-step` cannot be used with `--jobs` > 1")
+            self.run_sequence_parallel(sequence, jobs)
         else:
             self.run_sequence(sequence, step_by_step=step_by_step)
 
@@ -280,8 +316,11 @@ class MetroPipeline:
         to_run_steps = list(filter(lambda x: x[1] != StepStatus.UP_TO_DATE, sequence))
         if to_run_steps:
             n = len(to_run_steps)
-            for i, (step, _) in enumerate(to_run_steps):
+            for i, (step, status) in enumerate(to_run_steps):
                 logger.info(f"=== Step {i + 1} / {n}: {step} ===")
+                if self.skip_unchanged(step, status):
+                    logger.info("Input files are unchanged, skipping")
+                    continue
                 start = time.time()
                 step.execute(self.config)
                 end = time.time()
@@ -294,3 +333,100 @@ class MetroPipeline:
                         return
         else:
             logger.success("Nothing to do. All steps are still up-to-date!")
+
+    def run_sequence_parallel(self, sequence: list[tuple[Step, StepStatus]], jobs: int):
+        """Runs the Steps of the sequence in parallel, using at most `jobs` processes.
+
+        A Step is started as soon as all the Steps generating its input files are done.
+        The logs of each Step are printed as a single block when the Step is finished.
+        When a Step fails, the Steps depending on it are cancelled but the other Steps are still
+        run.
+        """
+        to_run_steps = [step for step, status in sequence if status != StepStatus.UP_TO_DATE]
+        if not to_run_steps:
+            logger.success("Nothing to do. All steps are still up-to-date!")
+            return
+        statuses = dict(sequence)
+        dependencies = self.step_dependencies(to_run_steps)
+        n = len(to_run_steps)
+        # Steps waiting to be run, in the order of the sequence.
+        pending = list(to_run_steps)
+        running: dict[Future, Step] = dict()
+        done: set[Step] = set()
+        failed: list[Step] = list()
+        cancelled: list[Step] = list()
+        # Each Step is run in a new process so that memory is released when the Step is done.
+        with ProcessPoolExecutor(max_workers=jobs, max_tasks_per_child=1) as executor:
+            while pending or running:
+                for step in list(pending):
+                    if len(running) >= jobs:
+                        break
+                    if dependencies[step].issubset(done):
+                        pending.remove(step)
+                        if self.skip_unchanged(step, statuses[step]):
+                            done.add(step)
+                            i = len(done) + len(failed) + len(cancelled)
+                            logger.info(f"=== Step {i} / {n}: {step} ===")
+                            logger.info("Input files are unchanged, skipping")
+                            continue
+                        logger.debug(f"Starting Step {step}")
+                        running[executor.submit(execute_step, step, self.config)] = step
+                if not running:
+                    if not pending:
+                        # All the remaining Steps were skipped.
+                        break
+                    # This can only happen if there is a cycle in the dependencies.
+                    raise MetropyError(
+                        "Cannot run the remaining Steps: " + ", ".join(map(str, pending))
+                    )
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = running.pop(future)
+                    try:
+                        logs, duration, error = future.result()
+                    except Exception as e:
+                        # The worker process crashed or the Step could not be sent to it.
+                        logs, duration, error = "", 0.0, f"{e.__class__.__name__}: {e}"
+                    i = len(done) + len(failed) + len(cancelled) + 1
+                    logger.info(f"=== Step {i} / {n}: {step} ===")
+                    if logs:
+                        logger.opt(raw=True).info(logs)
+                    if error is None:
+                        done.add(step)
+                        logger.info(f"Done in {humanize.precisedelta(duration)}")
+                        continue
+                    failed.append(step)
+                    logger.error(error)
+                    # Cancel all the pending Steps that depend (directly or not) on the failed Step.
+                    to_cancel = {step}
+                    for other in list(pending):
+                        # `pending` is ordered so dependencies are always visited first.
+                        if dependencies[other] & to_cancel:
+                            to_cancel.add(other)
+                            pending.remove(other)
+                            cancelled.append(other)
+                            logger.warning(f"Cancelling Step {other}")
+        if failed:
+            msg = "Failed to execute step(s): " + ", ".join(map(str, failed))
+            if cancelled:
+                msg += f" ({len(cancelled)} dependent step(s) cancelled)"
+            raise MetropyError(msg)
+
+
+def execute_step(step: Step, config: Config) -> tuple[str, float, str | None]:
+    """Executes a Step in a worker process.
+
+    Returns the logs of the Step, its running time (in seconds) and the error (with its traceback)
+    if the Step failed.
+    """
+    buffer = io.StringIO()
+    metro_logger.setup(buffer)
+    start = time.time()
+    error = None
+    try:
+        step.execute(config)
+    except Exception:
+        # The traceback is formatted here since it cannot be sent to the main process.
+        error = traceback.format_exc()
+    end = time.time()
+    return buffer.getvalue(), end - start, error
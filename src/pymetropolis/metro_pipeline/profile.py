@@ -0,0 +1,246 @@
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+import humanize
+
+from .file import IO_STATS
+
+# Number of steps shown in each table of the profile report.
+REPORT_SIZE = 10
+
+
+# Interval between two samples of the memory of the child processes (in seconds).
+SAMPLING_INTERVAL = 0.2
+
+
+def max_rss() -> tuple[int | None, int | None]:
+    """Returns the maximum resident set size (in bytes) of the current process and of its
+    terminated child processes, over the whole life of the process.
+
+    Returns `None` values on platforms where this is not available (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    # `ru_maxrss` is in kilobytes on Linux and in bytes on macOS.
+    factor = 1 if sys.platform == "darwin" else 1024
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * factor
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * factor
+    return self_rss, children_rss
+
+
+def reset_peak_rss() -> bool:
+    """Resets the peak resident set size of the current process.
+
+    Returns `False` if the peak cannot be reset (the operation is only available on Linux).
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def read_peak_rss(pid: int | str = "self") -> int | None:
+    """Returns the peak resident set size (in bytes) of a process, as reported by `/proc` (Linux
+    only), or `None` if it cannot be read."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def child_pids() -> list[str]:
+    """Returns the ids of the running child processes of the current process (Linux only)."""
+    pids = list()
+    try:
+        for task in os.listdir("/proc/self/task"):
+            with open(f"/proc/self/task/{task}/children") as f:
+                pids.extend(f.read().split())
+    except OSError:
+        pass
+    return pids
+
+
+class ChildrenMemorySampler(threading.Thread):
+    """Thread recording the largest peak resident set size of the running child processes."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak: int | None = None
+        self._stop_event = threading.Event()
+
+    def sample(self):
+        for pid in child_pids():
+            rss = read_peak_rss(pid)
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+
+    def run(self):
+        while not self._stop_event.wait(SAMPLING_INTERVAL):
+            self.sample()
+
+    def stop(self) -> int | None:
+        self._stop_event.set()
+        self.join()
+        return self.peak
+
+
+class StepProfiler:
+    """Measures the resources used while running a Step.
+
+    CPU times include the child processes (e.g., Metropolis-Core executables) that terminated
+    while the Step was running.
+
+    On Linux, the peak RSS of the process is reset when the profiler is created so that the
+    recorded peak is the peak of the Step only, and the peak RSS of the child processes is sampled
+    in a background thread while they run.
+    On other platforms, only the lifetime maximum RSS is available: a peak is recorded only if the
+    Step raised that maximum, otherwise it is unknown (`None`).
+    """
+
+    def __init__(self):
+        self.start_datetime = datetime.now()
+        self.start_time = time.perf_counter()
+        self.start_cpu = os.times()
+        self.start_io = dict(IO_STATS)
+        self.start_rss = max_rss()
+        self.peak_was_reset = reset_peak_rss()
+        self.sampler = ChildrenMemorySampler()
+        self.sampler.start()
+
+    def peak_rss(self) -> tuple[int | None, int | None]:
+        """Returns the peak RSS of the current process and of its child processes since the
+        profiler was created."""
+        children_peak = self.sampler.stop()
+        end_rss = max_rss()
+        if self.peak_was_reset:
+            self_peak = read_peak_rss()
+        elif end_rss[0] is not None and end_rss[0] > (self.start_rss[0] or 0):
+            self_peak = end_rss[0]
+        else:
+            self_peak = None
+        if end_rss[1] is not None and end_rss[1] > (self.start_rss[1] or 0):
+            # A child process terminated during the Step with a new lifetime maximum (this catches
+            # child processes too short-lived to be sampled).
+            children_peak = max(children_peak or 0, end_rss[1])
+        return self_peak, children_peak
+
+    def finish(self) -> dict[str, Any]:
+        """Returns a dictionary with the resources used since the profiler was created."""
+        end_cpu = os.times()
+        self_rss, children_rss = self.peak_rss()
+        return {
+            "start": self.start_datetime.isoformat(timespec="seconds"),
+            "wall_time": time.perf_counter() - self.start_time,
+            "user_time": end_cpu.user - self.start_cpu.user,
+            "system_time": end_cpu.system - self.start_cpu.system,
+            "children_user_time": end_cpu.children_user - self.start_cpu.children_user,
+            "children_system_time": end_cpu.children_system - self.start_cpu.children_system,
+            "peak_rss": self_rss,
+            "children_peak_rss": children_rss,
+            "bytes_read": IO_STATS["bytes_read"] - self.start_io["bytes_read"],
+            "bytes_written": IO_STATS["bytes_written"] - self.start_io["bytes_written"],
+        }
+
+
+def profile_path(main_directory: Path) -> Path:
+    return main_directory / "update_files" / "profile.jsonl"
+
+
+def save_profile(record: dict[str, Any], main_directory: Path):
+    """Appends a profile record to the profile file."""
+    with open(profile_path(main_directory), "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def read_profiles(main_directory: Path) -> list[dict[str, Any]]:
+    """Returns all the profile records saved in the main directory."""
+    path = profile_path(main_directory)
+    if not path.exists():
+        return list()
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize_profiles(records: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Aggregates profile records by Step.
+
+    For each Step, returns the number of runs (and of failed runs), the mean and maximum wall
+    time, the mean CPU time, the maximum peak RSS (including child processes) and the number of
+    output rows of the last successful run.
+    """
+    by_step = dict()
+    for record in records:
+        by_step.setdefault(record["step"], []).append(record)
+    summary = list()
+    for step, step_records in by_step.items():
+        n = len(step_records)
+        cpu_times = [
+            r["user_time"] + r["system_time"] + r["children_user_time"] + r["children_system_time"]
+            for r in step_records
+        ]
+        rss = [
+            max(r["peak_rss"] or 0, r["children_peak_rss"] or 0)
+            for r in step_records
+            if r["peak_rss"] is not None or r["children_peak_rss"] is not None
+        ]
+        successes = [r for r in step_records if not r.get("failed", False)]
+        summary.append(
+            {
+                "step": step,
+                "runs": n,
+                "failed_runs": n - len(successes),
+                "mean_wall_time": sum(r["wall_time"] for r in step_records) / n,
+                "max_wall_time": max(r["wall_time"] for r in step_records),
+                "mean_cpu_time": sum(cpu_times) / n,
+                "max_peak_rss": max(rss) if rss else None,
+                "last_rows": sum(successes[-1]["output_rows"].values()) if successes else 0,
+            }
+        )
+    return summary
+
+
+def print_profile(main_directory: Path):
+    """Prints the slowest and most memory-hungry Steps across all the recorded runs."""
+    records = read_profiles(main_directory)
+    if not records:
+        print("No profile recorded yet.")
+        return
+    summary = summarize_profiles(records)
+    s = "Slowest steps (mean wall time):\n"
+    slowest = sorted(summary, key=lambda x: x["mean_wall_time"], reverse=True)
+    for i, x in enumerate(slowest[:REPORT_SIZE]):
+        s += (
+            f"{i + 1}. {x['step']}: {humanize.precisedelta(x['mean_wall_time'])} "
+            f"(CPU: {humanize.precisedelta(x['mean_cpu_time'])}, "
+            f"max: {humanize.precisedelta(x['max_wall_time'])}, runs: {x['runs']}"
+        )
+        if x["failed_runs"]:
+            s += f", failed: {x['failed_runs']}"
+        s += ")\n"
+    hungriest = sorted(
+        filter(lambda x: x["max_peak_rss"] is not None, summary),
+        key=lambda x: x["max_peak_rss"],
+        reverse=True,
+    )
+    if hungriest:
+        s += "\nMost memory-hungry steps (peak RSS):\n"
+        for i, x in enumerate(hungriest[:REPORT_SIZE]):
+            s += (
+                f"{i + 1}. {x['step']}: {humanize.naturalsize(x['max_peak_rss'], binary=True)} "
+                f"(output rows: {x['last_rows']:,}, runs: {x['runs']})\n"
+            )
+    print(s)
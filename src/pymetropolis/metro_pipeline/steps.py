@@ -9,9 +9,9 @@ from pymetropolis.metro_common.errors import MetropyError, error_context
 
 from .config import Config
 from .file import MetroFile
+from .fingerprint import fingerprint, modification_time
 from .parameters import Parameter, PathParameter
-
-# TODO: Add something to measure running time for each step.
+from .profile import StepProfiler, save_profile
 
 
 class InputFile:
@@ -42,18 +42,44 @@ class InputFile:
         return doc
 
 
+class OutputFile:
+    def __init__(
+        self,
+        file_class: type[MetroFile],
+        when: Callable[[Any], bool] | None = None,
+        when_doc: str | None = None,
+    ):
+        self.file_class = file_class
+        self.when = when
+        self.when_doc = when_doc
+
+    def is_needed(self, step: "Step") -> bool:
+        if self.when:
+            return self.when(step)
+        else:
+            return True
+
+    def _md_doc(self) -> str:
+        doc = f"[`{self.file_class.__name__}`](files.html#{self.file_class.__name__.lower()})"
+        if self.when_doc:
+            doc += f" [{self.when_doc}]"
+        return doc
+
+
 class Step:
     input_files: ClassVar[dict[str, InputFile | type[MetroFile]]] = {}
-    output_files: ClassVar[dict[str, type[MetroFile]]] = {}
+    output_files: ClassVar[dict[str, OutputFile | type[MetroFile]]] = {}
     priority: ClassVar[int] = 1
     _input_files: dict[str, MetroFile]
     _output_files: dict[str, MetroFile]
     _update_file_path: Path
     _config_dict: dict[str, Any]
     _data_files: dict[str, Path]
+    _content_fingerprint: bool
 
     def __init__(self, config: Config):
         self._config_dict = dict()
+        self._content_fingerprint = config.content_fingerprint
         self._data_files = dict()
         for param_name, param_obj in self.__class__._iter_params():
             value = param_obj.from_config(config)
@@ -72,7 +98,7 @@ class Step:
             k: f.from_dir(config.main_directory) for k, f in self._iter_input_files()
         }
         self._output_files = {
-            k: f.from_dir(config.main_directory) for k, f in self.output_files.items()
+            k: f.from_dir(config.main_directory) for k, f in self._iter_output_files()
         }
         self._update_file_path = config.main_directory / "update_files" / f"{self}.json"
 
@@ -103,6 +129,21 @@ class Step:
                     continue
                 yield name, file_spec
 
+    def _iter_output_files(self):
+        for name, file_spec in self.output_files.items():
+            if isinstance(file_spec, OutputFile):
+                if not file_spec.is_needed(self):
+                    # File is not generated given the configured parameters.
+                    continue
+                yield name, file_spec.file_class
+            else:
+                yield name, file_spec
+
+    @classmethod
+    def _all_output_files(cls) -> list[type[MetroFile]]:
+        """Returns the classes of all the files that the step can generate."""
+        return [f.file_class if isinstance(f, OutputFile) else f for f in cls.output_files.values()]
+
     def __str__(self) -> str:
         return self.__class__.__name__
 
@@ -151,7 +192,24 @@ class Step:
 
     @error_context(msg="Failed to execute step `{}`", fmt_args=[0])
     def execute(self, config: Config):
-        self.run()
+        profiler = StepProfiler()
+        failed = True
+        try:
+            self.run()
+            failed = False
+        finally:
+            # The profile is saved even if the step failed.
+            record = {"step": str(self), "failed": failed, **profiler.finish()}
+            record["output_rows"] = (
+                dict()
+                if failed
+                else {
+                    k: n
+                    for k, f in self.output.items()
+                    if f.exists() and (n := f.num_rows()) is not None
+                }
+            )
+            save_profile(record, config.main_directory)
         self.save_update_dict(config)
 
     def update_required(self) -> bool:
@@ -163,6 +221,9 @@ class Step:
         - Any InputFile has been modified.
         - Any input MetroFile has been modified.
         - Any output MetroFile has been deleted / modified.
+
+        When `content_fingerprint` is enabled in the config, a file is considered modified only if
+        its content changed.
         """
         update_dict = self.update_dict()
         if update_dict is None:
@@ -172,11 +233,12 @@ class Step:
         for k, v in self._data_files.items():
             if v is None:
                 continue
-            if not v.exists() and update_dict.get(f"data_file_{k}_mtime") is not None:
-                # A file that was previously read no longer exists.
-                return True
-            # TODO: Handle data directories.
-            if v.stat().st_mtime != update_dict.get(f"data_file_{k}_mtime"):
+            if not v.exists():
+                if update_dict.get(f"data_file_{k}_mtime") is not None:
+                    # A file that was previously read no longer exists.
+                    return True
+                continue
+            if self.file_modified(v, f"data_file_{k}", update_dict):
                 # The file exists but was updated since the last run (or did not exist before).
                 return True
         # Check that the input / output MetroFiles have not been modified.
@@ -189,12 +251,26 @@ class Step:
                 else:
                     # it has been removed.
                     return True
-            if f.last_modified_time() != update_dict.get(f"metro_file_{k}_mtime"):
+            if self.file_modified(f.get_path(), f"metro_file_{k}", update_dict):
                 # The file exists but was updated since the last run (or did not exist before).
                 return True
         # Check that the relevant config has not been modified.
         return self.config_hash() != update_dict.get("config_hash")
 
+    def file_modified(self, path: Path, key: str, update_dict: dict) -> bool:
+        """Returns `True` if the file at the given path was modified since the update dict was
+        saved.
+
+        For a directory, the modification time is the latest modification time of all its
+        content. When `content_fingerprint` is enabled, a file with a new modification time is
+        considered unmodified if its content fingerprint did not change.
+        """
+        if modification_time(path) == update_dict.get(f"{key}_mtime"):
+            return False
+        if not self._content_fingerprint or update_dict.get(f"{key}_hash") is None:
+            return True
+        return fingerprint(path) != update_dict[f"{key}_hash"]
+
     def update_dict(self) -> dict | None:
         """Returns a dictionary representing the update file of this step.
 
@@ -221,11 +297,15 @@ class Step:
             if v is None or not v.exists():
                 # Input file is not specified.
                 continue
-            update_dict[f"data_file_{k}_mtime"] = v.stat().st_mtime
+            update_dict[f"data_file_{k}_mtime"] = modification_time(v)
+            if self._content_fingerprint:
+                update_dict[f"data_file_{k}_hash"] = fingerprint(v)
         for k, f in chain(self.input.items(), self.output.items()):
             if not f.exists():
                 continue
             update_dict[f"metro_file_{k}_mtime"] = f.last_modified_time()
+            if self._content_fingerprint:
+                update_dict[f"metro_file_{k}_hash"] = fingerprint(f.get_path())
         update_dict["config_hash"] = self.config_hash()
         with open(self._update_file_path, "w", encoding="utf-8") as f:
             json.dump(update_dict, f)
@@ -277,7 +357,10 @@ class Step:
     def _md_doc_output_files(cls) -> str:
         files = list()
         for ofile in cls.output_files.values():
-            files.append(f"[`{ofile.__name__}`](files.html#{ofile.__name__.lower()})")
+            if isinstance(ofile, OutputFile):
+                files.append(ofile._md_doc())
+            else:
+                files.append(f"[`{ofile.__name__}`](files.html#{ofile.__name__.lower()})")
         if files:
             doc = "\n- **Output files:** " + ", ".join(sorted(files)) + "\n"
             return doc
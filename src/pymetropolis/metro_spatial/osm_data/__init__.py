@@ -0,0 +1,5 @@
+from .file import OSMAreasFile, OSMNodesFile, OSMWaysFile
+from .osm import OpenStreetMapAreasStep, OpenStreetMapDataStep
+
+OSM_DATA_FILES = [OSMWaysFile, OSMNodesFile, OSMAreasFile]
+OSM_DATA_STEPS = [OpenStreetMapDataStep, OpenStreetMapAreasStep]
@@ -0,0 +1,83 @@
+from pymetropolis.metro_pipeline.file import Column, MetroDataFrameFile, MetroDataType
+
+
+class OSMWaysFile(MetroDataFrameFile):
+    path = "osm/ways.parquet"
+    description = "OpenStreetMap ways with a `highway` tag, read from the OpenStreetMap file."
+    schema = [
+        Column(
+            "osm_id",
+            MetroDataType.ID,
+            description="OpenStreetMap id of the way.",
+            unique=True,
+            nullable=False,
+        ),
+        Column(
+            "highway",
+            MetroDataType.STRING,
+            description="Value of the `highway` tag.",
+            nullable=False,
+        ),
+        Column(
+            "tags",
+            MetroDataType.ANY,
+            description="List of all the tags of the way, as `key` / `value` structs.",
+            nullable=False,
+        ),
+        Column(
+            "nodes",
+            MetroDataType.LIST_OF_IDS,
+            description="OpenStreetMap ids of the way's nodes.",
+            nullable=False,
+        ),
+    ]
+
+
+class OSMNodesFile(MetroDataFrameFile):
+    path = "osm/nodes.parquet"
+    description = "Nodes of the OpenStreetMap ways with a `highway` tag."
+    schema = [
+        Column(
+            "osm_id",
+            MetroDataType.ID,
+            description="OpenStreetMap id of the node.",
+            unique=True,
+            nullable=False,
+        ),
+        Column("lon", MetroDataType.FLOAT, description="Longitude of the node.", nullable=False),
+        Column("lat", MetroDataType.FLOAT, description="Latitude of the node.", nullable=False),
+        Column(
+            "tags",
+            MetroDataType.ANY,
+            description=(
+                "List of all the tags of the node, as `key` / `value` structs (only for the nodes "
+                "with a tag key used by the network imports)."
+            ),
+        ),
+    ]
+
+
+class OSMAreasFile(MetroDataFrameFile):
+    path = "osm/areas.parquet"
+    description = (
+        "OpenStreetMap areas with one of the urban `landuse` tags or with the `admin_level` of the "
+        "simulation area."
+    )
+    schema = [
+        Column(
+            "osm_id",
+            MetroDataType.ID,
+            description="Osmium id of the area (built from the id of the way or relation).",
+            unique=True,
+            nullable=False,
+        ),
+        Column("landuse", MetroDataType.STRING, description="Value of the `landuse` tag."),
+        Column("admin_level", MetroDataType.STRING, description="Value of the `admin_level` tag."),
+        Column("name", MetroDataType.STRING, description="Value of the `name` tag."),
+        Column(
+            "geometry",
+            MetroDataType.ANY,
+            description="MultiPolygon of the area, as WKB, in WGS 84.",
+            nullable=False,
+        ),
+    ]
@@ -0,0 +1,360 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from loguru import logger
+
+from pymetropolis.metro_common import MetropyError
+from pymetropolis.metro_pipeline.parameters import IntParameter, ListParameter
+from pymetropolis.metro_pipeline.types import Float, String
+from pymetropolis.metro_spatial import OSMStep
+
+from .file import OSMAreasFile, OSMNodesFile, OSMWaysFile
+
+if TYPE_CHECKING:
+    import polars as pl
+
+# Tag keys of the nodes whose tags are stored (the other nodes only have their coordinates stored).
+NODE_TAG_KEYS = ("highway", "traffic_calming")
+
+
+class OSMWay:
+    """OpenStreetMap way read from the OSM data files, with the same interface as osmium's ways
+    (for the attributes used by the network imports)."""
+
+    __slots__ = ("id", "nodes", "tags")
+
+    def __init__(self, id: int, tags: dict[str, str], nodes: list[int]):
+        self.id = id
+        self.tags = tags
+        self.nodes = nodes
+
+    def is_closed(self) -> bool:
+        return self.nodes[0] == self.nodes[-1]
+
+
+class OSMNode:
+    """OpenStreetMap node read from the OSM data files, with the same interface as osmium's nodes
+    (for the attributes used by the network imports)."""
+
+    __slots__ = ("id", "lat", "lon", "tags")
+
+    def __init__(self, id: int, lon: float, lat: float, tags: dict[str, str]):
+        self.id = id
+        self.lon = lon
+        self.lat = lat
+        self.tags = tags
+
+
+def read_osm_data(
+    osm_file: Path, bbox: list[float] | None = None
+) -> tuple[pl.DataFrame, pl.DataFrame]:
+    """Reads the OpenStreetMap ways and nodes used by the network imports from an OSM file, in a
+    single pass.
+
+    Returns two DataFrames:
+
+    - The ways with a `highway` tag, with all their tags and their nodes.
+    - The nodes of these ways, with their coordinates and, for the nodes with one of the tag keys
+      in `NODE_TAG_KEYS`, all their tags.
+
+    If `bbox` is given (`[minx, miny, maxx, maxy]`, in WGS 84), only the ways intersecting that
+    bounding box are returned.
+    """
+    from array import array
+
+    import numpy as np
+    import osmium
+    import polars as pl
+    import pyarrow as pa
+    import shapely
+    from osmium.filter import EntityFilter, KeyFilter
+    from osmium.osm import NODE, WAY
+
+    processor = (
+        osmium.FileProcessor(osm_file)
+        .with_locations()
+        .with_filter(EntityFilter(NODE | WAY))
+        .with_filter(KeyFilter("highway").enable_for(WAY))
+        .with_filter(KeyFilter(*NODE_TAG_KEYS).enable_for(NODE))
+    )
+    way_ids = array("Q")
+    # Tags of the ways, concatenated.
+    way_tags = TagsBuilder()
+    # Node ids and coordinates of the ways, concatenated.
+    refs = array("Q")
+    lons = array("d")
+    lats = array("d")
+    offsets = array("q", [0])
+    node_ids = array("Q")
+    node_tags = TagsBuilder()
+    nb_invalid = 0
+    logger.debug("Reading OSM file")
+    for obj in processor:
+        if obj.is_way():
+            way_nodes = obj.nodes  # ty: ignore[unresolved-attribute]
+            if len(way_nodes) < 2:
+                nb_invalid += 1
+                continue
+            start = len(refs)
+            try:
+                for n in way_nodes:
+                    lons.append(n.lon)
+                    lats.append(n.lat)
+                    refs.append(n.ref)
+            except osmium.InvalidLocationError:
+                # Some nodes of the way are missing.
+                del refs[start:], lons[start:], lats[start:]
+                nb_invalid += 1
+                continue
+            offsets.append(len(refs))
+            way_ids.append(obj.id)
+            way_tags.add(obj.tags)
+        else:
+            node_ids.append(obj.id)
+            node_tags.add(obj.tags)
+    if nb_invalid:
+        logger.warning(f"Skipped {nb_invalid:,} ways with less than two nodes or missing nodes")
+    logger.debug("Building DataFrames")
+    refs = np.frombuffer(refs, dtype=np.uint64)
+    lons = np.frombuffer(lons, dtype=np.float64)
+    lats = np.frombuffer(lats, dtype=np.float64)
+    offsets = np.frombuffer(offsets, dtype=np.int64)
+    tags = way_tags.build()
+    ways = pl.DataFrame(
+        {
+            "osm_id": np.frombuffer(way_ids, dtype=np.uint64),
+            "highway": tags.list.eval(
+                pl.element().filter(pl.element().struct.field("key") == "highway")
+            )
+            .list.first()
+            .struct.field("value"),
+            "tags": tags,
+            "nodes": pl.from_arrow(pa.LargeListArray.from_arrays(offsets, pa.array(refs))),
+        }
+    )
+    if bbox is not None:
+        logger.debug("Filtering based on bounding box")
+        box = shapely.box(*bbox)
+        way_index = np.repeat(np.arange(len(ways)), np.diff(offsets))
+        mask = shapely.intersects(box, shapely.linestrings(lons, lats, indices=way_index))
+        ways = ways.filter(pl.Series(mask))
+        node_mask = np.repeat(mask, np.diff(offsets))
+        refs, lons, lats = refs[node_mask], lons[node_mask], lats[node_mask]
+    if ways.is_empty():
+        raise MetropyError("No valid highway in the OpenStreetMap data")
+    tagged_nodes = pl.DataFrame(
+        {"osm_id": np.frombuffer(node_ids, dtype=np.uint64), "tags": node_tags.build()}
+    )
+    nodes = (
+        pl.DataFrame({"osm_id": refs, "lon": lons, "lat": lats})
+        .unique("osm_id", keep="first", maintain_order=True)
+        .join(tagged_nodes, on="osm_id", how="left", maintain_order="left")
+    )
+    return ways, nodes
+
+
+def read_osm_areas(
+    osm_file: Path,
+    landuse_tags: list[str] | None = None,
+    admin_level: int | None = None,
+    bbox: list[float] | None = None,
+) -> pl.DataFrame:
+    """Reads the OpenStreetMap areas (closed ways and multipolygon or boundary relations) with a
+    `landuse` tag in `landuse_tags` or with the given `admin_level` tag.
+
+    Returns a DataFrame with the id, the `landuse`, `admin_level` and `name` tags and the geometry
+    (as WKB, in WGS 84) of the areas.
+
+    If `bbox` is given (`[minx, miny, maxx, maxy]`, in WGS 84), only the areas intersecting that
+    bounding box are returned.
+    """
+    import osmium
+    import polars as pl
+    import shapely
+    from osmium.filter import EntityFilter, TagFilter
+    from osmium.geom import WKBFactory
+    from osmium.osm import AREA
+
+    tag_pairs = [("landuse", tag) for tag in landuse_tags or []]
+    if admin_level is not None:
+        tag_pairs.append(("admin_level", str(admin_level)))
+    # The tag filter is also applied when selecting the relations to be assembled as areas so that
+    # only the relevant multipolygons are built.
+    processor = (
+        osmium.FileProcessor(osm_file)
+        .with_areas(TagFilter(*tag_pairs))
+        .with_filter(EntityFilter(AREA))
+        .with_filter(TagFilter(*tag_pairs))
+    )
+    areas = {key: list() for key in ("osm_id", "landuse", "admin_level", "name", "geometry")}
+    fab = WKBFactory()
+    logger.debug("Reading areas from OSM file")
+    for area in processor:
+        areas["osm_id"].append(area.id)
+        areas["landuse"].append(area.tags.get("landuse"))
+        areas["admin_level"].append(area.tags.get("admin_level"))
+        areas["name"].append(area.tags.get("name"))
+        # The WKB factory returns hex-encoded strings.
+        areas["geometry"].append(bytes.fromhex(fab.create_multipolygon(area)))  # ty: ignore[invalid-argument-type]
+    df = pl.DataFrame(
+        areas,
+        schema={
+            "osm_id": pl.UInt64,
+            "landuse": pl.String,
+            "admin_level": pl.String,
+            "name": pl.String,
+            "geometry": pl.Binary,
+        },
+    )
+    if bbox is not None:
+        logger.debug("Filtering based on bounding box")
+        mask = shapely.intersects(shapely.box(*bbox), shapely.from_wkb(df["geometry"].to_numpy()))
+        df = df.filter(pl.Series(mask, dtype=pl.Boolean))
+    return df
+
+
+class TagsBuilder:
+    """Collects the tags of OSM objects as concatenated keys and values, to build a column of
+    lists of `key` / `value` structs (with dictionary-encoded keys)."""
+
+    def __init__(self):
+        from array import array
+
+        self.keys: list[str] = list()
+        self.values: list[str] = list()
+        self.offsets = array("q", [0])
+
+    def add(self, tags):
+        for tag in tags:
+            self.keys.append(tag.k)
+            self.values.append(tag.v)
+        self.offsets.append(len(self.keys))
+
+    def build(self) -> pl.Series:
+        import numpy as np
+        import polars as pl
+        import pyarrow as pa
+
+        structs = pa.StructArray.from_arrays(
+            [
+                pa.array(self.keys).dictionary_encode(),
+                pa.array(self.values, type=pa.large_string()),
+            ],
+            names=["key", "value"],
+        )
+        offsets = pa.array(np.frombuffer(self.offsets, dtype=np.int64))
+        return pl.Series("tags", pa.LargeListArray.from_arrays(offsets, structs))
+
+
+def tags_as_dicts(tags: pl.Series) -> list[dict[str, str]]:
+    """Returns the tags of a column of lists of `key` / `value` structs as dictionaries."""
+    import polars as pl
+
+    df = tags.to_frame("tags").select(
+        keys=pl.col("tags").list.eval(pl.element().struct.field("key").cast(pl.String)),
+        values=pl.col("tags").list.eval(pl.element().struct.field("value")),
+    )
+    return [dict(zip(keys, values)) for keys, values in df.iter_rows()]
+
+
+def has_tag_key(keys: list[str] | tuple[str, ...]) -> pl.Expr:
+    """Returns an expression which is `True` for the rows whose `tags` contain one of the keys."""
+    import polars as pl
+
+    return (
+        pl.col("tags")
+        .list.eval(pl.element().struct.field("key").cast(pl.String).is_in(keys))
+        .list.any()
+        .fill_null(False)
+    )
+
+
+class OpenStreetMapDataStep(OSMStep):
+    """Reads the OpenStreetMap data used by the network imports from the OpenStreetMap file.
+
+    The OpenStreetMap file is decoded only once and the data is stored in columnar files, from
+    which the road, pedestrian and bicycle networks are read:
+
+    - ways with a `highway` tag, with all their tags and the ids of their nodes,
+    - coordinates of the nodes of these ways (with the tags of the nodes with a `highway` or
+      `traffic_calming` tag).
+
+    The [`osm_data.bbox`](parameters.md#osm_databbox) parameter can be used to store only the ways
+    intersecting a bounding box, which reduces the size of the files when the OpenStreetMap file
+    covers a much larger region than the simulation area.
+    """
+
+    bbox = ListParameter(
+        "osm_data.bbox",
+        inner=Float(),
+        length=4,
+        description=(
+            "Bounding box of the OpenStreetMap data to be read, as [minx, miny, maxx, maxy], in "
+            "WGS 84 (longitude, latitude)."
+        ),
+        example="`[1.4777, 48.3955, 3.6200, 49.2032]`",
+        note="If not specified, all the data of the OpenStreetMap file is read.",
+    )
+    output_files = {"ways": OSMWaysFile, "nodes": OSMNodesFile}
+    priority = 0
+
+    def is_defined(self) -> bool:
+        return self.osm_file is not None
+
+    def run(self):
+        assert self.osm_file is not None
+        logger.info("Reading OpenStreetMap data")
+        ways, nodes = read_osm_data(self.osm_file, self.bbox)
+        self.output["ways"].write(ways)
+        self.output["nodes"].write(nodes)
+
+
+class OpenStreetMapAreasStep(OSMStep):
+    """Reads the OpenStreetMap areas used to build the urban areas and the simulation area from
+    the OpenStreetMap file.
+
+    Only the areas (closed ways and multipolygon or boundary relations) with a `landuse` tag in
+    [`osm_urban_areas.urban_landuse_tags`](parameters.md#osm_urban_areasurban_landuse_tags) or with
+    the [`simulation_area.osm_admin_level`](parameters.md#simulation_areaosm_admin_level)
+    administrative level are read, with their geometry.
+    """
+
+    urban_landuse_tags = ListParameter(
+        "osm_urban_areas.urban_landuse_tags",
+        inner=String(),
+        min_length=1,
+        description="List of `landuse=*` OpenStreetMap tags that define urban areas.",
+        example='`["residential", "industrial", "commercial", "retail"]`',
+    )
+    osm_admin_level = IntParameter(
+        "simulation_area.osm_admin_level",
+        description="Administrative level to be considered when reading administrative boundaries.",
+    )
+    bbox = ListParameter(
+        "osm_data.bbox",
+        inner=Float(),
+        length=4,
+        description=(
+            "Bounding box of the OpenStreetMap data to be read, as [minx, miny, maxx, maxy], in "
+            "WGS 84 (longitude, latitude)."
+        ),
+        example="`[1.4777, 48.3955, 3.6200, 49.2032]`",
+        note="If not specified, all the data of the OpenStreetMap file is read.",
+    )
+    output_files = {"areas": OSMAreasFile}
+    priority = 0
+
+    def is_defined(self) -> bool:
+        return self.osm_file is not None and (
+            self.urban_landuse_tags is not None or self.osm_admin_level is not None
+        )
+
+    def run(self):
+        assert self.osm_file is not None
+        logger.info("Reading OpenStreetMap areas")
+        areas = read_osm_areas(
+            self.osm_file, self.urban_landuse_tags, self.osm_admin_level, self.bbox
+        )
+        self.output["areas"].write(areas)
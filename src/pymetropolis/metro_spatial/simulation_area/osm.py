@@ -5,6 +5,7 @@ from loguru import logger
 from pymetropolis.metro_common.errors import MetropyError
 from pymetropolis.metro_pipeline.parameters import CustomParameter, FloatParameter, IntParameter
 from pymetropolis.metro_spatial import GeoStep, OSMStep
+from pymetropolis.metro_spatial.osm_data.file import OSMAreasFile
 
 from .common import buffer_area, geom_as_gdf
 from .file import SimulationAreaFile
@@ -94,6 +95,7 @@ class SimulationAreaFromOSMStep(GeoStep, OSMStep):
             "Positive values extend the area, while negative values shrink it."
         ),
     )
+    input_files = {"osm_areas": OSMAreasFile}
     output_files = {"simulation_area": SimulationAreaFile}
 
     def is_defined(self) -> bool:
@@ -106,43 +108,31 @@ class SimulationAreaFromOSMStep(GeoStep, OSMStep):
 
     def run(self):
         import geopandas as gpd
-        import osmium
-        from osmium.filter import TagFilter
-        from osmium.geom import WKBFactory
-        from osmium.osm import Area
-
-        assert self.osm_file is not None
+        import polars as pl
 
         names = self.osm_name
         if len(names) == 0:
             raise MetropyError("You must provide at least one name to be selected")
         if isinstance(names, str):
             # Only one name provided.
-            name_pairs = (("name", names),)
-        else:
-            name_pairs = tuple(("name", name) for name in names)
-        fab = WKBFactory()
-        logger.debug("Reading areas from OSM file")
-        found_names = list()
-        polygons = list()
-        for area in (
-            osmium.FileProcessor(self.osm_file)
-            .with_filter(TagFilter(("admin_level", str(self.osm_admin_level))))
-            .with_filter(TagFilter(*name_pairs))
-            .with_areas()
-        ):
-            if area.is_area():  # ty: ignore[unresolved-attribute]
-                assert isinstance(area, Area)
-                found_names.append(area.tags["name"])
-                polygons.append(fab.create_multipolygon(area))
-        if not found_names:
+            names = [names]
+        logger.debug("Reading administrative areas")
+        df = (
+            self.input["osm_areas"]
+            .scan()
+            .filter(pl.col("admin_level") == str(self.osm_admin_level), pl.col("name").is_in(names))
+            .select("name", "geometry")
+            .collect()
+        )
+        if df.is_empty():
             raise MetropyError(
                 f"The OpenStreetMap data does not contain any relation with \
                 `admin_level={self.osm_admin_level}` and `name` in `{names}`"
             )
         logger.debug("Building GeoDataFrame")
         gdf = gpd.GeoDataFrame(
-            {"name": names}, geometry=gpd.GeoSeries.from_wkb(polygons, crs="EPSG:4326")
+            {"name": df["name"].to_list()},
+            geometry=gpd.GeoSeries.from_wkb(df["geometry"].to_list(), crs="EPSG:4326"),
         )
         missing_names = set(names).difference(set(gdf["name"]))
         if missing_names:
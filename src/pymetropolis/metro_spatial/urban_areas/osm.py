@@ -1,61 +1,56 @@
 from __future__ import annotations
 
-from pathlib import Path
 from typing import TYPE_CHECKING
 
 from loguru import logger
 
+from pymetropolis.common import ThreadedStep
+from pymetropolis.metro_common.area_filter import AreaFilter
 from pymetropolis.metro_pipeline.parameters import FloatParameter, ListParameter
 from pymetropolis.metro_pipeline.steps import InputFile
 from pymetropolis.metro_pipeline.types import String
 from pymetropolis.metro_spatial import GeoStep, OSMStep
+from pymetropolis.metro_spatial.osm_data.file import OSMAreasFile
 from pymetropolis.metro_spatial.simulation_area.file import SimulationAreaFile
 
 from .file import UrbanAreasFile
 
 if TYPE_CHECKING:
+    import polars as pl
     import pyproj
 
 
 def read_osm_urban_areas(
-    osm_file: Path,
+    areas: pl.LazyFrame,
     landuse_tags: list[str],
     buffer: float,
     crs: pyproj.CRS,
     simulation_area_file: SimulationAreaFile,
+    nb_threads: int | None = None,
 ):
-    """Reads the areas with a urban landuse in the OSM file and returns a MultiPolygon representing
-    all these urban areas.
+    """Reads the areas with a urban landuse in the OpenStreetMap areas and returns a MultiPolygon
+    representing all these urban areas.
     """
     import geopandas as gpd
-    import osmium
-    from osmium.filter import TagFilter
-    from osmium.geom import WKBFactory
+    import polars as pl
 
     filter_polygon = simulation_area_file.get_area_opt()
     logger.info("Reading urban areas")
-    ids = list()
-    tags = list()
-    polygons = list()
-    fab = WKBFactory()
-    valid_tag_pairs = tuple(("landuse", tag) for tag in landuse_tags)
-    logger.debug("Reading areas from OSM file")
-    for area in (
-        osmium.FileProcessor(osm_file).with_filter(TagFilter(*valid_tag_pairs)).with_areas()
-    ):
-        if area.is_area():  # ty: ignore[unresolved-attribute]
-            ids.append(area.id)
-            tags.append(area.tags["landuse"])
-            polygons.append(fab.create_multipolygon(area))  # ty: ignore[invalid-argument-type]
+    df = (
+        areas.filter(pl.col("landuse").is_in(landuse_tags))
+        .select("osm_id", "landuse", "geometry")
+        .collect()
+    )
     logger.debug("Building GeoDataFrame")
     gdf = gpd.GeoDataFrame(
-        {"osm_id": ids, "landuse": tags}, geometry=gpd.GeoSeries.from_wkb(polygons, crs="EPSG:4326")
+        {"osm_id": df["osm_id"].to_numpy(), "landuse": df["landuse"].to_list()},
+        geometry=gpd.GeoSeries.from_wkb(df["geometry"].to_list(), crs="EPSG:4326"),
     )
     logger.debug("Converting to required CRS")
     gdf.to_crs(crs, inplace=True)
     if filter_polygon is not None:
         logger.debug("Filtering based on area")
-        mask = [filter_polygon.intersects(geom) for geom in gdf.geometry]
+        mask = AreaFilter(filter_polygon, nb_threads).intersects(gdf.geometry.values)
         gdf = gdf.loc[mask].copy()
     logger.debug("Computing union of all urban areas")
     urban_area = gdf.union_all()
@@ -65,7 +60,7 @@ def read_osm_urban_areas(
     return gdf
 
 
-class OpenStreetMapUrbanAreasStep(GeoStep, OSMStep):
+class OpenStreetMapUrbanAreasStep(GeoStep, OSMStep, ThreadedStep):
     """Identifies urban areas from OpenStreetMap data.
 
     Urban areas are read from the OpenStreetMap areas with tag
@@ -119,7 +114,10 @@ class OpenStreetMapUrbanAreasStep(GeoStep, OSMStep):
         ),
     )
 
-    input_files = {"simulation_area": InputFile(SimulationAreaFile, optional=True)}
+    input_files = {
+        "osm_areas": OSMAreasFile,
+        "simulation_area": InputFile(SimulationAreaFile, optional=True),
+    }
     output_files = {"urban_areas": UrbanAreasFile}
 
     def is_defined(self) -> bool:
@@ -136,10 +134,11 @@ class OpenStreetMapUrbanAreasStep(GeoStep, OSMStep):
         assert self.buffer is not None
 
         gdf = read_osm_urban_areas(
-            osm_file=self.osm_file,
+            areas=self.input["osm_areas"].scan(),
             landuse_tags=self.urban_landuse_tags,
             buffer=self.buffer,
             crs=self.crs,
             simulation_area_file=self.input["simulation_area"],  # ty: ignore[invalid-argument-type]
+            nb_threads=self.nb_threads,
         )
         self.output["urban_areas"].write(gdf)
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+import shapely
+
+from pymetropolis.metro_common.area_filter import MAX_TILE_VERTICES, AreaFilter, split_area
+
+
+def large_area() -> shapely.MultiPolygon:
+    """Returns a MultiPolygon with many vertices: a detailed star with a hole and an island."""
+    angles = np.linspace(0, 2 * np.pi, 5_000, endpoint=False)
+    radius = 100 + 20 * np.sin(40 * angles)
+    star = shapely.Polygon(
+        np.column_stack((radius * np.cos(angles), radius * np.sin(angles))),
+        holes=[shapely.Point(0, 0).buffer(30).exterior.coords],
+    )
+    island = shapely.Point(200, 200).buffer(20, quad_segs=500)
+    return shapely.MultiPolygon([star, island])
+
+
+def random_lines(nb_lines: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    starts = rng.uniform(-150, 250, (nb_lines, 2))
+    ends = starts + rng.normal(0, 10, (nb_lines, 2))
+    return shapely.linestrings(np.stack((starts, ends), axis=1))
+
+
+def test_split_area():
+    """The tiles are small and cover exactly the area."""
+    area = large_area()
+    tiles = split_area(area)
+    assert len(tiles) > 1
+    assert (shapely.get_num_coordinates(tiles) <= MAX_TILE_VERTICES).all()
+    assert (shapely.get_type_id(tiles) == shapely.GeometryType.POLYGON).all()
+    assert shapely.union_all(tiles).symmetric_difference(area).area == pytest.approx(0, abs=1e-6)
+    assert shapely.area(tiles).sum() == pytest.approx(area.area)
+
+
+@pytest.mark.parametrize("nb_threads", [1, 3])
+def test_area_filter(nb_threads):
+    """The predicates are equal to the ones of shapely on the full area."""
+    area = large_area()
+    geoms = random_lines(5_000)
+    area_filter = AreaFilter(area, nb_threads)
+    np.testing.assert_array_equal(area_filter.intersects(geoms), shapely.intersects(area, geoms))
+    np.testing.assert_array_equal(area_filter.contains(geoms), shapely.contains(area, geoms))
@@ -0,0 +1,66 @@
+from datetime import timedelta
+
+import polars as pl
+import pytest
+
+from pymetropolis.metro_common import MetropyError
+from pymetropolis.metro_common.edge_index import MISSING, EdgeIndex
+
+EDGES = pl.DataFrame(
+    {
+        "edge_id": [12, 10, 11, 13],
+        "length": [1.5, 2.0, None, 4.25],
+        "lanes": pl.Series([1, 2, 3, None], dtype=pl.Int8),
+        "count": pl.Series([1, 2, 3, 4], dtype=pl.UInt32),
+        "urban": [True, False, None, True],
+        "time": [timedelta(seconds=s) for s in (1, 2, 3, 4)],
+    }
+)
+
+ROUTES = pl.Series("route", [[10, 11, 12], [], None, [13, 13, 10], [11]], dtype=pl.List(pl.Int64))
+
+
+def baseline_sum(routes: pl.Series, edges: pl.DataFrame, column: str) -> pl.Series:
+    """Sum of the edges' values along the routes, as computed before the edge index."""
+    return (
+        routes.to_frame()
+        .select(
+            pl.col(routes.name)
+            .list.eval(pl.element().replace_strict(edges["edge_id"], edges[column]))
+            .list.sum()
+        )
+        .to_series()
+    )
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+@pytest.mark.parametrize("column", ["length", "lanes", "count", "urban", "time"])
+def test_route_sums(column, sparse):
+    """Sums along routes are equal to the baseline polars expressions (values and dtypes)."""
+    edges = EDGES
+    routes = ROUTES
+    if sparse:
+        # Ids far apart so that the index uses a binary search instead of a lookup table.
+        edges = edges.with_columns(pl.col("edge_id") * 1_000_000)
+        routes = routes.list.eval(pl.element() * 1_000_000)
+    index = EdgeIndex(edges)
+    actual = index.routes(routes).sum(index.edges[column])
+    expected = baseline_sum(routes, edges, column)
+    assert actual.dtype == expected.dtype
+    assert actual.to_list() == expected.to_list()
+
+
+def test_gather():
+    index = EdgeIndex(EDGES)
+    edge_ids = pl.Series([13, 10, 10])
+    assert index.gather(edge_ids, "length").to_list() == [4.25, 2.0, 2.0]
+
+
+@pytest.mark.parametrize("edge_id", [9, 14, 1_000_000, MISSING])
+def test_missing_edge(edge_id):
+    """Edge ids which are not in the index raise an error (like `replace_strict`)."""
+    index = EdgeIndex(EDGES)
+    with pytest.raises(MetropyError):
+        index.routes(pl.Series([[10, edge_id]]))
+    with pytest.raises(MetropyError):
+        index.gather(pl.Series([edge_id]), "length")
@@ -0,0 +1,34 @@
+import networkx as nx
+import numpy as np
+import polars as pl
+import pytest
+
+from pymetropolis.metro_network.functions import largest_strongly_connected_component_mask
+
+
+def networkx_mask(df: pl.DataFrame) -> np.ndarray:
+    """Returns the mask of the edges in the largest strongly connected component, computed with
+    networkx."""
+    graph = nx.DiGraph()
+    graph.add_edges_from(zip(df["source"], df["target"]))
+    largest = max(nx.strongly_connected_components(graph), key=len)
+    return np.array([s in largest and t in largest for s, t in zip(df["source"], df["target"])])
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_largest_strongly_connected_component_mask(seed):
+    """The mask is equal to the one of networkx, with sparse and unsorted node ids."""
+    rng = np.random.default_rng(seed)
+    node_ids = rng.choice(10**9, size=300, replace=False)
+    edges = rng.integers(0, len(node_ids), size=(400, 2))
+    df = pl.DataFrame(
+        {
+            "source": pl.Series(node_ids[edges[:, 0]], dtype=pl.UInt64),
+            "target": pl.Series(node_ids[edges[:, 1]], dtype=pl.UInt64),
+        }
+    )
+    mask = largest_strongly_connected_component_mask(df)
+    expected = networkx_mask(df)
+    # The graph is sparse enough for the largest component not to include all the edges.
+    assert 0 < expected.sum() < len(df)
+    np.testing.assert_array_equal(mask, expected)
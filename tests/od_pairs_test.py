@@ -0,0 +1,75 @@
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from pymetropolis.metro_demand.routing.od_pairs import EdgeSnapper, identify_od_pairs
+
+CRS = "EPSG:2154"
+
+
+def grid_edges(size: int) -> gpd.GeoDataFrame:
+    """Returns the horizontal and vertical edges of a grid network with unit spacing."""
+    lines, sources, targets = list(), list(), list()
+    for i in range(size):
+        for j in range(size):
+            node = i * size + j
+            if j + 1 < size:
+                lines.append(shapely.LineString([(j, i), (j + 1, i)]))
+                sources.append(node)
+                targets.append(node + 1)
+            if i + 1 < size:
+                lines.append(shapely.LineString([(j, i), (j, i + 1)]))
+                sources.append(node)
+                targets.append(node + size)
+    return gpd.GeoDataFrame(
+        {"edge_id": np.arange(len(lines)), "source": sources, "target": targets},
+        geometry=lines,
+        crs=CRS,
+    )
+
+
+def points(coords: np.ndarray) -> gpd.GeoDataFrame:
+    return gpd.GeoDataFrame(
+        {"trip_id": np.arange(len(coords), dtype=np.uint64)},
+        geometry=shapely.points(coords),
+        crs=CRS,
+    )
+
+
+def test_snap():
+    """Points are snapped to the nearest edge and to its nearest node."""
+    edges = grid_edges(10)
+    rng = np.random.default_rng(0)
+    gdf = points(rng.uniform(0, 9, (1_000, 2)))
+    df = EdgeSnapper(edges).snap(gdf, nb_threads=2)
+    assert df["trip_id"].to_list() == gdf["trip_id"].tolist()
+    distances = shapely.distance(gdf.geometry.to_numpy()[:, None], edges.geometry.to_numpy())
+    np.testing.assert_allclose(df["edge_dist"].to_numpy(), distances.min(axis=1))
+    # The node is the nearest node of the grid (ties at equal distance excepted).
+    coords = shapely.get_coordinates(gdf.geometry)
+    node_dist = np.hypot(*(coords - np.round(coords)).T)
+    np.testing.assert_allclose(df["node_dist"].to_numpy(), node_dist)
+
+
+def test_snap_no_point():
+    """An empty DataFrame is returned when there is no point to snap."""
+    edges = grid_edges(3)
+    gdf = points(np.empty((0, 2)))
+    df = identify_od_pairs(edges, gdf, gdf, nb_threads=1)
+    assert df.is_empty()
+    assert "origin_node" in df.columns
+    assert "destination_edge" in df.columns
+
+
+def test_snap_empty_geometries():
+    """Points with empty geometries are not snapped and the other points keep their order."""
+    edges = grid_edges(10)
+    rng = np.random.default_rng(0)
+    gdf = points(rng.uniform(0, 9, (1_000, 2)))
+    expected = EdgeSnapper(edges).snap(gdf, nb_threads=2)
+    empty = rng.random(len(gdf)) < 0.2
+    gdf.loc[empty, "geometry"] = shapely.Point()
+    df = EdgeSnapper(edges).snap(gdf, nb_threads=2)
+    assert df["trip_id"].to_list() == gdf["trip_id"].tolist()
+    assert df["edge"].is_null().to_numpy().tolist() == empty.tolist()
+    assert df.filter(~empty).equals(expected.filter(~empty))
@@ -0,0 +1,218 @@
+import asyncio
+import threading
+from collections.abc import Callable
+from datetime import date, timedelta
+from pathlib import Path
+
+import geopandas as gpd
+import polars as pl
+import pytest
+from aiohttp import web
+
+from pymetropolis.metro_common import MetropyError
+from pymetropolis.metro_demand.routing import opentripplanner
+from pymetropolis.metro_demand.routing.opentripplanner import (
+    MAX_TRIES,
+    MIN_WINDOW,
+    AdaptiveLimit,
+    query_cache_directory,
+    round_coordinates,
+    run_queries,
+)
+
+URL = "http://0.0.0.0:8080"
+PARAMETERS = {"walkSpeed": 1.0, "transferCost": 300}
+
+
+def plan(variables: dict) -> dict:
+    """Returns the response of the stub OpenTripPlanner API to a query.
+
+    The least-cost itinerary takes one bus, with a duration depending on the origin latitude.
+    The other itinerary is faster but has a larger generalized cost.
+    """
+    duration = round(variables["originLat"] * 100)
+    bus = {
+        "mode": "BUS",
+        "duration": duration,
+        "route": {"gtfsId": "R1"},
+        "from": {"stop": {"gtfsId": "S1"}},
+        "to": {"stop": {"gtfsId": "S2"}},
+    }
+    walk = {"mode": "WALK", "duration": 1, "route": None, "from": None, "to": None}
+    return {
+        "data": {
+            "planConnection": {
+                "edges": [
+                    {
+                        "node": {
+                            "duration": 1,
+                            "generalizedCost": duration + 1_000,
+                            "waitingTime": 0,
+                            "legs": [walk],
+                        }
+                    },
+                    {
+                        "node": {
+                            "duration": duration,
+                            "generalizedCost": duration,
+                            "waitingTime": 10,
+                            "legs": [bus],
+                        }
+                    },
+                ]
+            }
+        }
+    }
+
+
+class StubServer:
+    """Stub OpenTripPlanner GraphQL API, running on a local port in a background thread."""
+
+    def __init__(self):
+        self.requests: list[dict] = list()
+        # Requests for which the server answers with an error.
+        self.failing: Callable[[dict], bool] = lambda variables: False
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        variables = (await request.json())["variables"]
+        self.requests.append(variables)
+        if self.failing(variables):
+            return web.Response(status=500)
+        return web.json_response(plan(variables))
+
+    async def setup(self) -> int:
+        app = web.Application()
+        app.router.add_post("/", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", 0).start()
+        return self.runner.addresses[0][1]
+
+    def start(self):
+        self.thread.start()
+        port = asyncio.run_coroutine_threadsafe(self.setup(), self.loop).result()
+        self.url = f"http://127.0.0.1:{port}/"
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+@pytest.fixture
+def otp_server(monkeypatch):
+    monkeypatch.setattr(opentripplanner, "RETRY_DELAY", 0.001)
+    server = StubServer()
+    server.start()
+    yield server
+    server.stop()
+
+
+def make_trips(origin_lats: list[float]) -> pl.DataFrame:
+    n = len(origin_lats)
+    return pl.DataFrame(
+        {
+            "trip_id": range(n),
+            "origin_lat": origin_lats,
+            "origin_lng": [2.3] * n,
+            "destination_lat": [48.9] * n,
+            "destination_lng": [2.4] * n,
+            "date": [date(2026, 5, 28)] * n,
+            "time": ["08:00:00"] * n,
+            "arrive_by": [False] * n,
+        }
+    )
+
+
+def test_run_queries(otp_server):
+    """The least-cost itinerary of each unique query is returned for all the trips, in order."""
+    trips = make_trips([48.3, 48.1, 48.3, 48.2, 48.1])
+    df = run_queries(trips, otp_server.url, PARAMETERS, max_concurrency=2)
+    assert len(otp_server.requests) == 3
+    assert df["trip_id"].to_list() == trips["trip_id"].to_list()
+    expected = [timedelta(seconds=round(lat * 100)) for lat in trips["origin_lat"]]
+    assert df["travel_time"].to_list() == expected
+    assert df["generalized_time"].to_list() == expected
+    assert df["waiting_time"].to_list() == [timedelta(seconds=10)] * len(trips)
+    assert df["legs"].list.eval(pl.element().struct.field("mode")).to_list() == [["BUS"]] * 5
+
+
+def test_run_queries_failure(otp_server):
+    """A request failing more than `MAX_TRIES` times raises an error."""
+    otp_server.failing = lambda variables: True
+    with pytest.raises(MetropyError, match="OpenTripPlanner request failed"):
+        run_queries(make_trips([48.1]), otp_server.url, PARAMETERS, max_concurrency=2)
+    assert len(otp_server.requests) == MAX_TRIES + 1
+
+
+def test_round_coordinates():
+    points = gpd.GeoSeries.from_xy([1_049.0, 951.0, -1_450.0], [2_051.0, 1_949.0, 0.0], crs=2154)
+    rounded = round_coordinates(points, 100.0)
+    assert rounded.x.tolist() == [1_000.0, 1_000.0, -1_400.0]
+    assert rounded.y.tolist() == [2_100.0, 1_900.0, 0.0]
+    assert rounded.crs == points.crs
+
+
+def test_run_queries_rounded_coordinates(otp_server):
+    """Trips whose origins are rounded to the same point share a single query."""
+    origins = gpd.GeoSeries.from_xy([652_100.0, 651_800.0], [6_862_300.0, 6_861_900.0], crs=2154)
+    origins = round_coordinates(origins, 1_000.0).to_crs("EPSG:4326")
+    trips = make_trips(origins.y.tolist()).with_columns(origin_lng=pl.Series(origins.x.tolist()))
+    df = run_queries(trips, otp_server.url, PARAMETERS)
+    assert len(otp_server.requests) == 1
+    assert df["trip_id"].to_list() == [0, 1]
+    assert df["legs"][0].to_list() == df["legs"][1].to_list()
+    assert [leg["route_id"] for leg in df["legs"][0]] == ["R1"]
+
+
+def test_adaptive_limit():
+    limit = AdaptiveLimit(8)
+    assert limit.limit == 4
+    limit.backoff()
+    assert limit.limit == 2
+    for _ in range(3):
+        limit.backoff()
+    assert limit.limit == 1
+    # The limit is increased after the first window of successful requests.
+    for _ in range(MIN_WINDOW):
+        limit.record()
+    assert limit.limit == 2
+    for _ in range(100 * MIN_WINDOW):
+        limit.record()
+        assert 1 <= limit.limit <= 8
+
+
+def test_run_queries_resume(otp_server, tmp_path: Path):
+    """An interrupted run resumes from the cache: only the missing queries are sent again."""
+    trips = make_trips([48.1, 48.2, 48.3])
+    # The run is interrupted by the failure of the last batch.
+    otp_server.failing = lambda variables: variables["originLat"] == 48.3
+    with pytest.raises(MetropyError):
+        run_queries(trips, otp_server.url, PARAMETERS, batch_size=1, cache_directory=tmp_path)
+    otp_server.failing = lambda variables: False
+    otp_server.requests.clear()
+    df = run_queries(trips, otp_server.url, PARAMETERS, batch_size=1, cache_directory=tmp_path)
+    assert [variables["originLat"] for variables in otp_server.requests] == [48.3]
+    # All the results are now in the cache.
+    otp_server.requests.clear()
+    df_cached = run_queries(trips, otp_server.url, PARAMETERS, cache_directory=tmp_path)
+    assert otp_server.requests == []
+    assert df_cached.equals(df)
+    assert df["travel_time"].to_list() == [timedelta(seconds=s) for s in (4810, 4820, 4830)]
+
+
+def test_query_cache_directory(tmp_path: Path):
+    """The cache directory depends on the query parameters and on the content of the GTFS files."""
+    gtfs = tmp_path / "gtfs.zip"
+    gtfs.write_bytes(b"first version")
+    directory = query_cache_directory(tmp_path, URL, PARAMETERS, [gtfs])
+    assert directory == query_cache_directory(tmp_path, URL, dict(PARAMETERS), [gtfs])
+    assert directory != query_cache_directory(tmp_path, URL, PARAMETERS)
+    assert directory != query_cache_directory(
+        tmp_path, URL, {**PARAMETERS, "transferCost": 0}, [gtfs]
+    )
+    gtfs.write_bytes(b"second version")
+    assert directory != query_cache_directory(tmp_path, URL, PARAMETERS, [gtfs])
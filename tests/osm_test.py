@@ -0,0 +1,76 @@
+import os
+import tempfile
+
+import pyproj
+
+from pymetropolis.metro_network.road_network.osm import OSMRoadNetworkImport
+from pymetropolis.metro_spatial.osm_data.osm import read_osm_areas, read_osm_data
+
+OSM_DATA = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" generator="test">
+  <node id="1" lat="0.0" lon="0.0"/>
+  <node id="2" lat="0.0" lon="0.01"/>
+  <node id="3" lat="0.01" lon="0.01"/>
+  <node id="4" lat="0.01" lon="0.0"/>
+  <node id="5" lat="0.02" lon="0.02"><tag k="highway" v="traffic_signals"/></node>
+  <way id="10">
+    <nd ref="1"/><nd ref="2"/><nd ref="3"/>
+    <tag k="highway" v="primary"/>
+  </way>
+  <way id="11">
+    <nd ref="3"/><nd ref="4"/>
+    <tag k="highway" v="primary"/><tag k="access" v="private"/>
+  </way>
+  <way id="12">
+    <nd ref="3"/><nd ref="5"/>
+    <tag k="highway" v="residential"/><tag k="access" v="destination"/>
+  </way>
+  <way id="13">
+    <nd ref="1"/><nd ref="2"/><nd ref="3"/><nd ref="4"/><nd ref="1"/>
+    <tag k="landuse" v="residential"/>
+  </way>
+  <way id="14">
+    <nd ref="1"/><nd ref="2"/><nd ref="3"/><nd ref="4"/><nd ref="1"/>
+    <tag k="landuse" v="forest"/>
+  </way>
+</osm>
+"""
+
+
+def read_test_data(function, *args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "data.osm")
+        with open(path, "w") as f:
+            f.write(OSM_DATA)
+        return function(path, *args)
+
+
+def test_read_osm_data():
+    ways, nodes = read_test_data(read_osm_data)
+    assert ways["osm_id"].to_list() == [10, 11, 12]
+    assert ways["highway"].to_list() == ["primary", "primary", "residential"]
+    assert ways["nodes"].to_list() == [[1, 2, 3], [3, 4], [3, 5]]
+    assert sorted(nodes["osm_id"].to_list()) == [1, 2, 3, 4, 5]
+    tagged = nodes.filter(nodes["tags"].is_not_null())
+    assert tagged["osm_id"].to_list() == [5]
+
+
+def test_read_osm_areas():
+    """Only the areas with the requested landuse tags are read."""
+    areas = read_test_data(read_osm_areas, ["residential"], None)
+    assert areas["landuse"].to_list() == ["residential"]
+
+
+def test_extra_way_filter():
+    """Ways rejected by `extra_way_filter` are not imported."""
+    ways, nodes = read_test_data(read_osm_data)
+    importer = OSMRoadNetworkImport(
+        ways.lazy(),
+        nodes.lazy(),
+        highway_tags=["primary", "residential"],
+        crs=pyproj.CRS("EPSG:3857"),
+        filter_polygon=None,
+        allowed_access_tags=["yes", "destination"],
+    )
+    ways, _ = importer.read_network_data()
+    assert sorted(ways["osm_id"].to_list()) == [10, 12]
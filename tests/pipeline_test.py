@@ -1,7 +1,16 @@
+import os
 import tempfile
 
+import pytest
+from loguru import logger
+
+from pymetropolis.metro_common import MetropyError
 from pymetropolis.metro_pipeline import Config, MetroFile, Step
-from pymetropolis.metro_pipeline.pipeline import MetroPipeline
+from pymetropolis.metro_pipeline.cache import ARTIFACT_CACHE
+from pymetropolis.metro_pipeline.file import IO_STATS, MetroDataFrameFile, MetroTxtFile
+from pymetropolis.metro_pipeline.parameters import PathParameter
+from pymetropolis.metro_pipeline.pipeline import MetroPipeline, StepStatus
+from pymetropolis.metro_pipeline.profile import print_profile, read_profiles, reset_peak_rss
 from pymetropolis.metro_pipeline.steps import InputFile
 
 
@@ -49,6 +58,51 @@ class D(Step):
     output_files = {"3": File3}
 
 
+class TxtFile1(MetroTxtFile):
+    path = "txt1.txt"
+
+
+class TxtFile2(MetroTxtFile):
+    path = "txt2.txt"
+
+
+class TxtFile3(MetroTxtFile):
+    path = "txt3.txt"
+
+
+class DataFrameFile(MetroDataFrameFile):
+    path = "df.parquet"
+
+
+class TxtA(Step):
+    output_files = {"1": TxtFile1}
+
+    def run(self):
+        self.output["1"].write("a")
+
+
+class TxtB(Step):
+    output_files = {"2": TxtFile2}
+
+    def run(self):
+        self.output["2"].write("b")
+
+
+class TxtFailingB(Step):
+    output_files = {"2": TxtFile2}
+
+    def run(self):
+        raise MetropyError("Failure")
+
+
+class TxtC(Step):
+    input_files = {"1": TxtFile1, "2": TxtFile2}
+    output_files = {"3": TxtFile3}
+
+    def run(self):
+        self.output["3"].write(self.input["1"].read() + self.input["2"].read())
+
+
 def test_basic_pipeline():
     """Basic pipeline with 3 steps:
 
@@ -98,3 +152,236 @@ def test_pipeline_with_conflict():
         assert len(sequence) == 3
         step_sequence = list(map(lambda x: x[0].__class__.__name__, sequence))
         assert step_sequence == ["A", "B", "Cter"] or step_sequence == ["B", "A", "Cter"]
+
+
+def test_step_dependencies():
+    """The dependencies of a Step are the Steps generating its input files."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = Config({"main_directory": tmp_dir})
+        pipeline = MetroPipeline(config, [A, B, C])
+        steps = [step for step, _ in pipeline.find_sequence()]
+        dependencies = pipeline.step_dependencies(steps)
+        step_names = {str(step): {str(s) for s in deps} for step, deps in dependencies.items()}
+        assert step_names == {"A": set(), "B": set(), "C": {"A", "B"}}
+
+
+def test_parallel_run():
+    """Steps TxtA and TxtB can be run in parallel, TxtC is run when both are done."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = Config({"main_directory": tmp_dir})
+        pipeline = MetroPipeline(config, [TxtA, TxtB, TxtC])
+        pipeline.run(jobs=2)
+        assert TxtFile3.from_dir(config.main_directory).read() == "ab"
+        # All steps are now up-to-date.
+        assert all(not step.update_required() for step, _ in pipeline.find_sequence())
+
+
+def test_parallel_run_with_failure():
+    """When TxtFailingB fails, TxtC is cancelled but TxtA is still run."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = Config({"main_directory": tmp_dir})
+        pipeline = MetroPipeline(config, [TxtA, TxtFailingB, TxtC])
+        with pytest.raises(MetropyError, match="TxtFailingB"):
+            pipeline.run(jobs=2)
+        assert TxtFile1.from_dir(config.main_directory).exists()
+        assert not TxtFile3.from_dir(config.main_directory).exists()
+
+
+def test_parallel_run_failure_traceback():
+    """The traceback of a Step failing in a worker process is logged by the main process."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = Config({"main_directory": tmp_dir})
+        pipeline = MetroPipeline(config, [TxtA, TxtFailingB, TxtC])
+        errors = list()
+        logger.add(errors.append, level="ERROR")
+        with pytest.raises(MetropyError):
+            pipeline.run(jobs=2)
+        out = "".join(errors)
+        assert "Traceback (most recent call last)" in out
+        assert 'raise MetropyError("Failure")' in out
+        assert "MetropyError: Failed to execute step `TxtFailingB`" in out
+
+
+def test_content_fingerprint_touch():
+    """With `content_fingerprint`, touching a file does not make the step outdated."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = Config({"main_directory": tmp_dir, "content_fingerprint": True})
+        pipeline = MetroPipeline(config, [TxtA, TxtB, TxtC])
+        pipeline.run()
+        path = TxtFile1.from_dir(config.main_directory).get_path()
+        os.utime(path, (0, 0))
+        assert all(not step.update_required() for step, _ in pipeline.find_sequence())
+        # Without `content_fingerprint`, the steps reading or writing the file are outdated.
+        config = Config({"main_directory": tmp_dir})
+        pipeline = MetroPipeline(config, [TxtA, TxtB, TxtC])
+        outdated = {str(step) for step, _ in pipeline.find_sequence() if step.update_required()}
+        assert outdated == {"TxtA", "TxtC"}
+
+
+def test_content_fingerprint_stops_invalidation():
+    """With `content_fingerprint`, a step is not run when its input files are re-generated with
+    the same content."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = Config({"main_directory": tmp_dir, "content_fingerprint": True})
+        MetroPipeline(config, [TxtA, TxtB, TxtC]).run()
+        path = TxtFile3.from_dir(config.main_directory).get_path()
+        os.utime(path, (0, 0))
+        pipeline = MetroPipeline(config, [TxtA, TxtB, TxtC], target_step="TxtA")
+        statuses = {str(step): status for step, status in pipeline.find_sequence()}
+        assert statuses["TxtC"] == StepStatus.INVALIDATED
+        pipeline.run()
+        # TxtC was not run so its output file was not re-written.
+        assert path.stat().st_mtime == 0
+
+
+class DirStep(Step):
+    data_dir = PathParameter("data_dir", check_dir_exists=True)
+    output_files = {"1": TxtFile1}
+
+    def run(self):
+        self.output["1"].write("a")
+
+
+@pytest.mark.parametrize("content_fingerprint", [False, True])
+def test_data_directory_modified(content_fingerprint):
+    """Editing a file inside a data directory makes the step reading that directory outdated."""
+    with tempfile.TemporaryDirectory() as tmp_dir, tempfile.TemporaryDirectory() as data_dir:
+        sub_dir = os.path.join(data_dir, "sub")
+        os.mkdir(sub_dir)
+        data_file = os.path.join(sub_dir, "data.txt")
+        with open(data_file, "w") as f:
+            f.write("a")
+        os.utime(data_dir, (0, 0))
+        os.utime(sub_dir, (0, 0))
+        os.utime(data_file, (0, 0))
+        config = Config(
+            {
+                "main_directory": tmp_dir,
+                "data_dir": data_dir,
+                "content_fingerprint": content_fingerprint,
+            }
+        )
+        step = DirStep(config)
+        step.execute(config)
+        assert not step.update_required()
+        # Editing a file does not change the modification time of the data directory itself.
+        with open(data_file, "w") as f:
+            f.write("b")
+        assert os.stat(data_dir).st_mtime == 0
+        assert step.update_required()
+
+
+def test_profile(capsys):
+    """Each executed step appends a record to the profile file."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = Config({"main_directory": tmp_dir})
+        MetroPipeline(config, [TxtA, TxtB, TxtC]).run()
+        records = {r["step"]: r for r in read_profiles(config.main_directory)}
+        assert set(records) == {"TxtA", "TxtB", "TxtC"}
+        assert records["TxtA"]["bytes_written"] == 1
+        assert records["TxtC"]["bytes_read"] == 2
+        assert records["TxtC"]["bytes_written"] == 2
+        assert records["TxtC"]["wall_time"] >= 0
+        print_profile(config.main_directory)
+        assert "Slowest steps" in capsys.readouterr().out
+
+
+class DataFrameA(Step):
+    output_files = {"df": DataFrameFile}
+
+    def run(self):
+        import polars as pl
+
+        self.output["df"].write(pl.DataFrame({"a": [1, 2, 3]}))
+
+
+class ScanFailingB(Step):
+    input_files = {"df": DataFrameFile}
+    output_files = {"2": TxtFile2}
+
+    def run(self):
+        self.input["df"].scan()
+        raise MetropyError("Failure")
+
+
+def test_profile_failed_step():
+    """A profile record is saved for a failed step, with the size of the files scanned."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = Config({"main_directory": tmp_dir})
+        with pytest.raises(MetropyError, match="ScanFailingB"):
+            MetroPipeline(config, [DataFrameA, ScanFailingB]).run()
+        records = {r["step"]: r for r in read_profiles(config.main_directory)}
+        size = DataFrameFile.from_dir(config.main_directory).get_path().stat().st_size
+        assert not records["DataFrameA"]["failed"]
+        assert records["DataFrameA"]["bytes_written"] == size
+        assert records["ScanFailingB"]["failed"]
+        assert records["ScanFailingB"]["bytes_read"] == size
+        assert records["ScanFailingB"]["output_rows"] == {}
+
+
+class HeavyA(Step):
+    output_files = {"1": TxtFile1}
+
+    def run(self):
+        data = bytearray(200 * 1024 * 1024)
+        data[::4096] = b"x" * len(data[::4096])
+        self.output["1"].write("a")
+
+
+@pytest.mark.skipif(not reset_peak_rss(), reason="the peak RSS cannot be reset")
+def test_profile_peak_rss_per_step():
+    """The peak RSS recorded for a step does not include the memory used by previous steps."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = Config({"main_directory": tmp_dir})
+        MetroPipeline(config, [HeavyA, TxtB]).run()
+        records = {r["step"]: r for r in read_profiles(config.main_directory)}
+        assert records["HeavyA"]["peak_rss"] - records["TxtB"]["peak_rss"] > 150 * 1024 * 1024
+
+
+def test_write_batches_failure():
+    """A failure while writing batches leaves the previous file untouched."""
+    import polars as pl
+
+    def batches():
+        yield pl.DataFrame({"a": [4, 5]})
+        raise ValueError("failure")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        f = DataFrameFile.from_dir(tmp_dir)
+        f.write(pl.DataFrame({"a": [1, 2, 3]}))
+        with pytest.raises(MetropyError):
+            f.write_batches(batches())
+        assert f.read()["a"].to_list() == [1, 2, 3]
+        assert os.listdir(tmp_dir) == ["df.parquet"]
+
+
+@pytest.fixture
+def artifact_cache():
+    """Restores the budget of the artifact cache and empties it at the end of the test."""
+    budget = ARTIFACT_CACHE.budget
+    yield ARTIFACT_CACHE
+    ARTIFACT_CACHE.set_budget(0)
+    ARTIFACT_CACHE.set_budget(budget)
+
+
+def test_memory_cache(artifact_cache):
+    """With a memory budget, DataFrames are read from memory until the file is modified."""
+    import polars as pl
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = Config({"main_directory": tmp_dir, "memory_cache_size": 1})
+        MetroPipeline(config, [A, B, C])
+        f = DataFrameFile.from_dir(config.main_directory)
+        df = pl.DataFrame({"a": [1, 2, 3]})
+        f.write(df)
+        bytes_read = IO_STATS["bytes_read"]
+        assert f.read().equals(df)
+        assert IO_STATS["bytes_read"] == bytes_read
+        # The file is modified outside of the MetroFile: the cached value is invalid.
+        pl.DataFrame({"a": [4, 5]}).write_parquet(f.get_path())
+        os.utime(f.get_path(), ns=(0, 0))
+        assert f.read()["a"].to_list() == [4, 5]
+        assert IO_STATS["bytes_read"] > bytes_read
+        # Values larger than the budget are not cached.
+        f.write(pl.DataFrame({"a": range(1_000_000)}))
+        assert artifact_cache.get(f.get_path()) is None
@@ -0,0 +1,193 @@
+import geopandas as gpd
+import numpy as np
+import polars as pl
+import shapely
+
+from pymetropolis.metro_network.road_network import (
+    RoadEdgesCleanFile,
+    RoadEdgesContractionFile,
+    RoadEdgesRawFile,
+)
+from pymetropolis.metro_network.road_network.postprocess import (
+    PostprocessRoadNetworkStep,
+    contract_nodes,
+    find_chains,
+    find_next_edges,
+)
+from pymetropolis.metro_pipeline import Config
+
+# Network with a one-way chain 0 -> 1 -> 2, a two-way road 2 <-> 3 <-> 4 and a one-way edge
+# 4 -> 5.
+# Node 1 (one incoming and one outgoing edge) and node 3 (two-way road) can be contracted.
+SOURCES = np.array([0, 1, 2, 3, 3, 4, 4])
+TARGETS = np.array([1, 2, 3, 2, 4, 3, 5])
+
+
+def test_find_next_edges():
+    next_edges = find_next_edges(SOURCES, TARGETS)
+    # 0 -> 1 is followed by 1 -> 2, 2 -> 3 by 3 -> 4 and 4 -> 3 by 3 -> 2.
+    assert next_edges.tolist() == [1, -1, 4, -1, -1, 3, -1]
+
+
+def test_find_chains():
+    chains, ranks = find_chains(np.array([1, -1, 4, -1, -1, 3, -1]))
+    assert chains.tolist() == [0, 0, 2, 5, 2, 5, 6]
+    assert ranks.tolist() == [0, 1, 0, 1, 1, 0, 0]
+
+
+def test_find_chains_cycle():
+    """The edges of a cycle are not merged."""
+    sources = np.array([0, 1, 2])
+    targets = np.array([1, 2, 0])
+    next_edges = find_next_edges(sources, targets)
+    assert next_edges.tolist() == [1, 2, 0]
+    chains, ranks = find_chains(next_edges)
+    assert chains.tolist() == [0, 1, 2]
+    assert ranks.tolist() == [0, 0, 0]
+
+
+def test_contract_nodes_no_edge():
+    edges = pl.DataFrame(
+        schema={
+            "edge_id": pl.UInt64,
+            "source": pl.UInt64,
+            "target": pl.UInt64,
+            "length": pl.Float64,
+            "geometry": pl.Binary,
+        }
+    )
+    merged, contraction = contract_nodes(edges, None)
+    assert merged.is_empty()
+    assert contraction.is_empty()
+    assert contraction.columns == ["edge_id", "original_edges"]
+
+
+# Toy road network with a one-way chain 10 -> 11 -> 12 (edges 0 and 1) and a two-way chain
+# 12 <-> 13 <-> 14 (edges 2 and 4 in one direction, 5 and 3 in the other), on the x axis.
+TOY_SOURCES = [10, 11, 12, 13, 13, 14]
+TOY_TARGETS = [11, 12, 13, 12, 14, 13]
+TOY_X = {10: 0.0, 11: 1.0, 12: 3.0, 13: 6.0, 14: 10.0, 15: 20.0}
+
+
+def toy_edges(sources: list[int] = TOY_SOURCES, targets: list[int] = TOY_TARGETS) -> pl.DataFrame:
+    n = len(sources)
+    geoms = [
+        shapely.LineString([(TOY_X[s], 0.0), ((TOY_X[s] + TOY_X[t]) / 2, 1.0), (TOY_X[t], 0.0)])
+        for s, t in zip(sources, targets)
+    ]
+    return pl.DataFrame(
+        {
+            "edge_id": pl.Series(range(n), dtype=pl.UInt64),
+            "source": pl.Series(sources, dtype=pl.UInt64),
+            "target": pl.Series(targets, dtype=pl.UInt64),
+            "length": [abs(TOY_X[t] - TOY_X[s]) for s, t in zip(sources, targets)],
+            "speed_limit": [50.0] * n,
+            "lanes": [1.0] * n,
+            "give_way": [False] * n,
+            "stop": [False] * n,
+            "traffic_signals": [False] * n,
+            "name": [f"road {i}" for i in range(n)],
+            "geometry": pl.Series(shapely.to_wkb(geoms), dtype=pl.Binary),
+        }
+    )
+
+
+def test_contract_nodes():
+    edges = toy_edges().with_columns(
+        # End-intersection features of the last edges of the chains.
+        give_way=pl.Series([False, True, False, False, False, False]),
+        stop=pl.Series([False, False, False, False, True, False]),
+    )
+    merged, contraction = contract_nodes(edges, None)
+    assert merged["edge_id"].to_list() == [0, 2, 5]
+    assert merged["source"].to_list() == [10, 12, 14]
+    assert merged["target"].to_list() == [12, 14, 12]
+    assert merged["length"].to_list() == [3.0, 7.0, 7.0]
+    assert merged["name"].to_list() == ["road 0", "road 2", "road 5"]
+    assert merged["give_way"].to_list() == [True, False, False]
+    assert merged["stop"].to_list() == [False, True, False]
+    geoms = shapely.from_wkb(merged["geometry"].to_numpy())
+    assert shapely.get_coordinates(geoms[0]).tolist() == [
+        [0.0, 0.0],
+        [0.5, 1.0],
+        [1.0, 0.0],
+        [2.0, 1.0],
+        [3.0, 0.0],
+    ]
+    assert shapely.get_coordinates(geoms[2]).tolist() == [
+        [10.0, 0.0],
+        [8.0, 1.0],
+        [6.0, 0.0],
+        [4.5, 1.0],
+        [3.0, 0.0],
+    ]
+    assert contraction["edge_id"].to_list() == [0, 2, 5]
+    assert contraction["original_edges"].to_list() == [[0, 1], [2, 4], [5, 3]]
+
+
+def test_contract_nodes_different_attributes():
+    """Edges with different speed limits are not merged."""
+    edges = toy_edges().with_columns(speed_limit=pl.Series([50.0, 30.0, 50.0, 50.0, 50.0, 50.0]))
+    merged, contraction = contract_nodes(edges, None)
+    assert merged["edge_id"].to_list() == [0, 1, 2, 5]
+    assert contraction["original_edges"].to_list() == [[0], [1], [2, 4], [5, 3]]
+
+
+def test_contract_nodes_signals():
+    """Edges are not merged through a node with traffic signals.
+
+    For a two-way road, the signals in one direction prevent merging the edges in both directions.
+    """
+    edges = toy_edges().with_columns(
+        traffic_signals=pl.Series([True, False, True, False, False, False])
+    )
+    merged, contraction = contract_nodes(edges, None)
+    assert merged.equals(edges)
+    assert contraction["original_edges"].to_list() == [[i] for i in range(6)]
+
+
+def test_postprocess_contraction_file(tmp_path):
+    """The contraction file only contains the clean edges, after the duplicate and disconnected
+    edges are removed.
+    """
+    # Edge 6 is parallel to the one-way chain (but longer), edge 7 connects node 12 to node 10 and
+    # edge 8 leads to a dead end.
+    sources = [*TOY_SOURCES, 10, 12, 14]
+    targets = [*TOY_TARGETS, 12, 10, 15]
+    edges = toy_edges(sources, targets).with_columns(
+        length=pl.Series([1.0, 2.0, 3.0, 3.0, 4.0, 4.0, 5.0, 3.0, 10.0])
+    )
+    raw_file = RoadEdgesRawFile.from_dir(tmp_path)
+    raw_file.create_dir_if_needed()
+    raw_file.write(
+        gpd.GeoDataFrame(
+            edges.drop("geometry").to_pandas(),
+            geometry=gpd.GeoSeries.from_wkb(edges["geometry"].to_numpy()),
+            crs=2154,
+        )
+    )
+    config = Config(
+        {
+            "main_directory": str(tmp_path),
+            "road_network": {
+                "contract_nodes": True,
+                "remove_duplicates": True,
+                "ensure_connected": True,
+            },
+        }
+    )
+    PostprocessRoadNetworkStep(config).run()
+    clean_edges = RoadEdgesCleanFile.from_dir(tmp_path).read()
+    assert sorted(clean_edges["edge_id"]) == [0, 2, 5, 7]
+    contraction = RoadEdgesContractionFile.from_dir(tmp_path).read()
+    assert contraction["edge_id"].to_list() == [0, 2, 5, 7]
+    assert contraction["original_edges"].to_list() == [[0, 1], [2, 4], [5, 3], [7]]
+
+
+def test_postprocess_no_contraction(tmp_path):
+    """The contraction file is not generated when the nodes are not contracted."""
+    for contract in (False, True):
+        config = Config(
+            {"main_directory": str(tmp_path), "road_network": {"contract_nodes": contract}}
+        )
+        assert ("contraction" in PostprocessRoadNetworkStep(config).output) == contract
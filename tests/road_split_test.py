@@ -0,0 +1,56 @@
+import numpy as np
+import polars as pl
+import pytest
+
+from pymetropolis.metro_demand.routing.road_split import find_first_last_primary, find_primary_edges
+
+
+def recursive_primary_edges(routes: pl.DataFrame, primary_edges: set) -> set:
+    """Previous (recursive) implementation of `find_primary_edges`."""
+    primary_idx = find_first_last_primary(routes, primary_edges)
+    secondary_edges_in_middle = set(
+        routes.lazy()
+        .join(primary_idx.lazy(), on="trip_id")
+        .select(
+            edge_id=pl.col("route").list.slice(
+                pl.col("first_idx_primary") - 1,
+                pl.col("last_idx_primary") - pl.col("first_idx_primary") + 1,
+            )
+        )
+        .explode("edge_id")
+        .filter(pl.col("edge_id").is_in(primary_edges).not_())
+        .collect()
+        .to_series()
+    )
+    if secondary_edges_in_middle:
+        return recursive_primary_edges(routes, primary_edges | secondary_edges_in_middle)
+    return primary_edges
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_find_primary_edges(seed):
+    """The primary edges are equal to the ones of the recursive implementation."""
+    rng = np.random.default_rng(seed)
+    nb_edges = 2_000
+    routes = pl.DataFrame(
+        {
+            "trip_id": np.arange(500),
+            "route": [rng.integers(0, nb_edges, rng.integers(0, 12)).tolist() for _ in range(500)],
+        },
+        schema={"trip_id": pl.UInt64, "route": pl.List(pl.UInt64)},
+    )
+    primary_edges = set(rng.choice(nb_edges, 20, replace=False).tolist())
+    expected = recursive_primary_edges(routes, set(primary_edges))
+    actual, timings = find_primary_edges(routes, set(primary_edges))
+    assert actual == expected
+    assert len(timings) >= 1
+
+
+def test_find_primary_edges_unknown_edge():
+    """Edges of the routes which are not in the initial edges can become primary."""
+    routes = pl.DataFrame(
+        {"trip_id": [1, 2], "route": [[1, 99, 2], [3, 4]]},
+        schema={"trip_id": pl.UInt64, "route": pl.List(pl.UInt64)},
+    )
+    actual, _ = find_primary_edges(routes, {1, 2, 4})
+    assert actual == {1, 2, 4, 99}
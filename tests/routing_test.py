@@ -0,0 +1,46 @@
+import networkx as nx
+import numpy as np
+import polars as pl
+
+from pymetropolis.metro_common.routing import compute_all_pairs_dijkstra
+
+
+def random_edges(nb_nodes: int, nb_edges: int, seed: int = 0) -> pl.DataFrame:
+    rng = np.random.default_rng(seed)
+    sources = rng.integers(0, nb_nodes, nb_edges)
+    targets = rng.integers(0, nb_nodes, nb_edges)
+    weights = rng.integers(0, 10, nb_edges).astype(np.float64)
+    # Duplicate some edges with a different weight to create parallel edges.
+    return pl.DataFrame(
+        {
+            "source": np.concatenate((sources, sources[:50])) * 10,
+            "target": np.concatenate((targets, targets[:50])) * 10,
+            "weight": np.concatenate((weights, weights[:50] + 1)),
+        }
+    ).filter(pl.col("source") != pl.col("target"))
+
+
+def test_all_pairs_dijkstra():
+    """The shortest-path weights are equal to the ones computed by networkx."""
+    edges = random_edges(200, 600)
+    graph = nx.DiGraph()
+    for s, t, w in edges.iter_rows():
+        if not graph.has_edge(s, t) or graph[s][t]["weight"] > w:
+            graph.add_edge(s, t, weight=w)
+    expected = {
+        (o, d): w
+        for o, dists in nx.all_pairs_dijkstra_path_length(graph, weight="weight")
+        for d, w in dists.items()
+    }
+    df = pl.concat(compute_all_pairs_dijkstra(edges, nb_threads=2, block_size=17))
+    assert df["origin_id"].dtype == edges["source"].dtype
+    actual = {(o, d): w for o, d, w in df.iter_rows()}
+    assert actual == expected
+
+
+def test_all_pairs_dijkstra_empty():
+    """An empty DataFrame is returned for a graph without edges."""
+    edges = pl.DataFrame(schema={"source": pl.UInt64, "target": pl.UInt64, "weight": pl.Float64})
+    df = pl.concat(compute_all_pairs_dijkstra(edges, nb_threads=1))
+    assert df.is_empty()
+    assert df.columns == ["origin_id", "destination_id", "weight"]